@@ -0,0 +1,184 @@
+"""统计聚合 - 每个user的层级/分类/每日写入/最近10条常驻内存，增量维护 + 定期对账"""
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from memory import TZ_CN, LEVEL_ORDER
+
+RECENT_SIZE = 10
+
+
+def _day(ts: int) -> str:
+    return datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%Y-%m-%d")
+
+
+def _recent_row(r: dict) -> dict:
+    return {
+        "id": r.get("id"),
+        "content": (r.get("content") or "")[:80],
+        "category": r.get("category"),
+        "memory_level": r.get("memory_level", "flash"),
+        "timestamp": r.get("timestamp", 0),
+    }
+
+
+class UserAggregate:
+
+    def __init__(self):
+        self.total = 0
+        self.levels = Counter({lv: 0 for lv in LEVEL_ORDER})
+        self.categories = Counter()
+        self.days = Counter()
+        self.recent = []            # 按timestamp倒序，最多RECENT_SIZE条
+        self.built_at = time.monotonic()
+        self.dirty = False
+
+    def add(self, r: dict):
+        self.total += 1
+        self.levels[r.get("memory_level", "flash")] += 1
+        self.categories[r.get("category", "未分类")] += 1
+        ts = r.get("timestamp", 0)
+        if ts:
+            self.days[_day(ts)] += 1
+        self._push_recent(r)
+
+    def _push_recent(self, r: dict):
+        ts = r.get("timestamp", 0)
+        if len(self.recent) >= RECENT_SIZE and ts <= self.recent[-1]["timestamp"]:
+            return
+        self.recent.append(_recent_row(r))
+        self.recent.sort(key=lambda x: x["timestamp"], reverse=True)
+        del self.recent[RECENT_SIZE:]
+
+    def remove(self, r: dict):
+        self.total = max(0, self.total - 1)
+        lv = r.get("memory_level", "flash")
+        self.levels[lv] = max(0, self.levels[lv] - 1)
+        cat = r.get("category", "未分类")
+        self.categories[cat] -= 1
+        if self.categories[cat] <= 0:
+            del self.categories[cat]
+        ts = r.get("timestamp", 0)
+        if ts:
+            self.days[_day(ts)] -= 1
+        before = len(self.recent)
+        self.recent = [x for x in self.recent if x["id"] != r.get("id")]
+        if len(self.recent) < before:
+            # 环形缓冲里少了一条，补位要回后端查，下次读取时对账
+            self.dirty = True
+
+    def set_level(self, doc_id: str, old: str, new: str):
+        self.levels[old] = max(0, self.levels[old] - 1)
+        self.levels[new] += 1
+        for x in self.recent:
+            if x["id"] == doc_id:
+                x["memory_level"] = new
+
+    def replace(self, old: dict, new: dict):
+        cat_old, cat_new = old.get("category", "未分类"), new.get("category", "未分类")
+        if cat_old != cat_new:
+            self.categories[cat_old] -= 1
+            if self.categories[cat_old] <= 0:
+                del self.categories[cat_old]
+            self.categories[cat_new] += 1
+        for x in self.recent:
+            if x["id"] == new.get("id"):
+                x.update({"content": (new.get("content") or "")[:80], "category": cat_new})
+
+    def _trend(self) -> dict:
+        now = datetime.now(TZ_CN)
+        trend = {}
+        for i in range(6, -1, -1):
+            d = now - timedelta(days=i)
+            trend[d.strftime("%m-%d")] = self.days.get(d.strftime("%Y-%m-%d"), 0)
+        return trend
+
+    @staticmethod
+    def _time(ts: int) -> str:
+        return datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%m-%d %H:%M") if ts else ""
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total, "levels": dict(self.levels), "trend": self._trend(),
+            "recent": [{
+                "category": r["category"] or "", "content": r["content"],
+                "time": self._time(r["timestamp"]),
+            } for r in self.recent],
+        }
+
+    def dashboard(self) -> dict:
+        return {
+            "total": self.total, "levels": dict(self.levels),
+            "categories": dict(self.categories), "trend": self._trend(),
+            "recent": [{
+                "id": r["id"], "content": r["content"], "category": r["category"],
+                "memory_level": r["memory_level"], "time": self._time(r["timestamp"]),
+            } for r in self.recent],
+        }
+
+
+class AggregateRegistry:
+    """user -> UserAggregate。超过 reconcile_interval 秒或被标脏的聚合在下次读取时整体重建"""
+
+    def __init__(self, reconcile_interval: float = 600.0):
+        self.reconcile_interval = reconcile_interval
+        self._users: Dict[str, UserAggregate] = {}
+        self._building: Dict[str, bool] = {}
+
+    def get(self, user: str) -> Optional[UserAggregate]:
+        agg = self._users.get(user)
+        if agg is None or agg.dirty:
+            return None
+        if time.monotonic() - agg.built_at > self.reconcile_interval:
+            return None
+        return agg
+
+    def cached(self) -> Dict[str, UserAggregate]:
+        """当前内存里的全部聚合，过期/标脏的也照样返回（层级计数一直是增量维护的），不触发重建"""
+        return dict(self._users)
+
+    def begin_build(self, user: str):
+        self._building[user] = False
+
+    def finish_build(self, user: str, agg: UserAggregate):
+        # 重建期间有增量事件落进来，结果可能漏算：先用着，把对账提前到一分钟内
+        if self._building.pop(user, False):
+            agg.built_at -= max(0.0, self.reconcile_interval - 60)
+        self._users[user] = agg
+
+    def _touch(self, user: str) -> Optional[UserAggregate]:
+        if user in self._building:
+            self._building[user] = True
+        return self._users.get(user)
+
+    def on_write(self, user: str, rows: list):
+        agg = self._touch(user)
+        if agg:
+            for r in rows:
+                agg.add(r)
+
+    def on_delete(self, rows: list):
+        for r in rows:
+            agg = self._touch(r.get("user", "default"))
+            if agg:
+                agg.remove(r)
+
+    def on_level(self, user: str, doc_id: str, old: str, new: str):
+        agg = self._touch(user)
+        if agg and old != new:
+            agg.set_level(doc_id, old, new)
+
+    def on_update(self, old: dict, new: dict):
+        agg = self._touch(old.get("user", "default"))
+        if agg:
+            agg.replace(old, new)
+
+    def invalidate(self, user: Optional[str] = None):
+        if user is None:
+            self._users.clear()
+            for u in self._building:
+                self._building[u] = True
+        else:
+            self._touch(user)
+            self._users.pop(user, None)
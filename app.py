@@ -1,4 +1,3 @@
-from collections import deque
 import subprocess
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,20 +6,15 @@ from pydantic import BaseModel
 from mcp.server.fastmcp import FastMCP
 from mcp.server.transport_security import TransportSecuritySettings
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import RedirectResponse, JSONResponse, Response, FileResponse
+from starlette.responses import RedirectResponse, JSONResponse, Response, FileResponse, StreamingResponse
 import json
 import os
-import time
-import bcrypt
-import urllib.request
-from urllib.parse import quote
+import zlib
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 load_dotenv()
 from typing import List
-from datetime import datetime, timedelta
-import cnlunar
+from datetime import datetime
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -28,6 +22,16 @@ from memory import TZ_CN, LEVEL_ORDER
 from store import ZillizMemoryStore, MemoryStore
 from loader import PluginLoader
 from skill import SkillManager
+from embedder import EmbeddingService
+from recall_queue import RecallQueue
+from perm_cache import PermanentCache
+from aggregates import AggregateRegistry
+from importer import ImportJob, IMPORT_BATCH
+from weather import WeatherService, PROVIDERS, format_weather
+from calendar_service import CalendarService
+from middleware import Credentials, PasswordHasher, HasherBusy, LoginLimiter, AuthMiddleware, RequestLogMiddleware
+import metrics
+import tracing
 
 # === 日志 ===
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
@@ -42,54 +46,30 @@ _ch.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(message)s',
 logger.addHandler(_ch)
 
 AUTH_FILE = os.path.join(os.path.dirname(__file__), ".auth")
+credentials = Credentials(AUTH_FILE, hasher=PasswordHasher(
+    workers=int(os.getenv("BCRYPT_WORKERS", "2")),
+    max_pending=int(os.getenv("BCRYPT_MAX_PENDING", "8")),
+))
+login_limiter = LoginLimiter(
+    max_attempts=int(os.getenv("LOGIN_MAX_ATTEMPTS", "5")),
+    window=float(os.getenv("LOGIN_WINDOW", "600")),
+    max_ips=int(os.getenv("LOGIN_MAX_IPS", "10000")),
+)
+EXPORT_CHUNK = 64 * 1024
 
 encoder = None
 store = None
 plugin_loader = None
 skill_manager = None
-login_attempts = {}
+weather = None
+calendar = None
+import_jobs = {}
 
 def get_password_hash():
-    if os.path.exists(AUTH_FILE):
-        with open(AUTH_FILE, "r") as f:
-            return f.read().strip()
-    return None
-
-def set_password_hash(password):
-    h = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
-    with open(AUTH_FILE, "w") as f:
-        f.write(h)
-
-class RequestLogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        start = time.time()
-        if request.url.path in ["/favicon.ico", "/health"]:
-            return await call_next(request)
-        response = await call_next(request)
-        duration = round((time.time() - start) * 1000, 1)
-        ip = request.client.host if request.client else "unknown"
-        level = logging.WARNING if response.status_code >= 400 else logging.INFO
-        logger.log(level, f"{request.method} {request.url.path} | {response.status_code} | {duration}ms | {ip}")
-        return response
-
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        public_paths = ["/plugins", "/api/plugins", "/login", "/setup", "/favicon.ico", "/health"]
-        if request.url.path in public_paths:
-            return await call_next(request)
-        if not get_password_hash():
-            if not request.url.path.startswith("/mcp"):
-                return RedirectResponse(url="/setup")
-        if request.url.path.startswith("/mcp") or request.url.path.startswith("/api"):
-            token = request.headers.get("Authorization", "").replace("Bearer ", "")
-            if token != os.getenv("MCP_TOKEN"):
-                return JSONResponse({"error": "Unauthorized"}, status_code=401)
-            return await call_next(request)
-        if not request.session.get("authed"):
-            if request.url.path.startswith("/api"):
-                return JSONResponse({"error": "Not logged in"}, status_code=401)
-            return RedirectResponse(url="/login")
-        return await call_next(request)
+    return credentials.password_hash()
+
+async def set_password_hash(password):
+    await credentials.set_password(password)
 
 class UTF8JSONResponse(JSONResponse):
     media_type = "application/json; charset=utf-8"
@@ -101,21 +81,74 @@ _skill_instructions = open(_skill_path, encoding="utf-8").read() if os.path.exis
 
 mcp_server = FastMCP("RecallDoggy", instructions=_skill_instructions or None, transport_security=TransportSecuritySettings(enable_dns_rebinding_protection=False))
 mcp_http_app = mcp_server.streamable_http_app()
+metrics.instrument_tools(mcp_server, lambda name: plugin_loader.plugin_of_tool(name) if plugin_loader else None)
 
 async def _startup():
-    global encoder, store, plugin_loader, skill_manager
+    global encoder, store, plugin_loader, skill_manager, weather, calendar
     logger.info("启动服务...")
     milvus_api_url = os.getenv("MILVUS_API_URL")
-    if milvus_api_url:
+    partial_update = os.getenv("MILVUS_PARTIAL_UPDATE", "1") != "0"
+    if os.getenv("STORE_BACKEND", "").lower() == "local":
+        from local_store import LocalMemoryStore
+        store = LocalMemoryStore(os.getenv("LOCAL_STORE_DIR", "./data"),
+                                 partial_update=partial_update)
+    elif milvus_api_url:
         from http_store import HttpMemoryStore
-        store = HttpMemoryStore(milvus_api_url, os.getenv("MILVUS_API_KEY", ""))
+        store = HttpMemoryStore(milvus_api_url, os.getenv("MILVUS_API_KEY", ""),
+                                partial_update=partial_update,
+                                scan_mode=os.getenv("MILVUS_SCAN_MODE", "cursor"),
+                                pool_size=int(os.getenv("MILVUS_POOL_SIZE", "20")),
+                                keepalive=int(os.getenv("MILVUS_KEEPALIVE", "10")),
+                                http2=os.getenv("MILVUS_HTTP2", "1") != "0",
+                                timeouts={
+                                    "search": float(os.getenv("MILVUS_TIMEOUT_SEARCH", "10")),
+                                    "write": float(os.getenv("MILVUS_TIMEOUT_WRITE", "60")),
+                                },
+                                retries=int(os.getenv("MILVUS_RETRIES", "2")),
+                                breaker_cooldown=float(os.getenv("MILVUS_BREAKER_COOLDOWN", "30")),
+                                wire_format=os.getenv("MILVUS_WIRE_FORMAT", "json"))
     else:
         store = ZillizMemoryStore(
             uri=os.getenv("ZILLIZ_URI"),
-            token=os.getenv("ZILLIZ_TOKEN")
+            token=os.getenv("ZILLIZ_TOKEN"),
+            partial_update=partial_update,
+            flush_policy=os.getenv("ZILLIZ_FLUSH_POLICY", "immediate"),
+            flush_interval=float(os.getenv("ZILLIZ_FLUSH_INTERVAL", "10")),
+            flush_rows=int(os.getenv("ZILLIZ_FLUSH_ROWS", "1000")),
+            consistency_level=os.getenv("ZILLIZ_CONSISTENCY") or None,
         )
-    encoder = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+    tier_mb = float(os.getenv("TIER_CACHE_MB", "0"))
+    if tier_mb > 0:
+        from tiered_store import TieredMemoryStore
+        store = TieredMemoryStore(store, budget_mb=tier_mb,
+                                  sync_interval=float(os.getenv("TIER_SYNC_INTERVAL", "30")))
+    store.recall_queue = RecallQueue(
+        store,
+        max_pending=int(os.getenv("RECALL_MAX_PENDING", "1000")),
+        batch_size=int(os.getenv("RECALL_BATCH_SIZE", "100")),
+        flush_interval=float(os.getenv("RECALL_FLUSH_INTERVAL", "2")),
+    )
+    store.perm_cache = PermanentCache(ttl=float(os.getenv("PERM_CACHE_TTL", "300")))
+    store.scan_page_size = int(os.getenv("SCAN_PAGE_SIZE", "1000"))
+    store.perm_margin = int(os.getenv("SEARCH_PERM_MARGIN", "10"))
+    tracing.configure(float(os.getenv("TRACE_SAMPLE_RATE", "0.01")),
+                      int(os.getenv("TRACE_BUFFER", "200")))
+    store.aggregates = AggregateRegistry(
+        reconcile_interval=float(os.getenv("AGG_RECONCILE_INTERVAL", "600"))
+    )
+    metrics.instrument_store(store)
+    calendar = CalendarService(store)
+    encoder = EmbeddingService(
+        SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2'),
+        max_batch_size=int(os.getenv("EMBED_MAX_BATCH", "32")),
+        max_wait_ms=float(os.getenv("EMBED_MAX_WAIT_MS", "5")),
+    )
     logger.info("模型加载成功")
+    weather = WeatherService(
+        PROVIDERS[os.getenv("WEATHER_PROVIDER", "wttr")](),
+        ttl=float(os.getenv("WEATHER_TTL", "600")),
+        stale_ttl=float(os.getenv("WEATHER_STALE_TTL", "3600")),
+    )
     plugin_loader = PluginLoader()
     plugin_loader.load_all(app, mcp_server)
     logger.info(f"已加载 {len(plugin_loader.plugins)} 个插件")
@@ -129,12 +162,17 @@ async def combined_lifespan(application):
         await _startup()
         await store.connect()
         yield
+        await store.close()
+        await encoder.stop()
+        await weather.close()
+        credentials.hasher.close()
 
 app = FastAPI(default_response_class=UTF8JSONResponse, lifespan=combined_lifespan)
-app.add_middleware(AuthMiddleware)
+app.add_middleware(AuthMiddleware, credentials=credentials)
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET", "recalldoggy-default-secret-change-me"), max_age=60*60*24*7)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-app.add_middleware(RequestLogMiddleware)
+app.add_middleware(RequestLogMiddleware,
+                   plugin_of=lambda route: plugin_loader.plugin_of_route(route) if plugin_loader else None)
 
 
 class WriteRequest(BaseModel):
@@ -143,10 +181,17 @@ class WriteRequest(BaseModel):
     tags: List[str] = []
     memory_level: str = "flash"
 
+class WriteBatchRequest(BaseModel):
+    items: List[WriteRequest]
+
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 5
 
+class SearchManyRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+
 class UpdateRequest(BaseModel):
     content: str
     category: str = "通用"
@@ -154,6 +199,7 @@ class UpdateRequest(BaseModel):
 
 class CleanupRequest(BaseModel):
     threshold: float = 0.05
+    dry_run: bool = False
 
 # === 认证路由 ===
 
@@ -171,7 +217,10 @@ async def do_setup(request: Request):
     pw = data.get("password", "")
     if len(pw) < 6:
         return {"success": False, "msg": "密码至少6位"}
-    set_password_hash(pw)
+    try:
+        await set_password_hash(pw)
+    except HasherBusy:
+        return {"success": False, "msg": "服务繁忙，请稍后再试"}
     request.session["authed"] = True
     return {"success": True}
 
@@ -199,29 +248,27 @@ async def login_page(request: Request):
 async def do_login(request: Request):
     data = await request.json()
     ip = request.client.host
-    now = time.time()
-    if ip not in login_attempts:
-        login_attempts[ip] = deque()
-    attempts = login_attempts[ip]
-    while attempts and now - attempts[0] > 600:
-        attempts.popleft()
-    if len(attempts) >= 5:
-        wait = int(600 - (now - attempts[0])) + 1
-        return {"success": False, "msg": f"尝试过多，{wait // 60 + 1}分钟后再试"}
+    wait = login_limiter.acquire(ip)
+    if wait:
+        return {"success": False, "msg": f"尝试过多，{int(wait) // 60 + 1}分钟后再试"}
     password = data.get("password", "")
-    stored_hash = get_password_hash()
-    if stored_hash and bcrypt.checkpw(password.encode(), stored_hash.encode()):
+    try:
+        ok = await credentials.verify(password)
+    except HasherBusy:
+        login_limiter.release(ip)
+        logger.warning(f"登录校验繁忙，拒绝 | IP:{ip}")
+        return {"success": False, "msg": "服务繁忙，请稍后再试"}
+    if ok:
         request.session["authed"] = True
-        login_attempts.pop(ip, None)
+        login_limiter.reset(ip)
         logger.info(f"登录成功 | IP:{ip}")
         return {"success": True}
     else:
-        attempts.append(now)
-        left = 5 - len(attempts)
-        logger.warning(f"登录失败 | IP:{ip} | 窗口内:{len(attempts)}次")
+        left = login_limiter.remaining(ip)
+        logger.warning(f"登录失败 | IP:{ip} | 窗口内:{login_limiter.max_attempts - left}次")
         if left > 0:
             return {"success": False, "msg": f"密码错误，还剩{left}次"}
-        return {"success": False, "msg": "尝试过多，10分钟后再试"}
+        return {"success": False, "msg": f"尝试过多，{int(login_limiter.window) // 60}分钟后再试"}
 
 @app.get("/logout")
 async def logout(request: Request):
@@ -232,13 +279,16 @@ async def logout(request: Request):
 @app.get("/health")
 async def health():
     cnt = await store.count() if store else 0
-    return {"status": "ok", "version": "1.6.0", "entities": cnt}
+    return {
+        "status": "ok", "version": "1.6.0", "entities": cnt,
+        "perm_cache": store.perm_cache.stats() if store else {},
+    }
 
 # === 核心API ===
 @app.post("/api/write")
 async def write_knowledge(req: WriteRequest):
     try:
-        embedding = encoder.encode(req.content).tolist()
+        embedding = await encoder.encode(req.content)
         return await store.write(
             content=req.content, embedding=embedding,
             category=req.category, tags=req.tags,
@@ -247,14 +297,41 @@ async def write_knowledge(req: WriteRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/write_batch")
+async def write_knowledge_batch(req: WriteBatchRequest):
+    try:
+        embeddings = await encoder.encode_many([it.content for it in req.items])
+        results = await store.write_many([
+            {"content": it.content, "embedding": emb, "category": it.category,
+             "tags": it.tags, "memory_level": it.memory_level}
+            for it, emb in zip(req.items, embeddings)
+        ])
+        return {"total": len(results),
+                "written": sum(r["status"] == "success" for r in results),
+                "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/search")
 async def search_knowledge(req: SearchRequest):
     try:
-        query_vec = encoder.encode(req.query).tolist()
+        query_vec = await encoder.encode(req.query)
         return await store.search(query_vec, req.top_k)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/search_many")
+async def search_many_knowledge(req: SearchManyRequest):
+    try:
+        vecs = await encoder.encode_many(req.queries)
+        res = await store.search_many(vecs, req.top_k)
+        return {
+            "results": [{"query": q, "results": r} for q, r in zip(req.queries, res["results"])],
+            "permanent": res["permanent"],
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/stats")
 async def stats_api():
     try:
@@ -281,7 +358,7 @@ async def list_knowledge(limit: int = 50, offset: int = 0):
 @app.put("/api/update/{doc_id}")
 async def update_knowledge(doc_id: str, req: UpdateRequest):
     try:
-        embedding = encoder.encode(req.content).tolist()
+        embedding = await encoder.encode(req.content)
         result = await store.update(doc_id, req.content, embedding, req.category, req.tags)
         if result is None:
             raise HTTPException(status_code=404, detail="记忆不存在")
@@ -308,13 +385,49 @@ async def set_level(doc_id: str, level: str):
 @app.post("/api/cleanup")
 async def cleanup(req: CleanupRequest):
     try:
-        deleted = await store.cleanup(req.threshold)
-        return {"message": f"已清理 {deleted} 条衰减记忆", "deleted": deleted}
+        res = await store.cleanup(req.threshold, dry_run=req.dry_run)
+        if req.dry_run:
+            return {"message": f"预计清理 {res['matched']} 条衰减记忆", **res}
+        return {"message": f"已清理 {res['deleted']} 条衰减记忆", **res}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _ndjson_export(gzip_out: bool, include_embedding: bool):
+    async def gen():
+        z = zlib.compressobj(wbits=31) if gzip_out else None
+        buf = []
+        size = 0
+        try:
+            async for item in store.export_iter(include_embedding=include_embedding):
+                line = (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+                buf.append(line)
+                size += len(line)
+                if size >= EXPORT_CHUNK:
+                    chunk = b"".join(buf)
+                    buf, size = [], 0
+                    yield z.compress(chunk) if z else chunk
+        except Exception as e:
+            # 继续抛出让分块响应异常结束，客户端能看出备份不完整，而不是拿到一个截断但格式完好的文件
+            logger.error(f"导出中断: {e}")
+            raise
+        chunk = b"".join(buf)
+        if z:
+            yield z.compress(chunk) + z.flush()
+        elif chunk:
+            yield chunk
+    return gen()
+
 @app.get("/api/export")
-async def export_all():
+async def export_all(format: str = "json", gzip: bool = False, embedding: bool = False):
+    if format == "ndjson":
+        fname = f"kb_export_{datetime.now(TZ_CN).strftime('%Y-%m-%d_%H%M')}.ndjson"
+        if gzip:
+            fname += ".gz"
+        return StreamingResponse(
+            _ndjson_export(gzip, embedding),
+            media_type="application/gzip" if gzip else "application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename={fname}"}
+        )
     try:
         items = await store.export_all()
         data = {
@@ -331,6 +444,30 @@ async def export_all():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/import")
+async def import_knowledge(request: Request, job_id: str = "", skip: int = 0,
+                           byte_offset: int = 0, batch_size: int = IMPORT_BATCH):
+    """请求体直接流式上传NDJSON（可gzip）或 /api/export 的JSON。
+    中断后用返回/查询到的 records 作为 skip 重传整个文件，
+    或（未压缩NDJSON）用 bytes 作为 byte_offset 只上传剩余部分，同时带上 skip=records 累计进度。
+    """
+    job = import_jobs.get(job_id) or ImportJob(job_id or None)
+    if job.status == "running" and job.id in import_jobs:
+        raise HTTPException(status_code=409, detail="该导入任务正在进行")
+    import_jobs[job.id] = job
+    while len(import_jobs) > 20:
+        import_jobs.pop(next(iter(import_jobs)))
+    return await job.run(store, encoder.encode_many, request.stream(),
+                         skip=skip, byte_offset=byte_offset,
+                         batch_size=max(1, min(batch_size, 5000)))
+
+@app.get("/api/import/{job_id}")
+async def import_progress(job_id: str):
+    job = import_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在")
+    return job.to_dict()
+
 @app.get("/api/logs")
 async def view_logs(lines: int = 100):
     log_file = os.path.join(LOG_DIR, "app.log")
@@ -340,6 +477,17 @@ async def view_logs(lines: int = 100):
         all_lines = f.readlines()
     return {"logs": all_lines[-lines:]}
 
+@app.get("/api/traces")
+async def list_traces(limit: int = 50, min_ms: float = 0, name: str = ""):
+    return {"sample_rate": tracing.sample_rate, "traces": tracing.recent(limit, min_ms, name)}
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    t = tracing.get(trace_id)
+    if t is None:
+        raise HTTPException(status_code=404, detail="trace不存在或已被挤出缓冲")
+    return t
+
 @app.get("/api/dashboard")
 async def dashboard_data():
     try:
@@ -347,78 +495,41 @@ async def dashboard_data():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/tier/status")
+async def tier_status():
+    status = getattr(store, "status", None)
+    if status is None:
+        return {"enabled": False}
+    return {"enabled": True, **status()}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 抓取入口；层级条数只读内存里已有的聚合（过期的原样报），抓取从不触发后端扫描。
+    还没被 /api/stats、dashboard 读过的user不出现"""
+    if store:
+        for user, agg in store.aggregates.cached().items():
+            for lv, n in agg.levels.items():
+                metrics.ENTITIES.labels(user, lv).set(n)
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 # === 天气 ===
 @app.get("/api/weather")
 async def weather_api(city: str = "天津"):
     try:
-        url = f"https://wttr.in/{quote(city)}?format=j1&lang=zh&m"
-        req = urllib.request.Request(url, headers={"User-Agent": "RecallDoggy/1.5"})
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode())
-        current = data.get("current_condition", [{}])[0]
-        forecast = data.get("weather", [])
-        result = {
-            "city": city,
-            "temp_C": current.get("temp_C"),
-            "feels_like": current.get("FeelsLikeC"),
-            "humidity": current.get("humidity"),
-            "desc": current.get("lang_zh", [{}])[0].get("value", current.get("weatherDesc", [{}])[0].get("value", "")),
-            "wind_speed": current.get("windspeedKmph"),
-            "wind_dir": current.get("winddir16Point"),
-        }
-        if forecast:
-            today = forecast[0]
-            result["max_temp"] = today.get("maxtempC")
-            result["min_temp"] = today.get("mintempC")
-        return result
+        return await weather.get(city)
     except Exception as e:
         return {"city": city, "error": str(e)}
 
 # === 日历 ===
-def _parse_lunar_festivals(a):
-    lunar_legal = a.get_legalHolidays()
-    lunar_other = a.get_otherHolidays()
-    if isinstance(lunar_legal, str):
-        lunar_legal = [lunar_legal] if lunar_legal else []
-    if isinstance(lunar_other, str):
-        lunar_other = [lunar_other] if lunar_other else []
-    return list(lunar_legal) + list(lunar_other)
-
 @app.get("/api/today")
 async def api_today():
-    now = datetime.now(TZ_CN).replace(tzinfo=None)
-    a = cnlunar.Lunar(now, godType='8char')
-    lunar_date = f"{a.lunarMonthCn}{a.lunarDayCn}"
-    ganzhi_year = a.year8Char
-    zodiac = a.chineseYearZodiac
-    weekdays = ["星期一","星期二","星期三","星期四","星期五","星期六","星期日"]
-    weekday = weekdays[now.weekday()]
-    solar_term = a.todaySolarTerms
-    if solar_term == "无":
-        solar_term = None
-    festivals = []
-    solar_festivals = {
-        "01-01":"元旦","02-14":"情人节","03-08":"妇女节",
-        "04-01":"愚人节","05-01":"劳动节","05-04":"青年节",
-        "06-01":"儿童节","09-10":"教师节","10-01":"国庆节",
-        "12-24":"平安夜","12-25":"圣诞节"
-    }
-    solar_key = now.strftime("%m-%d")
-    if solar_key in solar_festivals:
-        festivals.append(solar_festivals[solar_key])
-    lunar_festivals = _parse_lunar_festivals(a)
-    festivals.extend([f for f in lunar_festivals if f])
-    tomorrow = now + timedelta(days=1)
-    a_tomorrow = cnlunar.Lunar(tomorrow, godType='8char')
-    if a_tomorrow.lunarMonthCn == "正月" and a_tomorrow.lunarDayCn == "初一":
-        if "除夕" not in festivals:
-            festivals.append("除夕")
+    d = calendar.day()
     return {
-        "solar": now.strftime("%Y年%m月%d日"),
-        "weekday": weekday,
-        "lunar": f"{ganzhi_year}年（{zodiac}年）{lunar_date}",
-        "solar_term": solar_term,
-        "festivals": list(set(festivals))
+        "solar": d["solar"],
+        "weekday": d["weekday"],
+        "lunar": d["lunar"],
+        "solar_term": d["solar_term"],
+        "festivals": d["festivals"],
     }
 
 # === MCP工具 ===
@@ -433,10 +544,25 @@ async def mcp_search(query: str, top_k: int = 5) -> str:
     返回: permanent置顶记忆(不占top_k) + 按 similarity*0.7+retention*0.3 加权排序的结果。
     每条结果含 id/content/category/tags/similarity/memory_level/retention/recall_count。
     """
-    query_vec = encoder.encode(query).tolist()
+    query_vec = await encoder.encode(query)
     result = await store.search(query_vec, top_k)
     return json.dumps(result, ensure_ascii=False)
 
+@mcp_server.tool()
+async def mcp_search_many(queries: List[str], top_k: int = 5) -> str:
+    """一次搜索多个关键词（比如一个人、一个项目、一个日期），比连续调用多次 mcp_search 快。
+
+    queries: 关键词列表，每项的写法同 mcp_search 的 query，如 ["小墨生日", "RecallDoggy部署端口"]。
+    top_k: 每个关键词返回条数，默认5。
+    返回: results 按 queries 顺序分组，每组 {query, results}；permanent 置顶记忆只返回一份。
+    """
+    vecs = await encoder.encode_many(queries)
+    res = await store.search_many(vecs, top_k)
+    return json.dumps({
+        "results": [{"query": q, "results": r} for q, r in zip(queries, res["results"])],
+        "permanent": res["permanent"],
+    }, ensure_ascii=False)
+
 @mcp_server.tool()
 async def mcp_write(content: str, category: str = "通用", tags: str = "", memory_level: str = "flash") -> str:
     """向记忆库写入一条记忆。
@@ -455,7 +581,7 @@ async def mcp_write(content: str, category: str = "通用", tags: str = "", memo
       拿不准就用flash，系统会根据召回次数自动升级。
     返回写入结果含id。相同内容MD5去重不会重复写入。
     """
-    embedding = encoder.encode(content).tolist()
+    embedding = await encoder.encode(content)
     tag_list = [t.strip() for t in tags.split(",") if t.strip()] if tags else []
     level = memory_level
     if category == "纪念日":
@@ -463,6 +589,30 @@ async def mcp_write(content: str, category: str = "通用", tags: str = "", memo
     result = await store.write(content, embedding, category, tag_list, level)
     return json.dumps(result, ensure_ascii=False)
 
+@mcp_server.tool()
+async def mcp_write_batch(items: List[dict]) -> str:
+    """批量写入多条记忆，一次编码一次插入。导入大量记忆时用它，不要循环调 mcp_write。
+
+    items: 列表，每项是 {"content": ..., "category": ..., "tags": "a,b", "memory_level": ...}，
+      字段含义和取值规则与 mcp_write 相同，只有 content 必填。
+    返回: 每条的写入状态（success / exists 已在库中 / duplicate 批内重复）及id。
+    """
+    docs = []
+    for it in items:
+        tags = it.get("tags", "")
+        if isinstance(tags, str):
+            tags = [t.strip() for t in tags.split(",") if t.strip()]
+        category = it.get("category", "通用")
+        docs.append({
+            "content": it["content"], "category": category, "tags": tags,
+            "memory_level": "permanent" if category == "纪念日" else it.get("memory_level", "flash"),
+        })
+    embeddings = await encoder.encode_many([d["content"] for d in docs])
+    for d, emb in zip(docs, embeddings):
+        d["embedding"] = emb
+    results = await store.write_many(docs)
+    return json.dumps(results, ensure_ascii=False)
+
 @mcp_server.tool()
 async def mcp_delete(doc_id: str) -> str:
     """删除一条记忆。
@@ -481,40 +631,17 @@ async def mcp_stats() -> str:
 @mcp_server.tool()
 async def mcp_today() -> str:
     """获取今天的日期信息：公历、农历、干支、生肖、节气、节日、自定义纪念日。无需任何参数。"""
-    now = datetime.now(TZ_CN).replace(tzinfo=None)
-    a = cnlunar.Lunar(now, godType='8char')
-    lunar_date = f"{a.lunarMonthCn}{a.lunarDayCn}"
-    ganzhi_year = a.year8Char
-    zodiac = a.chineseYearZodiac
-    weekdays = ["星期一","星期二","星期三","星期四","星期五","星期六","星期日"]
-    weekday = weekdays[now.weekday()]
-    solar_term = a.todaySolarTerms
-    if solar_term == "无":
-        solar_term = None
-    festivals = []
-    solar_festivals = {"01-01":"元旦","02-14":"情人节","03-08":"妇女节","04-01":"愚人节","05-01":"劳动节","05-04":"青年节","06-01":"儿童节","09-10":"教师节","10-01":"国庆节","12-24":"平安夜","12-25":"圣诞节"}
-    solar_key = now.strftime("%m-%d")
-    if solar_key in solar_festivals:
-        festivals.append(solar_festivals[solar_key])
-    lunar_festivals = _parse_lunar_festivals(a)
-    festivals.extend([f for f in lunar_festivals if f])
-    custom = []
+    d = calendar.day()
     try:
-        res = await store.query_by_category("纪念日", ["content", "tags"], 100)
-        for item in res:
-            tags = item.get("tags", "").split(",")
-            for tag in tags:
-                tag = tag.strip()
-                if tag == solar_key or tag in lunar_date:
-                    custom.append(item["content"])
+        custom = await calendar.anniversaries()
     except Exception:
-        pass
-    lines_out = [f"📅 {now.strftime('%Y年%m月%d日')} {weekday}"]
-    lines_out.append(f"🏮 农历：{ganzhi_year}年（{zodiac}年）{lunar_date}")
-    if solar_term:
-        lines_out.append(f"🌿 节气：{solar_term}")
-    if festivals:
-        lines_out.append(f"🎉 节日：{' / '.join(set(festivals))}")
+        custom = []
+    lines_out = [f"📅 {d['solar']} {d['weekday']}"]
+    lines_out.append(f"🏮 农历：{d['lunar']}")
+    if d["solar_term"]:
+        lines_out.append(f"🌿 节气：{d['solar_term']}")
+    if d["festivals"]:
+        lines_out.append(f"🎉 节日：{' / '.join(d['festivals'])}")
     if custom:
         lines_out.append(f"💝 纪念日：{' / '.join(custom)}")
     return "\n".join(lines_out)
@@ -527,18 +654,7 @@ async def mcp_weather(city: str) -> str:
     返回: 温度、体感温度、湿度、天气描述、今日温度范围。
     """
     try:
-        url = f"https://wttr.in/{quote(city)}?format=j1&lang=zh&m"
-        req = urllib.request.Request(url, headers={"User-Agent": "RecallDoggy/1.5"})
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode())
-        current = data.get("current_condition", [{}])[0]
-        forecast = data.get("weather", [])
-        desc = current.get("lang_zh", [{}])[0].get("value", "")
-        result = f"🌡️ {city}: {current.get('temp_C')}°C（体感{current.get('FeelsLikeC')}°C）| {desc} | 湿度{current.get('humidity')}%"
-        if forecast:
-            today = forecast[0]
-            result += f" | 今日{today.get('mintempC')}~{today.get('maxtempC')}°C"
-        return result
+        return format_weather(await weather.get(city))
     except Exception as e:
         return f"天气获取失败: {e}"
 
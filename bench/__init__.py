@@ -0,0 +1 @@
+"""离线基准 - 假编码器 + 可注入延迟的内存存储，驱动MCP工具与HTTP接口，输出JSON报告"""
@@ -0,0 +1,180 @@
+"""基准入口 - python -m bench --rows 10000 --concurrency 8 --out bench.json
+
+不加载真实模型、不连真实后端：FakeEncoder + 内存版 InstrumentedStore，
+可用 --latency-ms / --latency 名称=毫秒 模拟后端往返。结果为JSON，便于跨提交对比。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import bcrypt
+import httpx
+import numpy as np
+
+from bench import scenarios
+from bench.fakes import FakeEncoder, InstrumentedStore, populate
+
+BENCH_TOKEN = "bench-token"
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+
+def _peak_rss_mb() -> float:
+    # Linux 上 ru_maxrss 单位是KB，macOS 是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _summary(latencies: list, wall: float, errors: int) -> dict:
+    ms = np.asarray(latencies) * 1000
+    if not len(ms):
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(ms), "errors": errors,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_rps": round(len(ms) / wall, 2) if wall else 0.0,
+    }
+
+
+async def drive(op, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    todo = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in todo:
+            t = time.perf_counter()
+            try:
+                await op(i)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    logging.getLogger("recalldoggy").error(f"基准请求失败: {e!r}")
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return _summary(latencies, time.perf_counter() - start, errors)
+
+
+def _parse_overrides(items: list) -> dict:
+    out = {}
+    for it in items or []:
+        name, _, ms = it.partition("=")
+        out[name.strip()] = float(ms)
+    return out
+
+
+async def main(args) -> dict:
+    import app as app_module
+    from recall_queue import RecallQueue
+
+    logging.getLogger("recalldoggy").setLevel(getattr(logging, args.log_level))
+
+    store = InstrumentedStore(args.latency_ms, _parse_overrides(args.latency))
+    await store.connect()
+    t = time.perf_counter()
+    await populate(store, args.rows, seed=args.seed)
+    seed_s = time.perf_counter() - t
+    if not args.no_recall_queue:
+        store.recall_queue = RecallQueue(store)
+    encoder = FakeEncoder(args.encode_ms)
+    app_module.store, app_module.encoder = store, encoder
+
+    # HTTP场景走完整中间件栈：临时密码文件 + Bearer token
+    auth = tempfile.NamedTemporaryFile("w", delete=False)
+    auth.write(bcrypt.hashpw(b"bench", bcrypt.gensalt(4)).decode())
+    auth.close()
+    app_module.credentials.path = auth.name
+    os.environ["MCP_TOKEN"] = BENCH_TOKEN
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app),
+                               base_url="http://bench",
+                               headers={"Authorization": f"Bearer {BENCH_TOKEN}"},
+                               timeout=None)
+
+    ops = scenarios.build(app_module, client, args.export_format, args.cleanup_threshold)
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    report = {
+        "commit": _commit(),
+        "config": {
+            "rows": args.rows, "concurrency": args.concurrency, "requests": args.requests,
+            "heavy_requests": args.heavy_requests, "latency_ms": args.latency_ms,
+            "latency_overrides": _parse_overrides(args.latency), "encode_ms": args.encode_ms,
+            "recall_queue": not args.no_recall_queue, "export_format": args.export_format,
+        },
+        "seed_seconds": round(seed_s, 2),
+        "scenarios": {},
+    }
+    try:
+        for name in names:
+            if name not in ops:
+                raise SystemExit(f"未知场景: {name}（可选 {', '.join(ops)}）")
+            n = args.heavy_requests if name in scenarios.HEAVY else args.requests
+            store.calls.clear()
+            store.busy = 0.0
+            batches0, texts0 = encoder.batches, encoder.texts
+            result = await drive(ops[name], n, args.concurrency)
+            if store.recall_queue is not None:
+                await store.recall_queue.flush()
+            result["backend_calls"] = dict(sorted(store.calls.items()))
+            result["backend_calls_per_request"] = round(
+                sum(store.calls.values()) / max(1, result["requests"]), 2)
+            result["backend_busy_ms"] = round(store.busy * 1000, 1)
+            result["encoder"] = {"batches": encoder.batches - batches0,
+                                 "texts": encoder.texts - texts0}
+            report["scenarios"][name] = result
+    finally:
+        await client.aclose()
+        await store.close()
+        os.unlink(auth.name)
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+
+def cli(argv=None) -> dict:
+    p = argparse.ArgumentParser(prog="python -m bench", description="RecallDoggy 离线基准")
+    p.add_argument("--rows", type=int, default=10000, help="预置行数（1k~1M）")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--requests", type=int, default=200, help="轻场景（search/write）每场景请求数")
+    p.add_argument("--heavy-requests", type=int, default=5, help="全表场景（dashboard/cleanup/export）请求数")
+    p.add_argument("--scenarios", default="mcp_search,mcp_write,dashboard,cleanup,export")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="每次后端调用注入的延迟")
+    p.add_argument("--latency", action="append", metavar="名称=毫秒",
+                   help="按调用名覆盖延迟，如 _ann_search_many=8 scan=3，可重复")
+    p.add_argument("--encode-ms", type=float, default=0.0, help="假编码器每批耗时")
+    p.add_argument("--export-format", default="ndjson", choices=["json", "ndjson"])
+    p.add_argument("--cleanup-threshold", type=float, default=0.05)
+    p.add_argument("--no-recall-queue", action="store_true", help="召回同步写回（不挂 RecallQueue）")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    p.add_argument("--out", help="报告写入该文件（默认只打印）")
+    args = p.parse_args(argv)
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    cli()
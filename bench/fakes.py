@@ -0,0 +1,119 @@
+"""基准用替身 - 确定性假编码器、带调用计数与延迟注入的内存存储、批量造数"""
+import asyncio
+import contextvars
+import hashlib
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from local_store import LocalMemoryStore
+from memory import LEVEL_ORDER, now_ms
+from store import EMBEDDING_DIM
+
+# 被计数/注入延迟的存储调用：后端原语 + 直接打后端的读接口
+INSTRUMENTED = [
+    "_query_ids", "_insert_rows", "_upsert_rows", "_delete_ids", "_query_permanent",
+    "_ann_search_many", "get_by_id", "list_all", "count", "query_by_category",
+]
+_inside = contextvars.ContextVar("bench_inside", default=False)
+CATEGORIES = ["通用", "技术", "生活", "学习", "人物", "项目", "纪念日"]
+
+
+def fake_vector(text: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class FakeEncoder:
+    """与 EmbeddingService 同接口；同一文本永远得到同一向量。encode_ms 模拟每批推理耗时"""
+
+    def __init__(self, encode_ms: float = 0.0):
+        self.encode_ms = encode_ms
+        self.batches = 0
+        self.texts = 0
+
+    async def encode(self, text: str) -> list:
+        return (await self.encode_many([text]))[0]
+
+    async def encode_many(self, texts: List[str]) -> List[list]:
+        self.batches += 1
+        self.texts += len(texts)
+        if self.encode_ms:
+            await asyncio.sleep(self.encode_ms / 1000)
+        return [fake_vector(t).tolist() for t in texts]
+
+    async def stop(self):
+        pass
+
+
+class InstrumentedStore(LocalMemoryStore):
+    """内存版 LocalMemoryStore：每个后端调用计数，并按 latency_ms（可按调用名覆盖）睡眠模拟网络往返。
+    只统计最外层调用（list_all 内部的 count 不重复计）；scan 按页计数与注入延迟"""
+
+    def __init__(self, latency_ms: float = 0.0, overrides: Optional[Dict[str, float]] = None):
+        super().__init__(":memory:")
+        self.latency_ms = latency_ms
+        self.overrides = overrides or {}
+        self.calls: Counter = Counter()
+        self.busy = 0.0
+        for name in INSTRUMENTED:
+            setattr(self, name, self._wrap(name, getattr(self, name)))
+
+    async def _delay(self, name: str):
+        ms = self.overrides.get(name, self.latency_ms)
+        if ms:
+            await asyncio.sleep(ms / 1000)
+
+    def _wrap(self, name, fn):
+        async def call(*args, **kwargs):
+            if _inside.get():
+                return await fn(*args, **kwargs)
+            self.calls[name] += 1
+            await self._delay(name)
+            token = _inside.set(True)
+            t = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.busy += time.perf_counter() - t
+                _inside.reset(token)
+        return call
+
+    async def scan(self, expr, fields, page_size=None):
+        self.calls["scan"] += 1
+        async for page in super().scan(expr, fields, page_size):
+            self.calls["scan_page"] += 1
+            await self._delay("scan")
+            yield page
+
+
+async def populate(store: LocalMemoryStore, rows: int, user: str = "default",
+                   seed: int = 0, chunk: int = 10000) -> None:
+    """批量造数，时间/层级/召回次数/分类随机分布。造完后调用方应清零调用统计"""
+    rng = np.random.default_rng(seed)
+    now = now_ms()
+    levels = np.array(LEVEL_ORDER, dtype=object)
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        vecs = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        ts = now - rng.integers(0, 60 * 86400 * 1000, n)
+        lr = ts + rng.integers(0, 7 * 86400 * 1000, n)
+        lv = levels[rng.choice(len(LEVEL_ORDER), n, p=[0.6, 0.25, 0.12, 0.03])]
+        rc = rng.integers(0, 12, n)
+        cats = rng.integers(0, len(CATEGORIES), n)
+        batch = []
+        for i in range(n):
+            k = start + i
+            batch.append({
+                "id": hashlib.md5(f"bench-{seed}-{k}".encode()).hexdigest(),
+                "embedding": vecs[i], "content": f"基准记忆 {k} " + "示例文本" * 8,
+                "category": CATEGORIES[cats[i]], "tags": "bench",
+                "timestamp": int(ts[i]), "memory_level": lv[i],
+                "recall_count": int(rc[i]), "last_recall": int(min(lr[i], now)),
+                "user": user,
+            })
+        await store._insert_rows(batch)
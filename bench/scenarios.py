@@ -0,0 +1,46 @@
+"""基准场景 - 每个场景给出一次请求的协程工厂：MCP工具直接调用，HTTP接口走完整ASGI中间件栈"""
+import json
+from typing import Awaitable, Callable, Dict
+
+import httpx
+
+Op = Callable[[int], Awaitable[None]]
+
+QUERIES = ["部署端口", "生日", "项目进度", "学习计划", "周末安排", "纪念日", "技术方案", "朋友近况"]
+
+
+def _check(r: httpx.Response):
+    if r.status_code >= 400:
+        raise RuntimeError(f"{r.request.method} {r.request.url.path} -> {r.status_code}")
+
+
+def build(app_module, client: httpx.AsyncClient, export_format: str = "ndjson",
+          cleanup_threshold: float = 0.05) -> Dict[str, Op]:
+
+    async def mcp_search(i: int):
+        json.loads(await app_module.mcp_search(f"{QUERIES[i % len(QUERIES)]} {i % 97}", 5))
+
+    async def mcp_write(i: int):
+        json.loads(await app_module.mcp_write(f"基准写入 {i} {id(client)}", "通用", "bench"))
+
+    async def dashboard(i: int):
+        _check(await client.get("/api/dashboard"))
+
+    async def cleanup(i: int):
+        # 预演：只扫描+算衰减，不删除，保证每轮面对同样的数据量
+        _check(await client.post("/api/cleanup", json={"threshold": cleanup_threshold, "dry_run": True}))
+
+    async def export(i: int):
+        async with client.stream("GET", "/api/export", params={"format": export_format}) as r:
+            _check(r)
+            async for _ in r.aiter_bytes():
+                pass
+
+    return {
+        "mcp_search": mcp_search, "mcp_write": mcp_write,
+        "dashboard": dashboard, "cleanup": cleanup, "export": export,
+    }
+
+
+# 重场景（全表扫描）默认只跑少量请求
+HEAVY = {"dashboard", "cleanup", "export"}
@@ -0,0 +1,188 @@
+"""日历服务 - 公历/农历/节气/节日按上海自然日算一次、缓存到零点；纪念日按 MM-DD 与农历日建内存索引，随写入/更新/删除增量维护"""
+import asyncio
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import cnlunar
+
+from memory import TZ_CN
+
+ANNIV_CATEGORY = "纪念日"
+ANNIV_LIMIT = 1000
+WEEKDAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+SOLAR_FESTIVALS = {
+    "01-01": "元旦", "02-14": "情人节", "03-08": "妇女节",
+    "04-01": "愚人节", "05-01": "劳动节", "05-04": "青年节",
+    "06-01": "儿童节", "09-10": "教师节", "10-01": "国庆节",
+    "12-24": "平安夜", "12-25": "圣诞节",
+}
+_SOLAR_TAG = re.compile(r"^\d{2}-\d{2}$")
+
+
+def _parse_lunar_festivals(a):
+    lunar_legal = a.get_legalHolidays()
+    lunar_other = a.get_otherHolidays()
+    if isinstance(lunar_legal, str):
+        lunar_legal = [lunar_legal] if lunar_legal else []
+    if isinstance(lunar_other, str):
+        lunar_other = [lunar_other] if lunar_other else []
+    return list(lunar_legal) + list(lunar_other)
+
+
+def compute_day(now: datetime) -> dict:
+    """now 为上海时间（naive）。两次 cnlunar.Lunar：今天 + 明天（判断除夕）"""
+    a = cnlunar.Lunar(now, godType='8char')
+    lunar_date = f"{a.lunarMonthCn}{a.lunarDayCn}"
+    solar_term = a.todaySolarTerms
+    if solar_term == "无":
+        solar_term = None
+    solar_key = now.strftime("%m-%d")
+    festivals = []
+    if solar_key in SOLAR_FESTIVALS:
+        festivals.append(SOLAR_FESTIVALS[solar_key])
+    festivals.extend(f for f in _parse_lunar_festivals(a) if f)
+    a_tomorrow = cnlunar.Lunar(now + timedelta(days=1), godType='8char')
+    # lunarMonthCn 带大小月后缀（"正月大"），只比前缀
+    if a_tomorrow.lunarMonthCn.startswith("正月") and a_tomorrow.lunarDayCn == "初一":
+        festivals.append("除夕")
+    return {
+        "date": now.date(),
+        "solar": now.strftime("%Y年%m月%d日"),
+        "solar_key": solar_key,
+        "weekday": WEEKDAYS[now.weekday()],
+        "lunar_date": lunar_date,
+        "lunar": f"{a.year8Char}年（{a.chineseYearZodiac}年）{lunar_date}",
+        "solar_term": solar_term,
+        "festivals": list(dict.fromkeys(festivals)),
+    }
+
+
+class _UserAnniversaries:
+    """doc_id -> content，按标签分两张表：MM-DD 精确匹配；其余标签按"是农历日期的子串"匹配"""
+
+    def __init__(self):
+        self.solar: Dict[str, Dict[str, str]] = {}
+        self.lunar: Dict[str, Dict[str, str]] = {}
+        self.keys: Dict[str, list] = {}         # doc_id -> 它出现在的 (表, 标签)
+        self.touched: Optional[set] = None      # 载入期间被事件改过的id
+        self.loaded_at = time.monotonic()
+
+    def add(self, r: dict):
+        self.remove(r["id"])
+        keys = []
+        for tag in (r.get("tags") or "").split(","):
+            tag = tag.strip()
+            if not tag:
+                continue
+            table = self.solar if _SOLAR_TAG.match(tag) else self.lunar
+            table.setdefault(tag, {})[r["id"]] = r.get("content", "")
+            keys.append((table, tag))
+        if keys:
+            self.keys[r["id"]] = keys
+
+    def remove(self, doc_id: str):
+        for table, tag in self.keys.pop(doc_id, []):
+            bucket = table.get(tag)
+            if bucket is not None:
+                bucket.pop(doc_id, None)
+                if not bucket:
+                    del table[tag]
+
+    def match(self, solar_key: str, lunar_date: str) -> list:
+        found = dict(self.solar.get(solar_key, {}))
+        # 农历日期最多五六个字，枚举全部子串去查表，等价于对每个标签做 `tag in lunar_date`
+        n = len(lunar_date)
+        for i in range(n):
+            for j in range(i + 1, n + 1):
+                found.update(self.lunar.get(lunar_date[i:j], {}))
+        return list(found.values())
+
+
+class AnniversaryIndex:
+    """user -> 纪念日索引。首次访问时从后端拉一次，之后由 MemoryStore 的写入/更新/删除事件增量维护，
+    超过 reconcile_interval 秒整组重载（兜住其他写入方）"""
+
+    def __init__(self, reconcile_interval: float = 3600.0):
+        self.reconcile_interval = reconcile_interval
+        self._users: Dict[str, _UserAnniversaries] = {}
+        self._building: Dict[str, _UserAnniversaries] = {}
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    async def get(self, store, user: str = "default") -> _UserAnniversaries:
+        idx = self._users.get(user)
+        if idx is not None and time.monotonic() - idx.loaded_at <= self.reconcile_interval:
+            return idx
+        task = self._loading.get(user)
+        if task is None:
+            task = self._loading[user] = asyncio.ensure_future(self._load(store, user))
+            task.add_done_callback(lambda _: self._loading.pop(user, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, store, user: str) -> _UserAnniversaries:
+        fresh = self._building[user] = _UserAnniversaries()
+        touched = fresh.touched = set()
+        try:
+            rows = await store.query_by_category(ANNIV_CATEGORY, ["id", "content", "tags"],
+                                                 ANNIV_LIMIT, user=user)
+        finally:
+            self._building.pop(user, None)
+        # 载入期间的写入/删除已经直接作用在 fresh 上，查询结果里的旧版本不再覆盖
+        for r in rows:
+            if r["id"] not in touched:
+                fresh.add(r)
+        fresh.touched = None
+        self._users[user] = fresh
+        return fresh
+
+    def _targets(self, user: str, doc_id: str) -> list:
+        out = []
+        for idx in (self._users.get(user), self._building.get(user)):
+            if idx is not None:
+                if idx.touched is not None:
+                    idx.touched.add(doc_id)
+                out.append(idx)
+        return out
+
+    def on_write(self, user: str, rows: list):
+        for r in rows:
+            if r.get("category") == ANNIV_CATEGORY:
+                for idx in self._targets(user, r["id"]):
+                    idx.add(r)
+
+    def on_update(self, old: dict, new: dict):
+        for idx in self._targets(old.get("user", "default"), new["id"]):
+            if new.get("category") == ANNIV_CATEGORY:
+                idx.add(new)
+            else:
+                idx.remove(new["id"])
+
+    def on_delete(self, user: str, doc_ids: list):
+        for doc_id in doc_ids:
+            for idx in self._targets(user, doc_id):
+                idx.remove(doc_id)
+
+    def invalidate(self, user: Optional[str] = None):
+        if user is None:
+            self._users.clear()
+        else:
+            self._users.pop(user, None)
+
+
+class CalendarService:
+
+    def __init__(self, store=None):
+        self.store = store
+        self._day: Optional[dict] = None
+
+    def day(self) -> dict:
+        now = datetime.now(TZ_CN).replace(tzinfo=None)
+        if self._day is None or self._day["date"] != now.date():
+            self._day = compute_day(now)
+        return self._day
+
+    async def anniversaries(self, user: str = "default") -> list:
+        d = self.day()
+        idx = await self.store.anniversaries.get(self.store, user)
+        return idx.match(d["solar_key"], d["lunar_date"])
@@ -0,0 +1 @@
+"""pytest 入口 - 让 tests/ 能直接 import 根目录下的模块"""
@@ -0,0 +1,120 @@
+"""Embedding服务 - 独立工作线程推理 + 并发请求合批，不阻塞事件循环"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from metrics import ENCODER_BATCH, ENCODER_SECONDS, ENCODER_ERRORS
+from tracing import span
+
+logger = logging.getLogger("recalldoggy")
+
+
+class EmbeddingService:
+    """把 SentenceTransformer 包一层：请求进队列，worker 攒批后丢到专用线程里 encode。
+
+    max_batch_size: 单批最多多少条文本（超长的单个请求不拆，整体作为一批）
+    max_wait_ms:    拿到第一条请求后最多再等多久凑批
+    """
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch: list = []              # 已出队、正在凑批/推理的请求，worker被取消时由 _fail_pending 收尾
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        # worker 重启时沿用原队列，已排队的请求不会被丢下
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def encode(self, text: str) -> list:
+        return (await self.encode_many([text]))[0]
+
+    async def encode_many(self, texts: List[str]) -> List[list]:
+        if not texts:
+            return []
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        with span("encode", texts=len(texts)):
+            await self._queue.put((list(texts), fut))
+            return await fut
+
+    async def _collect(self) -> list:
+        self._batch = [await self._queue.get()]
+        size = len(self._batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            self._batch.append(item)
+            size += len(item[0])
+        return self._batch
+
+    def _fail_pending(self, exc: Exception):
+        """正在凑批的 + 还在队列里的请求全部以 exc 结束，调用方不会永远挂住"""
+        pending, self._batch = self._batch, []
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+        for _, fut in pending:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def _encode_sync(self, texts: List[str]) -> List[list]:
+        return self.model.encode(
+            texts, batch_size=self.max_batch_size, convert_to_numpy=True
+        ).tolist()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = await self._collect()
+                texts = [t for ts, _ in batch for t in ts]
+                ENCODER_BATCH.observe(len(texts))
+                start = time.perf_counter()
+                try:
+                    vectors = await loop.run_in_executor(self._executor, self._encode_sync, texts)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    ENCODER_ERRORS.inc()
+                    self._batch = []
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                self._batch = []
+                ENCODER_SECONDS.observe(time.perf_counter() - start)
+                pos = 0
+                for ts, fut in batch:
+                    if not fut.done():
+                        fut.set_result(vectors[pos:pos + len(ts)])
+                    pos += len(ts)
+        except asyncio.CancelledError:
+            self._fail_pending(RuntimeError("embedding service stopped"))
+            raise
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._fail_pending(RuntimeError("embedding service stopped"))
+        self._executor.shutdown(wait=False)
+        logger.info("Embedding服务已停止")
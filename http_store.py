@@ -1,35 +1,185 @@
 """HttpMemoryStore - 通过HTTP连接远程Milvus Lite API"""
-import hashlib
+import asyncio
 import logging
-from datetime import datetime, timedelta
+import random
+import time
 from typing import Optional
 import httpx
 
-from memory import (
-    TZ_CN, LEVEL_ORDER,
-    now_ms, calc_retention, check_upgrade, format_item
-)
-from store import MemoryStore, COLLECTION_NAME, EMBEDDING_DIM, ALL_FIELDS
+from memory import format_items
+from wire import WIRE_FORMATS, MSGPACK_TYPE, dumps, loads, pack_rows, unpack_rows, encode_vec
+from tracing import span
+from store import MemoryStore, COLLECTION_NAME, EMBEDDING_DIM, ALL_FIELDS, SEARCH_FIELDS, ids_expr
 
 logger = logging.getLogger("recalldoggy")
 
+# 各类操作的超时（秒）：检索要快，写入/建表可以慢
+OP_TIMEOUTS = {"search": 10.0, "query": 15.0, "write": 60.0, "delete": 30.0, "meta": 10.0}
+# 可安全重发的操作；insert 只在连接都没建立时重试，避免重复插入
+IDEMPOTENT_OPS = {"search", "query", "delete", "meta"}
+RETRY_STATUS = {429, 502, 503, 504}
+SCAN_MODES = ("cursor", "offset")
+QUERY_WINDOW = 16384        # Milvus query 的 offset + limit 上限
 
-class HttpMemoryStore(MemoryStore):
 
-    def __init__(self, base_url: str, api_key: str):
+class ScanWindowExceeded(RuntimeError):
+    pass
+
+
+class BackendUnavailable(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """连续失败 threshold 次后熔断 cooldown 秒，期间直接失败；冷却后放一个探测请求"""
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def before(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise BackendUnavailable("Milvus API 熔断中")
+        if state == "half_open":
+            self._probing = True
+
+    def success(self):
+        if self.opened_at is not None:
+            logger.info("Milvus API 恢复，熔断关闭")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def abandon(self):
+        """请求既没成功也没判成上游故障（被取消、本地异常）：不计失败，但要放开探测名额"""
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Milvus API 连续失败{self.failures}次，熔断{self.cooldown}秒")
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures}
+
+
+def _op(method: str, path: str) -> str:
+    if method == "GET":
+        return "meta"
+    head = path.strip("/").split("/", 1)[0]
+    if head in ("insert", "upsert"):
+        return "write"
+    if head in ("search", "query", "delete"):
+        return head
+    return "meta"
+
+
+class HttpMemoryStore(MemoryStore):
+    """pool_size / keepalive:  连接池上限与保活连接数
+    http2:                    需要安装 h2（httpx[http2]），缺失时退回 HTTP/1.1
+    timeouts:                 覆盖 OP_TIMEOUTS 中的项
+    retries / backoff:        可重试请求的最大重试次数与基础退避秒数（指数退避 + 抖动）
+    breaker_threshold / breaker_cooldown: 熔断阈值与冷却秒数
+    wire_format:              向量传输格式 json / base64 / msgpack，connect() 时按服务端能力协商
+    scan_mode:                全表翻页方式 cursor / offset。cursor 要求 /query 按主键升序返回，
+                              服务端未在 /capabilities 声明 ordered_query 时退回 offset；
+                              offset 受 QUERY_WINDOW 限制，超出时 scan 直接报错而不是返回残缺结果
+    """
+
+    def __init__(self, base_url: str, api_key: str, partial_update: bool = True,
+                 scan_mode: str = "cursor", pool_size: int = 20, keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, http2: bool = True,
+                 timeouts: Optional[dict] = None, retries: int = 2, backoff: float = 0.2,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30.0,
+                 wire_format: str = "json"):
+        super().__init__(partial_update)
+        if scan_mode not in SCAN_MODES:
+            raise ValueError(f"scan_mode 必须是 {SCAN_MODES} 之一")
+        self.scan_mode = scan_mode
         self.base_url = base_url.rstrip("/")
         self.headers = {"Authorization": f"Bearer {api_key}"}
-        self.client = httpx.AsyncClient(timeout=30)
+        self.timeouts = {**OP_TIMEOUTS, **(timeouts or {})}
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"wire_format 必须是 {WIRE_FORMATS} 之一")
+        self.wire_format = wire_format
+        self.wire = "json"                 # 协商后实际使用的格式
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，HTTP/2 不可用，退回 HTTP/1.1")
+                http2 = False
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(OP_TIMEOUTS["write"], connect=5.0),
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=keepalive,
+                                keepalive_expiry=keepalive_expiry),
+        )
+
+    async def _request(self, method: str, path: str, json: Optional[dict] = None) -> dict:
+        op = _op(method, path)
+        headers, content = self.headers, None
+        if json is not None:
+            if self.wire != "json":
+                json = {**json, "vector_encoding": self.wire}
+            content, ctype = dumps(json, "msgpack" if self.wire == "msgpack" else "json")
+            headers = {**self.headers, "Content-Type": ctype}
+        if self.wire == "msgpack":
+            headers = {**headers, "Accept": MSGPACK_TYPE}
+        attempt = 0
+        with span(f"http {path}", op=op) as sp:
+            while True:
+                self.breaker.before()
+                try:
+                    r = await self.client.request(method, f"{self.base_url}{path}", content=content,
+                                                  headers=headers, timeout=self.timeouts[op])
+                    if r.status_code in RETRY_STATUS:
+                        r.raise_for_status()
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    self.breaker.failure()
+                    retryable = op in IDEMPOTENT_OPS or isinstance(e, httpx.ConnectError)
+                    if not retryable or attempt >= self.retries:
+                        raise
+                    attempt += 1
+                    sp.set(retries=attempt)
+                    delay = self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                    logger.warning(f"Milvus API {method} {path} 失败，{delay:.2f}s后第{attempt}次重试: {e!r}")
+                    await asyncio.sleep(delay)
+                    continue
+                except BaseException:
+                    self.breaker.abandon()
+                    raise
+                self.breaker.success()
+                sp.set(status=r.status_code, bytes=len(r.content))
+                r.raise_for_status()
+                return loads(r.content, r.headers.get("content-type"))
 
     async def _post(self, path: str, json: dict) -> dict:
-        r = await self.client.post(f"{self.base_url}{path}", json=json, headers=self.headers)
-        r.raise_for_status()
-        return r.json()
+        return await self._request("POST", path, json)
 
     async def _get(self, path: str) -> dict:
-        r = await self.client.get(f"{self.base_url}{path}", headers=self.headers)
-        r.raise_for_status()
-        return r.json()
+        return await self._request("GET", path)
+
+    async def close(self) -> None:
+        await super().close()
+        await self.client.aclose()
 
     async def _query(self, filter_expr: str, output_fields: list,
                      limit: int = 16384, offset: int = 0) -> list:
@@ -39,27 +189,68 @@ class HttpMemoryStore(MemoryStore):
             "output_fields": output_fields,
             "limit": limit, "offset": offset,
         })
-        return res.get("results", [])
+        results = res.get("results", [])
+        return unpack_rows(results) if "embedding" in output_fields else results
 
-    async def _insert(self, record: dict):
+    async def _insert_rows(self, rows):
         await self._post("/insert", {
-            "collection_name": COLLECTION_NAME, "data": [record],
+            "collection_name": COLLECTION_NAME, "data": pack_rows(rows, self.wire),
+        })
+
+    async def _query_ids(self, ids, fields):
+        return await self._query(ids_expr(ids), fields, limit=len(ids))
+
+    async def _upsert_rows(self, rows, partial):
+        await self._post("/upsert", {
+            "collection_name": COLLECTION_NAME, "data": pack_rows(rows, self.wire),
+            "partial_update": partial,
         })
 
+    async def _query_permanent(self, user):
+        return await self._query(self._user_expr(user, 'memory_level == "permanent"'),
+                                 ALL_FIELDS, limit=100)
+
     async def _delete_expr(self, expr: str):
         await self._post("/delete", {
             "collection_name": COLLECTION_NAME, "filter": expr,
         })
 
-    def _user_expr(self, user: str, extra: str = "") -> str:
-        base = f'user == "{user}"'
-        return f"{base} and {extra}" if extra else base
+    async def _delete_ids(self, ids):
+        await self._delete_expr(ids_expr(ids))
+
+    async def scan(self, expr, fields, page_size=None):
+        """cursor: 按主键游标 id > last 翻页（要求API按主键序返回），offset: 普通偏移翻页，最多读到 QUERY_WINDOW 行"""
+        size = page_size or self.scan_page_size
+        out = fields if "id" in fields else ["id"] + fields
+        last, offset = None, 0
+        while True:
+            if self.scan_mode == "cursor":
+                f = expr if last is None else f'({expr}) and id > "{last}"'
+                page = await self._query(f, out, limit=size)
+                ids = [r["id"] for r in page]
+                if ids != sorted(ids):
+                    raise RuntimeError("/query 返回的结果未按主键排序，cursor 翻页会漏行")
+            else:
+                limit = min(size, QUERY_WINDOW - offset)
+                if limit <= 0:
+                    raise ScanWindowExceeded(
+                        f"offset 翻页已到 {QUERY_WINDOW} 行查询窗口上限，结果不完整；"
+                        f"需要服务端支持 ordered_query 以使用 cursor 翻页")
+                page = await self._query(expr, out, limit=limit, offset=offset)
+                offset += len(page)
+            if not page:
+                break
+            last = page[-1]["id"]
+            yield page
+            if len(page) < (size if self.scan_mode == "cursor" else limit):
+                break
 
     async def connect(self) -> None:
         res = await self._get("/health")
         if res.get("status") != "ok":
             raise ConnectionError("Milvus API unreachable")
         logger.info("已连接远程 Milvus API")
+        await self._negotiate()
 
         res = await self._get(f"/collection/has/{COLLECTION_NAME}")
         if not res.get("exists"):
@@ -68,6 +259,25 @@ class HttpMemoryStore(MemoryStore):
             c = await self._get(f"/count/{COLLECTION_NAME}")
             logger.info(f"知识库就绪，当前: {c.get('count', '?')} 条")
 
+    async def _negotiate(self):
+        """服务端在 /capabilities 声明 vector_encodings 与 ordered_query；旧服务端没有该接口时用JSON + offset"""
+        if self.wire_format == "json" and self.scan_mode == "offset":
+            return
+        try:
+            caps = await self._get("/capabilities")
+        except httpx.HTTPStatusError:
+            caps = {}
+        if self.wire_format != "json":
+            if self.wire_format in caps.get("vector_encodings", []):
+                self.wire = self.wire_format
+                logger.info(f"向量传输格式: {self.wire}")
+            else:
+                logger.warning(f"服务端不支持 {self.wire_format} 向量传输，使用JSON")
+        # 游标翻页靠 id > last 且 last 取本页最大id，结果不按主键排序就会漏行
+        if self.scan_mode == "cursor" and not caps.get("ordered_query"):
+            logger.error(f"服务端未声明 /query 按主键排序，翻页退回 offset：全表操作超过 {QUERY_WINDOW} 行会报错")
+            self.scan_mode = "offset"
+
     async def _create_collection(self):
         fields = [
             {"name": "id", "dtype": "VARCHAR", "is_primary": True, "max_length": 64},
@@ -89,107 +299,17 @@ class HttpMemoryStore(MemoryStore):
         })
         logger.info("远程collection已创建")
 
-    async def write(self, content, embedding, category, tags, memory_level, user="default"):
-        doc_id = hashlib.md5(content.encode()).hexdigest()
-        existing = await self._query(f'id == "{doc_id}"', ["id"], limit=1)
-        if existing:
-            return {"status": "exists", "message": "知识已存在"}
-        level = memory_level if memory_level in LEVEL_ORDER else "flash"
-        ts = now_ms()
-        await self._insert({
-            "id": doc_id, "embedding": embedding, "content": content,
-            "category": category,
-            "tags": ",".join(tags) if isinstance(tags, list) else tags,
-            "timestamp": ts, "memory_level": level,
-            "recall_count": 0, "last_recall": ts, "user": user,
-        })
-        logger.info(f"写入[{level}]: {content[:50]} | {category} | user={user}")
-        return {"status": "success", "message": "写入成功", "id": doc_id}
-
-    async def search(self, query_vec, top_k, user="default", update_recall=True):
-        perm_expr = self._user_expr(user, 'memory_level == "permanent"')
-        perm_raw = await self._query(perm_expr, ALL_FIELDS, limit=100)
-        permanent = [format_item(r) for r in perm_raw]
-        perm_ids = {r["id"] for r in perm_raw}
-
+    async def _ann_search_many(self, query_vecs, limit, user):
         res = await self._post("/search", {
             "collection_name": COLLECTION_NAME,
-            "data": [query_vec],
-            "limit": top_k + len(perm_raw),
-            "output_fields": ["content", "category", "tags", "timestamp",
-                              "memory_level", "recall_count", "last_recall", "user"],
+            "data": [encode_vec(v, self.wire) for v in query_vecs],
+            "limit": limit,
+            "output_fields": SEARCH_FIELDS,
             "filter": self._user_expr(user),
         })
-        hits_raw = res.get("results", [[]])[0]
-
-        scored = []
-        for hit in hits_raw:
-            if hit["id"] in perm_ids:
-                continue
-            e = hit.get("entity", {})
-            level = e.get("memory_level", "flash")
-            lr = e.get("last_recall", e.get("timestamp", 0))
-            rc = e.get("recall_count", 0)
-            ret = calc_retention(level, lr, rc)
-            sim = hit.get("distance", 0)
-            scored.append({
-                "id": hit["id"], "entity": e,
-                "final_score": sim * 0.7 + ret * 0.3,
-                "retention": ret, "similarity": sim,
-            })
-
-        scored.sort(key=lambda x: x["final_score"], reverse=True)
-        scored = scored[:top_k]
-
-        if update_recall:
-            for it in scored:
-                try: await self.do_recall(it["id"])
-                except: pass
-            for r in perm_raw:
-                try: await self.do_recall(r["id"])
-                except: pass
-
-        output = []
-        for it in scored:
-            e = it["entity"]
-            output.append({
-                "id": it["id"], "content": e.get("content"),
-                "category": e.get("category"),
-                "tags": e.get("tags", "").split(","),
-                "similarity": round(it["similarity"] * 100, 2),
-                "time": datetime.fromtimestamp(
-                    e.get("timestamp", 0) / 1000, tz=TZ_CN
-                ).strftime("%Y-%m-%d %H:%M"),
-                "memory_level": e.get("memory_level", "flash"),
-                "recall_count": e.get("recall_count", 0) + 1,
-                "retention": round(it["retention"] * 100, 2),
-            })
-
-        logger.info(f"搜索: top_k={top_k} | 结果:{len(output)} | permanent:{len(permanent)} | user={user}")
-        return {"results": output, "permanent": permanent}
-
-    async def delete(self, doc_id):
-        await self._delete_expr(f'id == "{doc_id}"')
-        logger.warning(f"删除: {doc_id}")
-        return True
-
-    async def update(self, doc_id, content, embedding, category, tags):
-        r = await self.get_by_id(doc_id)
-        if not r:
-            return None
-        await self._delete_expr(f'id == "{doc_id}"')
-        await self._insert({
-            "id": doc_id, "embedding": embedding, "content": content,
-            "category": category,
-            "tags": ",".join(tags) if isinstance(tags, list) else tags,
-            "timestamp": r.get("timestamp", now_ms()),
-            "memory_level": r.get("memory_level", "flash"),
-            "recall_count": r.get("recall_count", 0),
-            "last_recall": r.get("last_recall", now_ms()),
-            "user": r.get("user", "default"),
-        })
-        logger.info(f"更新: {doc_id}")
-        return {"message": "更新成功", "id": doc_id}
+        groups = res.get("results", [])
+        return [[(hit["id"], hit.get("entity", {}), hit.get("distance", 0)) for hit in hits]
+                for hits in groups] + [[] for _ in range(len(query_vecs) - len(groups))]
 
     async def get_by_id(self, doc_id):
         results = await self._query(f'id == "{doc_id}"', ALL_FIELDS, limit=1)
@@ -198,106 +318,7 @@ class HttpMemoryStore(MemoryStore):
     async def list_all(self, limit, offset, user="default"):
         results = await self._query(self._user_expr(user), ALL_FIELDS, limit=limit, offset=offset)
         c = await self._get(f"/count/{COLLECTION_NAME}")
-        return {"results": [format_item(r) for r in results], "total": c.get("count", 0)}
-
-    async def set_level(self, doc_id, level):
-        if level not in LEVEL_ORDER:
-            return None
-        r = await self._query(f'id == "{doc_id}"', ALL_FIELDS + ["embedding"], limit=1)
-        if not r:
-            return None
-        r = r[0]
-        await self._delete_expr(f'id == "{doc_id}"')
-        await self._insert({
-            "id": r["id"], "embedding": r["embedding"],
-            "content": r["content"], "category": r["category"],
-            "tags": r["tags"], "timestamp": r["timestamp"],
-            "memory_level": level, "recall_count": r.get("recall_count", 0),
-            "last_recall": now_ms(), "user": r.get("user", "default"),
-        })
-        logger.info(f"层级变更: {doc_id} -> {level}")
-        return {"message": f"已设为 {level}", "id": doc_id}
-
-    async def do_recall(self, doc_id):
-        r = await self._query(f'id == "{doc_id}"', ALL_FIELDS + ["embedding"], limit=1)
-        if not r:
-            return
-        r = r[0]
-        old_level = r.get("memory_level", "flash")
-        new_count = r.get("recall_count", 0) + 1
-        new_level = check_upgrade(old_level, new_count)
-        await self._delete_expr(f'id == "{doc_id}"')
-        await self._insert({
-            "id": r["id"], "embedding": r["embedding"],
-            "content": r["content"], "category": r["category"],
-            "tags": r["tags"], "timestamp": r["timestamp"],
-            "memory_level": new_level, "recall_count": new_count,
-            "last_recall": now_ms(), "user": r.get("user", "default"),
-        })
-        if new_level != old_level:
-            logger.info(f"记忆升级: {doc_id} {old_level} -> {new_level} (recall={new_count})")
-
-    async def cleanup(self, threshold, user="default"):
-        expr = self._user_expr(user, 'memory_level != "permanent"')
-        all_data = await self._query(expr, ALL_FIELDS, limit=16384)
-        to_delete = [
-            r["id"] for r in all_data
-            if calc_retention(r.get("memory_level", "flash"),
-                             r.get("last_recall", r.get("timestamp", 0)),
-                             r.get("recall_count", 0)) < threshold
-        ]
-        for doc_id in to_delete:
-            await self._delete_expr(f'id == "{doc_id}"')
-        logger.info(f"清理: 删除{len(to_delete)}条 | 阈值{threshold} | user={user}")
-        return len(to_delete)
-
-    async def stats(self, user="default"):
-        all_data = await self._query(self._user_expr(user),
-                                     ["memory_level", "content", "category", "timestamp"], limit=16384)
-        levels = {"flash": 0, "short": 0, "long": 0, "permanent": 0}
-        now = datetime.now(TZ_CN)
-        trend = {(now - timedelta(days=i)).strftime("%m-%d"): 0 for i in range(6, -1, -1)}
-        for r in all_data:
-            levels[r.get("memory_level", "flash")] = levels.get(r.get("memory_level", "flash"), 0) + 1
-            ts = r.get("timestamp", 0)
-            if ts:
-                key = datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%m-%d")
-                if key in trend:
-                    trend[key] += 1
-        sorted_data = sorted(all_data, key=lambda x: x.get("timestamp", 0), reverse=True)[:10]
-        recent = [{"category": r.get("category", ""), "content": r.get("content", "")[:80],
-                   "time": datetime.fromtimestamp(r.get("timestamp", 0) / 1000, tz=TZ_CN).strftime("%m-%d %H:%M")
-                   if r.get("timestamp") else ""} for r in sorted_data]
-        return {"total": len(all_data), "collection": COLLECTION_NAME,
-                "levels": levels, "trend": trend, "recent": recent}
-
-    async def dashboard(self, user="default"):
-        all_data = await self._query(self._user_expr(user), ALL_FIELDS, limit=16384)
-        levels = {"flash": 0, "short": 0, "long": 0, "permanent": 0}
-        cat_count = {}
-        now = datetime.now(TZ_CN)
-        trend = {(now - timedelta(days=i)).strftime("%m-%d"): 0 for i in range(6, -1, -1)}
-        for item in all_data:
-            lv = item.get("memory_level", "flash")
-            levels[lv] = levels.get(lv, 0) + 1
-            cat = item.get("category", "未分类")
-            cat_count[cat] = cat_count.get(cat, 0) + 1
-            ts = item.get("timestamp", 0)
-            if ts:
-                key = datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%m-%d")
-                if key in trend:
-                    trend[key] += 1
-        sorted_data = sorted(all_data, key=lambda x: x.get("timestamp", 0), reverse=True)
-        recent = [{"id": r.get("id"), "content": r.get("content", "")[:80],
-                   "category": r.get("category"), "memory_level": r.get("memory_level", "flash"),
-                   "time": datetime.fromtimestamp(r.get("timestamp", 0) / 1000, tz=TZ_CN).strftime("%m-%d %H:%M")}
-                  for r in sorted_data[:10]]
-        return {"total": len(all_data), "levels": levels,
-                "categories": cat_count, "trend": trend, "recent": recent}
-
-    async def export_all(self, user="default"):
-        all_data = await self._query(self._user_expr(user), ALL_FIELDS, limit=16384)
-        return [format_item(r) for r in all_data]
+        return {"results": format_items(results), "total": c.get("count", 0)}
 
     async def count(self):
         res = await self._get(f"/count/{COLLECTION_NAME}")
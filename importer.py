@@ -0,0 +1,265 @@
+"""流式导入 - 解析NDJSON或导出JSON，分批编码/插入，记录进度以便断点续传"""
+import codecs
+import hashlib
+import json
+import logging
+import time
+import uuid
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from memory import TZ_CN, LEVEL_ORDER, now_ms
+from store import EMBEDDING_DIM
+
+logger = logging.getLogger("recalldoggy")
+
+IMPORT_BATCH = 256
+
+
+class TruncatedUpload(ValueError):
+    pass
+
+
+async def _gunzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """首两个字节是gzip魔数就边读边解压，否则原样透传"""
+    d = None
+    first = True
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                d = zlib.decompressobj(wbits=47)
+        yield d.decompress(chunk) if d else chunk
+    if d:
+        tail = d.flush()
+        if tail:
+            yield tail
+
+
+def _loads(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+async def _ndjson(head: bytes, chunks: AsyncIterator[bytes],
+                  base: int) -> AsyncIterator[Tuple[dict, int]]:
+    buf = head
+    pos = base
+    while True:
+        while True:
+            nl = buf.find(b"\n")
+            if nl < 0:
+                break
+            line, buf = buf[:nl], buf[nl + 1:]
+            pos += nl + 1
+            if line.strip():
+                yield _loads(line), pos
+        try:
+            buf += await chunks.__anext__()
+        except StopAsyncIteration:
+            break
+    if buf.strip():
+        # 没有结尾换行：能完整解析说明文件只是少了最后的换行；否则是上传断在记录中间，
+        # 不计数也不推进偏移，续传从最后一个换行处接上
+        rec = _loads(buf)
+        if not isinstance(rec, dict):
+            raise TruncatedUpload(f"上传在记录中间结束（偏移{pos}之后{len(buf)}字节）")
+        yield rec, pos + len(buf)
+
+
+async def _json_array(head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[dict, int]]:
+    """整体是导出JSON（{"data": [...]}）或裸数组：定位到数组后逐个 raw_decode 元素"""
+    dec = codecs.getincrementaldecoder("utf-8")()
+    decoder = json.JSONDecoder()
+    text = dec.decode(head)
+    eof = False
+
+    async def more() -> bool:
+        nonlocal text, eof
+        try:
+            text += dec.decode(await chunks.__anext__())
+            return True
+        except StopAsyncIteration:
+            text += dec.decode(b"", final=True)
+            eof = True
+            return False
+
+    # 找数组起点
+    while True:
+        stripped = text.lstrip()
+        if stripped.startswith("["):
+            pos = len(text) - len(stripped) + 1
+            break
+        key = text.find('"data"')
+        bracket = text.find("[", key) if key >= 0 else -1
+        if bracket >= 0:
+            pos = bracket + 1
+            break
+        if eof or not await more():
+            return
+
+    while True:
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text):
+            if eof or not await more():
+                return
+            continue
+        if text[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            if eof or not await more():
+                raise
+            continue
+        yield obj, 0
+        text, pos = text[end:], 0
+
+
+async def iter_records(chunks: AsyncIterator[bytes],
+                       byte_offset: int = 0) -> AsyncIterator[Tuple[dict, int]]:
+    """产出 (记录, 该记录结束处在原文件中的字节偏移)。偏移仅对未压缩NDJSON有意义，其余为0。
+
+    byte_offset: 上传内容在原文件中的起始位置（续传时只上传文件尾部）
+    """
+    stream = _gunzip(chunks).__aiter__()
+    head = b""
+    # 读到第一个换行，决定是NDJSON还是整体JSON
+    while b"\n" not in head:
+        try:
+            head += await stream.__anext__()
+        except StopAsyncIteration:
+            break
+    first_line = head.split(b"\n", 1)[0].strip()
+    is_ndjson = False
+    if byte_offset:
+        is_ndjson = True
+    elif first_line.startswith(b"{"):
+        try:
+            is_ndjson = "content" in json.loads(first_line)
+        except ValueError:
+            is_ndjson = False
+    if is_ndjson:
+        async for rec, end in _ndjson(head, stream, byte_offset):
+            yield rec, end
+    else:
+        async for rec, end in _json_array(head, stream):
+            yield rec, end
+
+
+def _parse_time(rec: dict) -> int:
+    ts = rec.get("timestamp")
+    if isinstance(ts, (int, float)) and ts > 0:
+        return int(ts)
+    t = rec.get("time")
+    if t:
+        try:
+            return int(datetime.strptime(t, "%Y-%m-%d %H:%M").replace(tzinfo=TZ_CN).timestamp() * 1000)
+        except ValueError:
+            pass
+    return now_ms()
+
+
+def to_row(rec: dict) -> Optional[dict]:
+    content = rec.get("content")
+    if not isinstance(content, str) or not content:
+        return None
+    ts = _parse_time(rec)
+    tags = rec.get("tags", "")
+    if isinstance(tags, list):
+        tags = ",".join(t for t in tags if t)
+    level = rec.get("memory_level")
+    emb = rec.get("embedding")
+    return {
+        "id": rec.get("id") or hashlib.md5(content.encode()).hexdigest(),
+        "embedding": emb if isinstance(emb, list) and len(emb) == EMBEDDING_DIM else None,
+        "content": content,
+        "category": rec.get("category") or "通用",
+        "tags": tags or "",
+        "timestamp": ts,
+        "memory_level": level if level in LEVEL_ORDER else "flash",
+        "recall_count": int(rec.get("recall_count") or 0),
+        "last_recall": int(rec.get("last_recall") or ts),
+        "user": rec.get("user") or "default",
+    }
+
+
+class ImportJob:
+
+    def __init__(self, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.status = "pending"
+        self.records = 0        # 已处理（含跳过）的记录数，续传时作为 skip
+        self.bytes = 0          # 已处理到的字节偏移，续传时作为 byte_offset（仅NDJSON）
+        self.inserted = 0
+        self.exists = 0
+        self.invalid = 0
+        self.error = None
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id, "status": self.status,
+            "records": self.records, "bytes": self.bytes,
+            "inserted": self.inserted, "exists": self.exists, "invalid": self.invalid,
+            "error": self.error,
+            "elapsed": round(self.updated_at - self.started_at, 2),
+        }
+
+    async def run(self, store, encode_many: Callable[[List[str]], Awaitable[List[list]]],
+                  chunks: AsyncIterator[bytes], skip: int = 0, byte_offset: int = 0,
+                  batch_size: int = IMPORT_BATCH):
+        """skip: 从文件头上传时跳过前skip条；byte_offset: 只上传了文件尾部（NDJSON），
+        此时skip表示该偏移之前已有的记录数，仅用于累计进度"""
+        self.status = "running"
+        self.error = None
+        self.started_at = time.time()
+        base = skip if byte_offset else 0
+        self.records = skip
+        self.bytes = byte_offset
+        batch: List[dict] = []
+        batch_end = byte_offset
+        n = 0
+        try:
+            async for rec, end in iter_records(chunks, byte_offset):
+                n += 1
+                batch_end = end
+                if not byte_offset and n <= skip:
+                    continue
+                row = to_row(rec) if isinstance(rec, dict) else None
+                if row is None:
+                    self.invalid += 1
+                else:
+                    batch.append(row)
+                if len(batch) >= batch_size:
+                    await self._commit(store, encode_many, batch, batch_end, base + n)
+                    batch = []
+            await self._commit(store, encode_many, batch, batch_end, base + n)
+            self.status = "done"
+        except Exception as e:
+            self.status = "interrupted"
+            self.error = str(e)
+            logger.warning(f"导入中断: job={self.id} | 已处理{self.records}条 | {e}")
+        self.updated_at = time.time()
+        logger.info(f"导入{self.status}: job={self.id} | 新增{self.inserted} | 已存在{self.exists} | 无效{self.invalid}")
+        return self.to_dict()
+
+    async def _commit(self, store, encode_many, batch, batch_end, records):
+        if batch:
+            missing = [r for r in batch if r["embedding"] is None]
+            if missing:
+                for r, emb in zip(missing, await encode_many([r["content"] for r in missing])):
+                    r["embedding"] = emb
+            inserted, exists = await store.import_rows(batch)
+            self.inserted += inserted
+            self.exists += exists
+        self.records = max(self.records, records)
+        self.bytes = batch_end
+        self.updated_at = time.time()
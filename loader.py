@@ -12,6 +12,8 @@ class PluginLoader:
     def __init__(self):
         self.plugins = {}
         self._registered = {}  # name -> {"routes": [route_obj], "tools": [tool_name]}
+        self._route_owner = {}  # id(route) -> name
+        self._tool_owner = {}   # tool_name -> name
         os.makedirs(PLUGINS_DIR, exist_ok=True)
 
     # ── scan / load ──────────────────────────────────
@@ -70,6 +72,18 @@ class PluginLoader:
         elif hasattr(mcp_server, "tools"):
             mcp_server.tools.pop(tool_name, None)
 
+    # ── ownership（指标按插件打标签）────────────────
+
+    def _index(self):
+        self._route_owner = {id(r): n for n, reg in self._registered.items() for r in reg["routes"]}
+        self._tool_owner = {t: n for n, reg in self._registered.items() for t in reg["tools"]}
+
+    def plugin_of_route(self, route):
+        return self._route_owner.get(id(route)) if route is not None else None
+
+    def plugin_of_tool(self, tool_name):
+        return self._tool_owner.get(tool_name)
+
     # ── load / unload / reload ───────────────────────
 
     def _load_one(self, name, app, mcp_server=None):
@@ -105,9 +119,11 @@ class PluginLoader:
             "routes": new_routes,
             "tools": list(new_tools),
         }
+        self._index()
 
     def _unload_one(self, name, app, mcp_server=None):
         reg = self._registered.pop(name, None)
+        self._index()
         if reg:
             for route in reg["routes"]:
                 try:
@@ -171,6 +187,7 @@ class PluginLoader:
         shutil.rmtree(self.plugins[name]["dir"])
         del self.plugins[name]
         self._registered.pop(name, None)
+        self._index()
 
     def toggle(self, name: str) -> bool:
         if name not in self.plugins:
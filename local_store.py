@@ -0,0 +1,323 @@
+"""LocalMemoryStore - 进程内存储：向量存内存映射float32矩阵，标量存SQLite，NumPy精确余弦检索"""
+import logging
+import os
+import re
+import sqlite3
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from memory import cosine_topk, format_items
+from store import MemoryStore, EMBEDDING_DIM, ALL_FIELDS, SEARCH_FIELDS
+
+logger = logging.getLogger("recalldoggy")
+
+INITIAL_CAPACITY = 1024
+SQL_CHUNK = 500
+
+_COLUMNS = {
+    "id": "TEXT PRIMARY KEY", "content": "TEXT", "category": "TEXT", "tags": "TEXT",
+    "timestamp": "INTEGER", "memory_level": "TEXT", "recall_count": "INTEGER",
+    "last_recall": "INTEGER", "user": "TEXT",
+}
+_INSERT = (
+    "INSERT OR REPLACE INTO memories (" + ", ".join(f'"{k}"' for k in _COLUMNS) + ", slot) "
+    "VALUES (" + ", ".join("?" * (len(_COLUMNS) + 1)) + ")"
+)
+_TOKEN = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|(-?\d+)|(==|!=|>=|<=|>|<|\(|\)|\[|\]|,)|([A-Za-z_]\w*))')
+_KEYWORDS = {"and": "AND", "or": "OR", "not": "NOT", "in": "IN", "like": "LIKE"}
+
+
+def to_sql(expr: str) -> tuple:
+    """把store里用到的Milvus过滤表达式子集翻成 SQLite WHERE 子句 + 参数"""
+    sql, params, pos = [], [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN.match(expr, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"无法解析的过滤表达式: {expr}")
+        pos = m.end()
+        s, num, op, word = m.groups()
+        if s is not None:
+            sql.append("?")
+            params.append(re.sub(r"\\(.)", r"\1", s))
+        elif num is not None:
+            sql.append("?")
+            params.append(int(num))
+        elif op is not None:
+            sql.append({"==": "=", "[": "(", "]": ")"}.get(op, op))
+        elif word.lower() in _KEYWORDS:
+            sql.append(_KEYWORDS[word.lower()])
+        elif word in _COLUMNS:
+            sql.append(f'"{word}"')
+        else:
+            raise ValueError(f"未知字段: {word}")
+    return " ".join(sql) or "1", params
+
+
+class LocalMemoryStore(MemoryStore):
+    """slot 是向量在矩阵中的行号，SQLite 行里记着它；删除后的 slot 复用。
+    path=":memory:" 时不落盘（SQLite内存库 + 普通数组），供测试与基准使用"""
+
+    def __init__(self, path: str = "./data", partial_update: bool = True):
+        super().__init__(partial_update)
+        self.path = path
+        self.in_memory = path == ":memory:"
+        self.db: Optional[sqlite3.Connection] = None
+        self._vectors: Optional[np.memmap] = None
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._free: List[int] = []
+        self._high = 0                                   # 用过的最大 slot + 1
+        self._user_slots: Dict[str, Set[int]] = {}
+        self._user_index: Dict[str, np.ndarray] = {}     # user -> slot数组，变更时丢弃重建
+
+    # ── 向量矩阵 ──────────────────────────────────
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    def _open_matrix(self, capacity: int):
+        if self.in_memory:
+            vecs = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+            if self._vectors is not None:
+                vecs[:len(self._vectors)] = self._vectors
+            self._vectors = vecs
+        else:
+            self._map_matrix(capacity)
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:len(self._norms)] = self._norms[:capacity]
+        self._norms = norms
+
+    def _map_matrix(self, capacity: int):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._matrix_path, "ab") as f:
+            f.truncate(capacity * EMBEDDING_DIM * 4)
+        self._vectors = np.memmap(self._matrix_path, dtype=np.float32, mode="r+",
+                                  shape=(capacity, EMBEDDING_DIM))
+
+    def _alloc(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._high >= len(self._vectors):
+            self._open_matrix(len(self._vectors) * 2)
+        self._high += 1
+        return self._high - 1
+
+    def _put_vector(self, slot: int, vec):
+        v = np.asarray(vec, dtype=np.float32)
+        self._vectors[slot] = v
+        self._norms[slot] = np.linalg.norm(v)
+
+    def _index(self, user: str) -> np.ndarray:
+        idx = self._user_index.get(user)
+        if idx is None:
+            idx = np.fromiter(self._user_slots.get(user, ()), dtype=np.int64)
+            idx.sort()
+            self._user_index[user] = idx
+        return idx
+
+    def _track(self, user: str, slot: int, add: bool = True):
+        slots = self._user_slots.setdefault(user, set())
+        if add:
+            slots.add(slot)
+        else:
+            slots.discard(slot)
+        self._user_index.pop(user, None)
+
+    # ── SQLite ───────────────────────────────────
+
+    def _rows(self, sql: str, params=()) -> list:
+        return [dict(r) for r in self.db.execute(sql, params)]
+
+    def _select(self, fields: list, where: str = "1", params=(), tail: str = "") -> list:
+        want_vec = "embedding" in fields
+        cols = [f for f in fields if f != "embedding"]
+        if want_vec:
+            cols.append("slot")
+        sel = ", ".join(f'"{c}"' for c in cols) or '"id"'
+        rows = self._rows(f"SELECT {sel} FROM memories WHERE {where} {tail}", params)
+        if want_vec:
+            for r in rows:
+                r["embedding"] = self._vectors[r.pop("slot")].tolist()
+        return rows
+
+    def _slots_of(self, ids: list) -> Dict[str, tuple]:
+        out = {}
+        for i in range(0, len(ids), SQL_CHUNK):
+            chunk = ids[i:i + SQL_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            for r in self.db.execute(
+                f'SELECT id, slot, "user" FROM memories WHERE id IN ({marks})', chunk
+            ):
+                out[r["id"]] = (r["slot"], r["user"])
+        return out
+
+    async def connect(self) -> None:
+        if self.in_memory:
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(self.path, "meta.db"), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        cols = ", ".join(f'"{k}" {v}' for k, v in _COLUMNS.items())
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS memories ({cols}, slot INTEGER NOT NULL)")
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_user_level ON memories("user", memory_level)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS idx_user_category ON memories("user", category)')
+        self.db.commit()
+
+        used = self.db.execute('SELECT slot, "user" FROM memories').fetchall()
+        self._high = max((r["slot"] for r in used), default=-1) + 1
+        size = 0
+        if not self.in_memory and os.path.exists(self._matrix_path):
+            size = os.path.getsize(self._matrix_path)
+        capacity = max(INITIAL_CAPACITY, size // (EMBEDDING_DIM * 4), self._high)
+        self._open_matrix(capacity)
+        self._user_slots, self._user_index = {}, {}
+        taken = set()
+        for r in used:
+            taken.add(r["slot"])
+            self._user_slots.setdefault(r["user"], set()).add(r["slot"])
+        # 只写了向量、没来得及提交SQLite的slot也一并回收
+        self._free = [s for s in range(self._high - 1, -1, -1) if s not in taken]
+        self._norms[:self._high] = np.linalg.norm(self._vectors[:self._high], axis=1)
+        logger.info(f"本地存储就绪: {self.path} | 当前: {len(used)} 条")
+
+    async def _flush(self, rows=1):
+        self.db.commit()
+
+    async def close(self) -> None:
+        await super().close()
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+        if self._vectors is not None:
+            if not self.in_memory:
+                self._vectors.flush()
+            self._vectors = None
+
+    # ── 后端原语 ──────────────────────────────────
+
+    async def _query_ids(self, ids, fields):
+        out = []
+        for i in range(0, len(ids), SQL_CHUNK):
+            chunk = list(ids[i:i + SQL_CHUNK])
+            out.extend(self._select(fields, f"id IN ({','.join('?' * len(chunk))})", chunk))
+        return out
+
+    async def _insert_rows(self, rows):
+        await self._upsert_rows(rows, partial=False)
+
+    async def _upsert_rows(self, rows, partial):
+        known = self._slots_of([r["id"] for r in rows])
+        for r in rows:
+            cur = known.get(r["id"])
+            if partial:
+                if cur is None:
+                    continue
+                fields = [k for k in r if k in _COLUMNS and k != "id"]
+                if fields:
+                    sets = ", ".join(f'"{k}" = ?' for k in fields)
+                    self.db.execute(f"UPDATE memories SET {sets} WHERE id = ?",
+                                    [r[k] for k in fields] + [r["id"]])
+                if r.get("embedding") is not None:
+                    self._put_vector(cur[0], r["embedding"])
+                if "user" in r and r["user"] != cur[1]:
+                    self._track(cur[1], cur[0], add=False)
+                    self._track(r["user"], cur[0])
+                continue
+            if cur is None:
+                slot = self._alloc()
+            else:
+                slot = cur[0]
+                self._track(cur[1], slot, add=False)
+            self._put_vector(slot, r["embedding"])
+            row = {k: r.get(k) for k in _COLUMNS}
+            row["user"] = row["user"] or "default"
+            self.db.execute(_INSERT, list(row.values()) + [slot])
+            known[r["id"]] = (slot, row["user"])
+            self._track(row["user"], slot)
+        self.db.commit()
+
+    async def _delete_ids(self, ids):
+        known = self._slots_of(list(ids))
+        if not known:
+            return
+        keys = list(known)
+        for i in range(0, len(keys), SQL_CHUNK):
+            chunk = keys[i:i + SQL_CHUNK]
+            self.db.execute(f"DELETE FROM memories WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        self.db.commit()
+        for slot, user in known.values():
+            self._track(user, slot, add=False)
+            self._norms[slot] = 0
+            self._free.append(slot)
+
+    async def _query_permanent(self, user):
+        return self._select(ALL_FIELDS, '"user" = ? AND memory_level = ?',
+                            (user, "permanent"), "LIMIT 100")
+
+    async def scan(self, expr, fields, page_size=None):
+        size = page_size or self.scan_page_size
+        out = fields if "id" in fields else ["id"] + fields
+        where, params = to_sql(expr)
+        last = None
+        while True:
+            if last is None:
+                page = self._select(out, f"({where})", params + [size], "ORDER BY id LIMIT ?")
+            else:
+                page = self._select(out, f"({where}) AND id > ?", params + [last, size],
+                                    "ORDER BY id LIMIT ?")
+            if not page:
+                break
+            last = page[-1]["id"]
+            yield page
+            if len(page) < size:
+                break
+
+    # ── 查询 ──────────────────────────────────────
+
+    async def _ann_search_many(self, query_vecs, limit, user):
+        idx = self._index(user)
+        if not len(idx):
+            return [[] for _ in query_vecs]
+        if idx[-1] - idx[0] + 1 == len(idx):
+            block = self._vectors[idx[0]:idx[-1] + 1]    # 连续slot直接切视图，免拷贝
+        else:
+            block = self._vectors[idx]
+        norms = self._norms[idx]
+        tops = []
+        for vec in query_vecs:
+            top, sims = cosine_topk(block, norms, vec, limit)
+            tops.append([(int(idx[i]), float(sim)) for i, sim in zip(top, sims)])
+        slots = list({slot for top in tops for slot, _ in top})
+        rows = {}
+        for i in range(0, len(slots), SQL_CHUNK):
+            chunk = slots[i:i + SQL_CHUNK]
+            for r in self._select(["id", "slot"] + SEARCH_FIELDS,
+                                  f"slot IN ({','.join('?' * len(chunk))})", chunk):
+                rows[r["slot"]] = r
+        return [[(rows[slot]["id"], rows[slot], sim) for slot, sim in top if slot in rows]
+                for top in tops]
+
+    async def get_by_id(self, doc_id):
+        rows = self._select(ALL_FIELDS, "id = ?", (doc_id,), "LIMIT 1")
+        return rows[0] if rows else None
+
+    async def list_all(self, limit, offset, user="default"):
+        rows = self._select(ALL_FIELDS, '"user" = ?', (user, limit, offset),
+                            "ORDER BY rowid LIMIT ? OFFSET ?")
+        return {"results": format_items(rows), "total": await self.count()}
+
+    async def count(self):
+        if self.db is None:
+            return 0
+        return self.db.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+    async def query_by_category(self, category, fields, limit, user="default"):
+        return self._select(fields, '"user" = ? AND category = ?', (user, category, limit), "LIMIT ?")
@@ -1,43 +1,104 @@
 """分层记忆系统 - 核心常量与纯函数"""
-import math
 from datetime import datetime, timedelta, timezone
 
+import numpy as np
+
 TZ_CN = timezone(timedelta(hours=8))
 
 HALF_LIFE = {"flash": 24, "short": 168, "long": 720, "permanent": None}
 UPGRADE_THRESHOLDS = {1: "short", 4: "long", 10: "permanent"}
 LEVEL_ORDER = ["flash", "short", "long", "permanent"]
 
+_LEVEL_RANK = {lv: i for i, lv in enumerate(LEVEL_ORDER)}
+_UPGRADE_STEPS = sorted(UPGRADE_THRESHOLDS.items(), reverse=True)   # 阈值从高到低
+SIM_WEIGHT, RET_WEIGHT = 0.7, 0.3
+
 
 def now_ms():
     return int(datetime.now(TZ_CN).timestamp() * 1000)
 
 
-def calc_retention(memory_level, last_recall_ts, recall_count=0):
+def calc_retention(memory_level, last_recall_ts, recall_count=0, now=None):
     if memory_level == "permanent":
         return 1.0
     S = HALF_LIFE.get(memory_level, 24)
-    t_hours = max(0, (now_ms() - last_recall_ts) / 3600000)
-    return min(1.0, math.exp(-t_hours / S) * (max(1, recall_count) ** 0.3))
+    t_hours = max(0, ((now or now_ms()) - last_recall_ts) / 3600000)
+    # 与 retention_array 走同一套 numpy 运算，逐位一致
+    return float(min(1.0, np.exp(-t_hours / S) * np.power(float(max(1, recall_count)), 0.3)))
+
+
+def retention_array(levels, last_recall_ts, recall_counts, now=None):
+    """calc_retention 的整列版本，所有行共用同一个 now 快照"""
+    levels = np.asarray(levels, dtype=object)
+    n = len(levels)
+    S = np.fromiter((HALF_LIFE.get(lv, 24) or 1 for lv in levels), dtype=np.float64, count=n)
+    t_hours = np.maximum(0, ((now or now_ms()) - np.asarray(last_recall_ts, dtype=np.int64)) / 3600000)
+    boost = np.power(np.maximum(1, np.asarray(recall_counts, dtype=np.int64)).astype(np.float64), 0.3)
+    ret = np.minimum(1.0, np.exp(-t_hours / S) * boost)
+    ret[levels == "permanent"] = 1.0
+    return ret
 
 
 def check_upgrade(memory_level, recall_count):
     if memory_level == "permanent":
         return "permanent"
-    for threshold in sorted(UPGRADE_THRESHOLDS.keys(), reverse=True):
-        if recall_count >= threshold:
-            target = UPGRADE_THRESHOLDS[threshold]
-            if LEVEL_ORDER.index(target) > LEVEL_ORDER.index(memory_level):
-                return target
+    rank = _LEVEL_RANK.get(memory_level, -1)
+    for threshold, target in _UPGRADE_STEPS:
+        if recall_count >= threshold and _LEVEL_RANK[target] > rank:
+            return target
     return memory_level
 
 
-def format_item(r, similarity=None):
+def upgrade_levels(levels, recall_counts):
+    """check_upgrade 的整列版本，返回升级后的层级数组（object）"""
+    levels = np.asarray(levels, dtype=object)
+    counts = np.asarray(recall_counts, dtype=np.int64)
+    rank = np.fromiter((_LEVEL_RANK.get(lv, -1) for lv in levels), dtype=np.int64, count=len(levels))
+    out = levels.copy()
+    done = levels == "permanent"
+    for threshold, target in _UPGRADE_STEPS:
+        hit = ~done & (counts >= threshold) & (rank < _LEVEL_RANK[target])
+        out[hit] = target
+        done |= hit
+    return out
+
+
+def final_score(similarity, retention):
+    return similarity * SIM_WEIGHT + retention * RET_WEIGHT
+
+
+def final_scores(similarities, retention):
+    """final_score 的整列版本"""
+    return np.asarray(similarities, dtype=np.float64) * SIM_WEIGHT + np.asarray(retention, dtype=np.float64) * RET_WEIGHT
+
+
+def cosine_topk(matrix, norms, query, k):
+    """精确余弦 top-k：matrix 每行一个向量，norms 为各行模长。返回 (行号, 相似度)，按相似度降序"""
+    q = np.asarray(query, dtype=np.float32)
+    denom = norms * (np.linalg.norm(q) or 1.0)
+    sims = (matrix @ q) / np.where(denom > 0, denom, 1.0)
+    k = min(k, len(sims))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top], kind="stable")]
+    return top, sims[top]
+
+
+def row_columns(rows):
+    """从行里取出 层级 / 最近召回时间 / 召回次数 三列，缺省值与 format_item 一致"""
+    levels = [r.get("memory_level", "flash") for r in rows]
+    last = [r.get("last_recall", r.get("timestamp", 0)) for r in rows]
+    counts = [r.get("recall_count", 0) for r in rows]
+    return levels, last, counts
+
+
+def format_item(r, similarity=None, retention=None):
     ts = r.get("timestamp", 0)
     level = r.get("memory_level", "flash")
     rc = r.get("recall_count", 0)
     lr = r.get("last_recall", ts)
-    ret = calc_retention(level, lr, rc)
+    ret = calc_retention(level, lr, rc) if retention is None else retention
     item = {
         "id": r.get("id"),
         "content": r.get("content"),
@@ -52,3 +113,11 @@ def format_item(r, similarity=None):
     if similarity is not None:
         item["similarity"] = similarity
     return item
+
+
+def format_items(rows, now=None):
+    """整页格式化：保留率一次算完，再逐行拼字段"""
+    if not rows:
+        return []
+    ret = retention_array(*row_columns(rows), now=now)
+    return [format_item(r, retention=float(x)) for r, x in zip(rows, ret)]
@@ -0,0 +1,264 @@
+"""运行指标 - Prometheus文本格式的计数器/直方图/仪表，固定分桶、无锁，常开也几乎零开销
+
+所有写入都发生在事件循环线程里（编码线程的耗时也是回到循环后再记），因此不加锁；
+读（/metrics 渲染）同样在循环里，拿到的是一致快照。
+"""
+import functools
+import inspect
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Tuple
+
+import tracing
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 被计时的 MemoryStore 方法：公开接口 + 每次都要打到后端的原语
+STORE_METHODS = (
+    "write", "write_many", "import_rows", "update", "set_level", "set_level_many",
+    "apply_recalls", "delete", "stats", "dashboard", "cleanup", "export_all",
+    "search", "search_many", "get_by_id", "list_all", "count", "query_by_category",
+    "_query_ids", "_insert_rows", "_upsert_rows", "_delete_ids",
+    "_query_permanent", "_ann_search_many",
+)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[tuple, object] = {}
+
+    def _init_series(self):
+        # 无标签的指标一开始就输出0，抓取端不用处理"缺失"
+        if not self.labelnames:
+            self.labels()
+
+    def labels(self, *values):
+        key = tuple(map(str, values))
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = self._new()
+        return s
+
+    @abstractmethod
+    def _new(self):
+        """新建一个标签组合的序列对象"""
+
+    @abstractmethod
+    def _render_series(self, key: tuple, s) -> list: ...
+
+    def _label_str(self, key: tuple, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, s in sorted(self._series.items()):
+            lines.extend(self._render_series(key, s))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_series(self, key, s):
+        return [f"{self.name}{self._label_str(key)} {_fmt(s.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # 最后一格是 +Inf，各格不累计，渲染时再累加
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_series(self, key, s):
+        lines, acc = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), s.counts):
+            acc += n
+            le = 'le="' + _fmt(bound) + '"'
+            lines.append(f"{self.name}_bucket{self._label_str(key, le)} {acc}")
+        lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(s.sum)}")
+        lines.append(f"{self.name}_count{self._label_str(key)} {acc}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        metric._init_series()
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STORE_SECONDS = REGISTRY.register(Histogram(
+    "recalldoggy_store_seconds", "MemoryStore 方法耗时", ("backend", "method", "user")))
+STORE_ERRORS = REGISTRY.register(Counter(
+    "recalldoggy_store_errors_total", "MemoryStore 方法抛出的异常数", ("backend", "method", "user")))
+ENCODER_BATCH = REGISTRY.register(Histogram(
+    "recalldoggy_encoder_batch_size", "每次推理的文本条数", buckets=SIZE_BUCKETS))
+ENCODER_SECONDS = REGISTRY.register(Histogram(
+    "recalldoggy_encoder_seconds", "每批推理耗时"))
+ENCODER_ERRORS = REGISTRY.register(Counter(
+    "recalldoggy_encoder_errors_total", "推理失败的批数"))
+TOOL_SECONDS = REGISTRY.register(Histogram(
+    "recalldoggy_mcp_tool_seconds", "MCP工具调用耗时", ("tool", "plugin", "status")))
+RECALLS_QUEUED = REGISTRY.register(Counter(
+    "recalldoggy_recalls_total", "被召回的记忆条数（搜索命中）"))
+RECALL_FLUSH_ROWS = REGISTRY.register(Histogram(
+    "recalldoggy_recall_flush_rows", "每次写回的doc_id数", buckets=SIZE_BUCKETS))
+RECALL_FLUSH_SECONDS = REGISTRY.register(Histogram(
+    "recalldoggy_recall_flush_seconds", "召回队列每次写回耗时"))
+RECALL_FAILURES = REGISTRY.register(Counter(
+    "recalldoggy_recall_failures_total", "写回失败的doc_id数（会并回队列重试）"))
+RECALLS_DROPPED = REGISTRY.register(Counter(
+    "recalldoggy_recalls_dropped_total", "队列积压超上限时丢弃的新doc_id数"))
+PLUGIN_ROUTE_SECONDS = REGISTRY.register(Histogram(
+    "recalldoggy_plugin_route_seconds", "插件HTTP路由耗时", ("plugin", "route", "status")))
+ENTITIES = REGISTRY.register(Gauge(
+    "recalldoggy_entities", "各层级记忆条数", ("user", "level")))
+
+
+def backend_label(store) -> str:
+    name = type(store).__name__.replace("MemoryStore", "").lower() or "base"
+    inner = getattr(store, "backend", None)
+    return f"{name}:{backend_label(inner)}" if inner is not None else name
+
+
+def _timed_method(fn: Callable, backend: str, method: str) -> Callable:
+    """user 取自调用实参（按名或按位置），没有 user 参数的方法记为 "-"。
+    同时开一个追踪span，后端原语（下划线开头）计入trace的后端调用次数"""
+    span_name = f"{backend}.{method}"
+    is_backend = method.startswith("_")
+    params = list(inspect.signature(fn).parameters.values())
+    names = [p.name for p in params]
+    pos = names.index("user") if "user" in names else None
+    default = params[pos].default if pos is not None else "-"
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if pos is None:
+            user = "-"
+        elif "user" in kwargs:
+            user = kwargs["user"]
+        else:
+            user = args[pos] if len(args) > pos else default
+        start = time.perf_counter()
+        try:
+            with tracing.span(span_name, backend=is_backend):
+                return await fn(*args, **kwargs)
+        except Exception:
+            STORE_ERRORS.labels(backend, method, user).inc()
+            raise
+        finally:
+            STORE_SECONDS.labels(backend, method, user).observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def instrument_store(store) -> None:
+    """把实例上的方法换成计时版本；内部 self.xxx 调用同样会被记到"""
+    backend = backend_label(store)
+    for method in STORE_METHODS:
+        fn = getattr(store, method, None)
+        if fn is not None and inspect.iscoroutinefunction(fn):
+            setattr(store, method, _timed_method(fn, backend, method))
+    inner = getattr(store, "backend", None)
+    if inner is not None:
+        instrument_store(inner)
+
+
+def instrument_tools(mcp_server, plugin_of: Callable[[str], Optional[str]] = lambda name: None) -> None:
+    """所有工具（含插件运行时注册的）最终都经过 ToolManager.call_tool，在这一处计时并开trace"""
+    mgr = mcp_server._tool_manager
+    call_tool = mgr.call_tool
+
+    @functools.wraps(call_tool)
+    async def timed(name, arguments, *args, **kwargs):
+        start, status = time.perf_counter(), "ok"
+        try:
+            with tracing.trace(f"mcp {name}"):
+                return await call_tool(name, arguments, *args, **kwargs)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            TOOL_SECONDS.labels(name, plugin_of(name) or "", status).observe(time.perf_counter() - start)
+
+    mgr.call_tool = timed
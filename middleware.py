@@ -0,0 +1,255 @@
+"""中间件 - 纯ASGI的认证与请求日志：凭据常驻内存，路径按预计算集合判断，不包 BaseHTTPMiddleware"""
+import asyncio
+import hmac
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+import bcrypt
+from starlette.responses import JSONResponse, RedirectResponse
+
+import metrics
+import tracing
+
+logger = logging.getLogger("recalldoggy")
+
+PUBLIC_PATHS = frozenset({"/plugins", "/api/plugins", "/login", "/setup", "/favicon.ico", "/health"})
+MCP_HEADS = frozenset({"/mcp", "/mcp-http"})        # SSE 与 streamable-HTTP 两个挂载点
+BEARER_HEADS = MCP_HEADS | {"/api"}                 # 按第一段路径判断
+BEARER_PATHS = frozenset({"/metrics"})
+UNLOGGED_PATHS = frozenset({"/favicon.ico", "/health"})
+# 不开HTTP级trace：指标/追踪自身，以及MCP长连接（工具调用在 call_tool 处各自开trace）
+UNTRACED_HEADS = MCP_HEADS
+UNTRACED_PATHS = frozenset({"/metrics"})
+
+
+def _head(path: str) -> str:
+    return "/" + path.split("/", 2)[1] if len(path) > 1 else path
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for k, v in scope["headers"]:
+        if k == name:
+            return v.decode("latin-1")
+    return None
+
+
+class HasherBusy(RuntimeError):
+    pass
+
+
+class PasswordHasher:
+    """bcrypt 刻意很慢（100~300ms纯CPU），放到独立的小线程池里跑，不占事件循环。
+    max_pending 限制同时在算/排队的个数，满了直接抛 HasherBusy，撞库流量不会在内存里堆积"""
+
+    def __init__(self, workers: int = 2, max_pending: int = 8):
+        self.max_pending = max(1, max_pending)
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="bcrypt")
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            raise HasherBusy("密码校验繁忙")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def check(self, password: str, hashed: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    async def hash(self, password: str) -> str:
+        h = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+        return h.decode()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoginLimiter:
+    """ip -> 窗口内的登录尝试时间。每个IP最多记 max_attempts 条；最多跟踪 max_ips 个IP，
+    满了淘汰最久没尝试的；每 sweep_interval 秒顺手清掉窗口已过的IP（按最近尝试排序，只看队头）"""
+
+    def __init__(self, max_attempts: int = 5, window: float = 600.0,
+                 max_ips: int = 10000, sweep_interval: float = 60.0):
+        self.max_attempts = max(1, max_attempts)
+        self.window = window
+        self.max_ips = max(1, max_ips)
+        self.sweep_interval = sweep_interval
+        self._ips: "OrderedDict[str, deque]" = OrderedDict()
+        self._swept = time.monotonic()
+
+    def _sweep(self, now: float):
+        self._swept = now
+        while self._ips:
+            ip, attempts = next(iter(self._ips.items()))
+            if now - attempts[-1] <= self.window:
+                break
+            del self._ips[ip]
+
+    def acquire(self, ip: str) -> float:
+        """记一次尝试；返回 0 表示放行，否则为还要等多少秒。
+        校验前就计数，同一IP并发打进来也最多放行 max_attempts 次"""
+        now = time.monotonic()
+        if now - self._swept >= self.sweep_interval:
+            self._sweep(now)
+        attempts = self._ips.get(ip)
+        if attempts is None:
+            attempts = self._ips[ip] = deque(maxlen=self.max_attempts)
+            while len(self._ips) > self.max_ips:
+                self._ips.popitem(last=False)
+        while attempts and now - attempts[0] > self.window:
+            attempts.popleft()
+        if len(attempts) >= self.max_attempts:
+            return self.window - (now - attempts[0])
+        attempts.append(now)
+        self._ips.move_to_end(ip)
+        return 0.0
+
+    def release(self, ip: str):
+        """撤回一次 acquire：请求还没真正校验密码就被拒（如 HasherBusy），不该占用尝试次数"""
+        attempts = self._ips.get(ip)
+        if attempts:
+            attempts.pop()
+            if not attempts:
+                del self._ips[ip]
+
+    def remaining(self, ip: str) -> int:
+        attempts = self._ips.get(ip)
+        return self.max_attempts - (len(attempts) if attempts else 0)
+
+    def reset(self, ip: str):
+        self._ips.pop(ip, None)
+
+    def __len__(self):
+        return len(self._ips)
+
+
+class Credentials:
+    """密码哈希与 MCP_TOKEN 缓存在内存。set_password 直接更新缓存；
+    文件被外部改动（手动重置密码）时按 mtime 发现，最多每 check_interval 秒 stat 一次。
+    bcrypt 计算都走 hasher 的线程池"""
+
+    def __init__(self, path: str, check_interval: float = 2.0, hasher: Optional[PasswordHasher] = None):
+        self.path = path
+        self.hasher = hasher or PasswordHasher()
+        self.check_interval = check_interval
+        self._hash: Optional[str] = None
+        self._token: Optional[str] = None
+        self._mtime: Optional[int] = None
+        self._loaded_path: Optional[str] = None
+        self._checked = float("-inf")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval and self._loaded_path == self.path:
+            return
+        self._checked = now
+        self._token = os.getenv("MCP_TOKEN")
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._hash, self._mtime, self._loaded_path = None, None, self.path
+            return
+        if mtime != self._mtime or self._loaded_path != self.path:
+            with open(self.path, "r") as f:
+                self._hash = f.read().strip() or None
+            self._mtime, self._loaded_path = mtime, self.path
+
+    def password_hash(self) -> Optional[str]:
+        self._refresh()
+        return self._hash
+
+    def mcp_token(self) -> Optional[str]:
+        self._refresh()
+        return self._token
+
+    async def verify(self, password: str) -> bool:
+        stored = self.password_hash()
+        return bool(stored) and await self.hasher.check(password, stored)
+
+    async def set_password(self, password: str):
+        h = await self.hasher.hash(password)
+        with open(self.path, "w") as f:
+            f.write(h)
+        self._hash = h
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._loaded_path = self.path
+
+
+class AuthMiddleware:
+    """/mcp、/api、/metrics 走 Bearer token；页面走 session（需在 SessionMiddleware 内层）；未设密码时引导到 /setup"""
+
+    def __init__(self, app, credentials: Credentials):
+        self.app = app
+        self.credentials = credentials
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path in PUBLIC_PATHS:
+            return await self.app(scope, receive, send)
+        head = _head(path)
+        if not self.credentials.password_hash() and head not in MCP_HEADS:
+            return await RedirectResponse(url="/setup")(scope, receive, send)
+        if head in BEARER_HEADS or path in BEARER_PATHS:
+            auth = _header(scope, b"authorization") or ""
+            token = auth[7:] if auth.startswith("Bearer ") else auth
+            expected = self.credentials.mcp_token()
+            if not expected or not hmac.compare_digest(token.encode(), expected.encode()):
+                return await JSONResponse({"error": "Unauthorized"}, status_code=401)(scope, receive, send)
+            return await self.app(scope, receive, send)
+        if not (scope.get("session") or {}).get("authed"):
+            if head == "/api":
+                return await JSONResponse({"error": "Not logged in"}, status_code=401)(scope, receive, send)
+            return await RedirectResponse(url="/login")(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+
+class RequestLogMiddleware:
+    """访问日志 + 请求级trace（请求头带 X-Trace 必采，并在响应头回传trace id）+ 插件路由耗时。
+    耗时按整个响应（含流式body）计"""
+
+    def __init__(self, app, plugin_of: Callable[[object], Optional[str]] = lambda route: None):
+        self.app = app
+        self.plugin_of = plugin_of
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNLOGGED_PATHS:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        method, path = scope["method"], scope["path"]
+        want_trace = _header(scope, b"x-trace") is not None
+        quiet = path in UNTRACED_PATHS or _head(path) in UNTRACED_HEADS or path.startswith("/api/traces")
+        status = 500
+        with (nullcontext() if quiet else tracing.trace(f"{method} {path}", force=want_trace)) as t:
+            trace_header = [(b"x-trace", t.id.encode())] if want_trace and t is not None else None
+
+            async def send_wrapper(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if trace_header:
+                        message = {**message, "headers": list(message.get("headers", [])) + trace_header}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if t is not None:
+                    t.attrs["status"] = status
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                plugin = self.plugin_of(route)
+                if plugin:
+                    metrics.PLUGIN_ROUTE_SECONDS.labels(plugin, route.path, status).observe(elapsed)
+                client = scope.get("client")
+                ip = client[0] if client else "unknown"
+                level = logging.WARNING if status >= 400 else logging.INFO
+                logger.log(level, f"{method} {path} | {status} | {round(elapsed * 1000, 1)}ms | {ip}")
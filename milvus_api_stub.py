@@ -0,0 +1,194 @@
+"""Milvus API 参考桩 - 进程内实现 HttpMemoryStore 用到的远程接口子集（含二进制向量传输），供本地联调/测试
+
+    uvicorn milvus_api_stub:app --port 19531
+    MILVUS_API_URL=http://127.0.0.1:19531 MILVUS_WIRE_FORMAT=msgpack python app.py
+"""
+import os
+import sqlite3
+from typing import Dict
+
+import numpy as np
+from fastapi import FastAPI, Request, Response
+
+from local_store import to_sql
+from memory import cosine_topk
+from store import ALL_FIELDS
+from wire import WIRE_FORMATS, dumps, loads, encode_vec, decode_vec
+
+_SCALARS = [f for f in ALL_FIELDS if f != "id"]
+
+
+class _Collection:
+    """标量放内存SQLite（过滤表达式复用 local_store.to_sql），向量放 id -> ndarray"""
+
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        cols = ", ".join(f'"{f}"' for f in _SCALARS)
+        self.db.execute(f'CREATE TABLE rows ("id" TEXT PRIMARY KEY, {cols})')
+        self.vectors: Dict[str, np.ndarray] = {}
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def upsert(self, rows: list, partial: bool):
+        for r in rows:
+            exists = r["id"] in self.vectors
+            if partial and exists:
+                fields = [f for f in _SCALARS if f in r]
+                if fields:
+                    sets = ", ".join(f'"{f}" = ?' for f in fields)
+                    self.db.execute(f"UPDATE rows SET {sets} WHERE id = ?",
+                                    [r[f] for f in fields] + [r["id"]])
+            else:
+                cols = ["id"] + _SCALARS
+                self.db.execute(
+                    "INSERT OR REPLACE INTO rows (" + ", ".join(f'"{c}"' for c in cols) + ") "
+                    f"VALUES ({', '.join('?' * len(cols))})",
+                    [r.get(c) for c in cols],
+                )
+            if r.get("embedding") is not None:
+                self.vectors[r["id"]] = np.asarray(r["embedding"], dtype=np.float32)
+        self.db.commit()
+
+    def query(self, expr: str, fields: list, limit: int = 16384, offset: int = 0) -> list:
+        where, params = to_sql(expr) if expr else ("1", [])
+        cols = ", ".join(f'"{f}"' for f in ["id"] + [f for f in fields if f in _SCALARS])
+        rows = [dict(r) for r in self.db.execute(
+            f"SELECT {cols} FROM rows WHERE {where} ORDER BY id LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        )]
+        if "embedding" in fields:
+            for r in rows:
+                r["embedding"] = self.vectors[r["id"]]
+        return rows
+
+    def delete(self, expr: str):
+        where, params = to_sql(expr)
+        ids = [r[0] for r in self.db.execute(f"SELECT id FROM rows WHERE {where}", params)]
+        self.db.execute(f"DELETE FROM rows WHERE {where}", params)
+        self.db.commit()
+        for i in ids:
+            self.vectors.pop(i, None)
+
+    def search(self, vec, limit: int, expr: str, fields: list) -> list:
+        cand = self.query(expr, fields, limit=1 << 30)
+        if not cand:
+            return []
+        mat = np.stack([self.vectors[r["id"]] for r in cand])
+        top, sims = cosine_topk(mat, np.linalg.norm(mat, axis=1), vec, limit)
+        return [{"id": cand[i]["id"], "distance": float(s),
+                 "entity": {k: v for k, v in cand[i].items() if k != "id"}}
+                for i, s in zip(top, sims)]
+
+
+app = FastAPI()
+collections: Dict[str, _Collection] = {}
+API_KEY = os.getenv("MILVUS_API_KEY", "")
+QUERY_WINDOW = 16384                # 与 Milvus 一致：query 的 offset + limit 不能超过它
+ORDERED_QUERY = True                # 是否在 /capabilities 声明结果按主键排序（测试可关掉模拟旧服务端）
+
+
+async def _body(request: Request) -> dict:
+    body = loads(await request.body(), request.headers.get("content-type"))
+    data = body.get("data")
+    if isinstance(data, list):
+        for i, v in enumerate(data):
+            if not isinstance(v, dict):
+                data[i] = decode_vec(v)                 # /search 的查询向量
+            elif v.get("embedding") is not None:
+                v["embedding"] = decode_vec(v["embedding"])
+    return body
+
+
+def _reply(request: Request, payload: dict, enc: str = "json") -> Response:
+    for r in payload.get("results", []):
+        for row in (r if isinstance(r, list) else [r]):
+            target = row.get("entity", row)
+            if isinstance(target.get("embedding"), np.ndarray):
+                target["embedding"] = encode_vec(target["embedding"], enc)
+    fmt = "msgpack" if "msgpack" in request.headers.get("accept", "") else "json"
+    content, ctype = dumps(payload, fmt)
+    return Response(content, media_type=ctype)
+
+
+@app.middleware("http")
+async def auth(request: Request, call_next):
+    if API_KEY and request.headers.get("Authorization") != f"Bearer {API_KEY}":
+        return Response(status_code=401)
+    return await call_next(request)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/capabilities")
+async def capabilities():
+    return {"vector_encodings": list(WIRE_FORMATS), "ordered_query": ORDERED_QUERY}
+
+
+@app.get("/collection/has/{name}")
+async def has(name: str):
+    return {"exists": name in collections}
+
+
+@app.post("/collection/create_schema")
+async def create(request: Request):
+    body = await _body(request)
+    collections.setdefault(body["collection_name"], _Collection())
+    return _reply(request, {"status": "ok"})
+
+
+@app.get("/count/{name}")
+async def count(name: str):
+    col = collections.get(name)
+    return {"count": col.count() if col else 0}
+
+
+@app.post("/insert")
+async def insert(request: Request):
+    body = await _body(request)
+    collections[body["collection_name"]].upsert(body["data"], partial=False)
+    return _reply(request, {"insert_count": len(body["data"])})
+
+
+@app.post("/upsert")
+async def upsert(request: Request):
+    body = await _body(request)
+    collections[body["collection_name"]].upsert(body["data"], bool(body.get("partial_update")))
+    return _reply(request, {"upsert_count": len(body["data"])})
+
+
+@app.post("/delete")
+async def delete(request: Request):
+    body = await _body(request)
+    collections[body["collection_name"]].delete(body["filter"])
+    return _reply(request, {"status": "ok"})
+
+
+@app.post("/query")
+async def query(request: Request):
+    body = await _body(request)
+    limit, offset = body.get("limit", QUERY_WINDOW), body.get("offset", 0)
+    if offset + limit > QUERY_WINDOW:
+        return Response(f"offset + limit must be <= {QUERY_WINDOW}", status_code=400)
+    rows = collections[body["collection_name"]].query(
+        body.get("filter", ""), body.get("output_fields", []), limit, offset,
+    )
+    return _reply(request, {"results": rows}, body.get("vector_encoding", "json"))
+
+
+@app.post("/search")
+async def search(request: Request):
+    body = await _body(request)
+    col = collections[body["collection_name"]]
+    results = [col.search(v, body.get("limit", 10), body.get("filter", ""),
+                          body.get("output_fields", [])) for v in body["data"]]
+    return _reply(request, {"results": results}, body.get("vector_encoding", "json"))
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("PORT", "19531")))
@@ -0,0 +1,79 @@
+"""permanent记忆缓存 - 每个user的permanent集合常驻内存，变更时失效，TTL兜底"""
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+
+class PermanentCache:
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._data: Dict[str, tuple] = {}   # user -> (过期时间, rows)
+        self._owner: Dict[str, str] = {}    # doc_id -> user
+        # 每次失效代数+1：载入开始时记下代数，结束时变了就不回填（载入期间有写入，结果已过时）
+        self._gen: Dict[str, int] = {}
+        self._epoch = 0
+        self.loading: Dict[str, asyncio.Task] = {}      # user -> 进行中的载入（MemoryStore 的singleflight）
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user: str) -> Optional[list]:
+        entry = self._data.get(user)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        if entry:
+            self.invalidate(user)
+        self.misses += 1
+        return None
+
+    def generation(self, user: str) -> Tuple[int, int]:
+        return self._epoch, self._gen.get(user, 0)
+
+    def put(self, user: str, rows: list, generation: Optional[Tuple[int, int]] = None) -> bool:
+        """generation 为载入开始时的 generation(user)；期间被失效过就丢弃这份结果，返回False"""
+        if generation is not None and generation != self.generation(user):
+            return False
+        self.invalidate(user)
+        self._data[user] = (time.monotonic() + self.ttl, rows)
+        for r in rows:
+            self._owner[r["id"]] = user
+        return True
+
+    def invalidate(self, user: Optional[str] = None):
+        if user is None:
+            self._epoch += 1
+            self._data.clear()
+            self._owner.clear()
+            self.loading.clear()
+            return
+        self._gen[user] = self._gen.get(user, 0) + 1
+        # 之后的请求不再合并到失效前发起的载入上
+        self.loading.pop(user, None)
+        entry = self._data.pop(user, None)
+        if entry:
+            for r in entry[1]:
+                self._owner.pop(r["id"], None)
+
+    def invalidate_id(self, doc_id: str):
+        user = self._owner.get(doc_id)
+        if user is not None:
+            self.invalidate(user)
+
+    def patch(self, doc_id: str, fields: dict):
+        """召回只改计数/时间，原地更新，不必整组失效"""
+        user = self._owner.get(doc_id)
+        entry = self._data.get(user) if user is not None else None
+        if not entry:
+            return
+        for r in entry[1]:
+            if r["id"] == doc_id:
+                r.update(fields)
+                break
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._data), "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,117 @@
+"""召回写回队列 - 搜索只记账，后台按doc_id合并后批量刷回存储"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from memory import now_ms
+from metrics import RECALL_FLUSH_ROWS, RECALL_FLUSH_SECONDS, RECALL_FAILURES, RECALLS_DROPPED
+
+logger = logging.getLogger("recalldoggy")
+
+BACKLOG_FACTOR = 4          # 挂起数到 max_pending × 该倍数后不再收新doc_id（已有的照样合并）
+
+
+class RecallQueue:
+    """doc_id -> [累计召回次数, 最近召回时间]，定时或攒满一批时刷给 store.apply_recalls。
+
+    max_pending:    挂起多少个doc_id时提前唤醒后台写回；put 从不等待写回，
+                    后端慢到积压超过 max_pending × BACKLOG_FACTOR 时丢弃新doc_id
+    写回失败的批次并回队列，下一轮重试
+    batch_size:     每次交给 store 的doc_id数
+    flush_interval: 后台定时刷新间隔（秒）
+    """
+
+    def __init__(self, store, max_pending: int = 1000, batch_size: int = 100,
+                 flush_interval: float = 2.0):
+        self.store = store
+        self.max_pending = max(1, max_pending)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, List[int]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def put(self, doc_ids: Iterable[str], ts: Optional[int] = None):
+        self._ensure_started()
+        ts = ts or now_ms()
+        cap = self.max_pending * BACKLOG_FACTOR
+        dropped = 0
+        for doc_id in doc_ids:
+            cur = self._pending.get(doc_id)
+            if cur:
+                cur[0] += 1
+                cur[1] = max(cur[1], ts)
+            elif len(self._pending) < cap:
+                self._pending[doc_id] = [1, ts]
+            else:
+                dropped += 1
+        if dropped:
+            RECALLS_DROPPED.inc(dropped)
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def _merge_back(self, chunk: Dict[str, List[int]]):
+        for doc_id, (count, ts) in chunk.items():
+            cur = self._pending.get(doc_id)
+            if cur:
+                cur[0] += count
+                cur[1] = max(cur[1], ts)
+            else:
+                self._pending[doc_id] = [count, ts]
+
+    async def flush(self) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            start = time.perf_counter()
+            for i in range(0, len(items), self.batch_size):
+                chunk = dict(items[i:i + self.batch_size])
+                try:
+                    await self.store.apply_recalls(chunk)
+                except Exception as e:
+                    RECALL_FAILURES.inc(len(chunk))
+                    self._merge_back(chunk)
+                    logger.warning(f"召回写回失败，并回队列: {len(chunk)}条 | {e}")
+            RECALL_FLUSH_ROWS.observe(len(items))
+            RECALL_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            return len(items)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await asyncio.shield(self.flush())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        n = await self.flush()
+        if n:
+            logger.info(f"召回队列已排空: {n}条")
+        if self._pending:
+            logger.warning(f"召回写回失败，丢弃: {len(self._pending)}条")
+            self._pending = {}
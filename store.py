@@ -1,89 +1,537 @@
 """数据库抽象层 - MemoryStore基类 + ZillizMemoryStore实现"""
+import asyncio
 import hashlib
 import logging
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import numpy as np
 
 from pymilvus import (
     connections, Collection, FieldSchema,
     CollectionSchema, DataType, utility
 )
 
+from perm_cache import PermanentCache
+from aggregates import AggregateRegistry, UserAggregate
+from calendar_service import AnniversaryIndex
 from memory import (
     TZ_CN, LEVEL_ORDER,
-    now_ms, calc_retention, check_upgrade, format_item
+    now_ms, retention_array, upgrade_levels, final_scores, row_columns,
+    format_items
 )
+from metrics import RECALLS_QUEUED
+from tracing import span
 
 logger = logging.getLogger("recalldoggy")
 
 COLLECTION_NAME = "ai_knowledge"
 EMBEDDING_DIM = 384
+WRITE_CHUNK = 1000
+FLUSH_POLICIES = ("immediate", "none", "background")
+SCAN_PAGE_SIZE = 1000
+DELETE_CHUNK = 500
+CLEANUP_FIELDS = ["id", "memory_level", "last_recall", "recall_count"]
+AGG_FIELDS = ["id", "memory_level", "category", "timestamp"]
+PERM_MARGIN = 10            # permanent集合未缓存时，ANN 先按 top_k + PERM_MARGIN 并发超取
+SEARCH_FIELDS = [
+    "content", "category", "tags", "timestamp",
+    "memory_level", "recall_count", "last_recall", "user"
+]
 ALL_FIELDS = [
     "id", "content", "category", "tags", "timestamp",
     "memory_level", "recall_count", "last_recall", "user"
 ]
 
 
+def ids_expr(ids: list) -> str:
+    return "id in [" + ", ".join(f'"{i}"' for i in ids) + "]"
+
+
 class MemoryStore(ABC):
 
+    def __init__(self, partial_update: bool = True):
+        self.partial_update = partial_update
+        self.recall_queue = None
+        self.perm_cache = PermanentCache()
+        self.aggregates = AggregateRegistry()
+        self.anniversaries = AnniversaryIndex()
+        self.scan_page_size = SCAN_PAGE_SIZE
+        self.perm_margin = PERM_MARGIN
+
     @abstractmethod
     async def connect(self) -> None: ...
 
     @abstractmethod
-    async def write(self, content: str, embedding: list, category: str,
-                    tags: list, memory_level: str, user: str = "default") -> dict: ...
+    async def get_by_id(self, doc_id: str) -> Optional[dict]: ...
 
     @abstractmethod
-    async def search(self, query_vec: list, top_k: int,
-                     user: str = "default", update_recall: bool = True) -> dict: ...
+    async def list_all(self, limit: int, offset: int,
+                       user: str = "default") -> dict: ...
 
     @abstractmethod
-    async def delete(self, doc_id: str) -> bool: ...
+    async def count(self) -> int: ...
 
     @abstractmethod
-    async def update(self, doc_id: str, content: str, embedding: list,
-                     category: str, tags: list) -> dict: ...
+    async def query_by_category(self, category: str, fields: list,
+                                limit: int, user: str = "default") -> list: ...
 
-    @abstractmethod
-    async def get_by_id(self, doc_id: str) -> Optional[dict]: ...
+    # ── 后端原语 ──────────────────────────────────
 
     @abstractmethod
-    async def list_all(self, limit: int, offset: int,
-                       user: str = "default") -> dict: ...
+    async def _query_ids(self, ids: list, fields: list) -> list: ...
 
     @abstractmethod
-    async def set_level(self, doc_id: str, level: str) -> dict: ...
+    async def _insert_rows(self, rows: list) -> None: ...
 
     @abstractmethod
-    async def cleanup(self, threshold: float, user: str = "default") -> int: ...
+    async def _delete_ids(self, ids: list) -> None: ...
 
     @abstractmethod
-    async def do_recall(self, doc_id: str) -> None: ...
+    def scan(self, expr: str, fields: list,
+             page_size: Optional[int] = None) -> AsyncIterator[list]:
+        """按页流式读取满足expr的全部行（每页最多page_size条），不受16384上限限制"""
 
     @abstractmethod
-    async def stats(self, user: str = "default") -> dict: ...
+    async def _upsert_rows(self, rows: list, partial: bool) -> None: ...
 
     @abstractmethod
-    async def dashboard(self, user: str = "default") -> dict: ...
+    async def _query_permanent(self, user: str) -> list: ...
 
     @abstractmethod
-    async def export_all(self, user: str = "default") -> list: ...
+    async def _ann_search_many(self, query_vecs: list, limit: int, user: str) -> list:
+        """每个查询向量按余弦相似度取该user的前limit条。
+        返回与 query_vecs 对应的 [[(id, entity, similarity)], ...]，entity含SEARCH_FIELDS"""
+
+    async def _load_permanent(self, user: str) -> list:
+        """同一user并发未命中时只查一次后端，其余等同一个任务；失效会摘掉进行中的任务"""
+        loading = self.perm_cache.loading
+        task = loading.get(user)
+        if task is None:
+            task = loading[user] = asyncio.ensure_future(self._fetch_permanent(user))
+            task.add_done_callback(lambda t: loading.pop(user) if loading.get(user) is t else None)
+        return await asyncio.shield(task)
+
+    async def _fetch_permanent(self, user: str) -> list:
+        gen = self.perm_cache.generation(user)
+        with span("permanent") as sp:
+            rows = await self._query_permanent(user)
+            sp.set(rows=len(rows))
+        self.perm_cache.put(user, rows, gen)
+        return rows
+
+    async def _permanent(self, user: str) -> list:
+        rows = self.perm_cache.get(user)
+        if rows is None:
+            rows = await self._load_permanent(user)
+        return rows
 
-    @abstractmethod
-    async def count(self) -> int: ...
+    def _user_expr(self, user: str, extra: str = "") -> str:
+        base = f'user == "{user}"'
+        return f"{base} and {extra}" if extra else base
 
-    @abstractmethod
-    async def query_by_category(self, category: str, fields: list,
-                                limit: int, user: str = "default") -> list: ...
+    async def _flush(self, rows: int = 1) -> None:
+        """写入后的落盘钩子，rows为本次变更行数"""
+        pass
 
+    async def _update_fields(self, rows: list) -> None:
+        """rows: 每行含 id + 需要改的标量字段。后端不支持部分更新时补全整行再upsert"""
+        if not rows:
+            return
+        if self.partial_update:
+            await self._upsert_rows(rows, partial=True)
+            return
+        full = {r["id"]: r for r in await self._query_ids(
+            [r["id"] for r in rows], ALL_FIELDS + ["embedding"]
+        )}
+        merged = [{**full[r["id"]], **r} for r in rows if r["id"] in full]
+        await self._upsert_rows(merged, partial=False)
 
-class ZillizMemoryStore(MemoryStore):
+    async def write(self, content: str, embedding: list, category: str,
+                    tags: list, memory_level: str, user: str = "default") -> dict:
+        res = (await self.write_many([{
+            "content": content, "embedding": embedding, "category": category,
+            "tags": tags, "memory_level": memory_level,
+        }], user))[0]
+        if res["status"] == "success":
+            logger.info(f"写入[{res['memory_level']}]: {content[:50]} | {category} | user={user}")
+        return res
+
+    async def write_many(self, items: list, user: str = "default") -> list:
+        """items: [{content, embedding, category, tags, memory_level}]，批内+库内MD5去重，一次插入"""
+        results = [None] * len(items)
+        first = {}
+        for i, it in enumerate(items):
+            doc_id = hashlib.md5(it["content"].encode()).hexdigest()
+            if doc_id in first:
+                results[i] = {"status": "duplicate", "message": "批内重复", "id": doc_id}
+            else:
+                first[doc_id] = i
+
+        existing = await self._existing_ids(list(first))
+
+        ts = now_ms()
+        rows = []
+        for doc_id, i in first.items():
+            if doc_id in existing:
+                results[i] = {"status": "exists", "message": "知识已存在", "id": doc_id}
+                continue
+            it = items[i]
+            level = it.get("memory_level") if it.get("memory_level") in LEVEL_ORDER else "flash"
+            tags = it.get("tags", [])
+            rows.append({
+                "id": doc_id, "embedding": it["embedding"], "content": it["content"],
+                "category": it.get("category", "通用"),
+                "tags": ",".join(tags) if isinstance(tags, list) else tags,
+                "timestamp": ts, "memory_level": level,
+                "recall_count": 0, "last_recall": ts, "user": user,
+            })
+            results[i] = {"status": "success", "message": "写入成功", "id": doc_id,
+                          "memory_level": level}
+
+        if rows:
+            await self._insert_rows(rows)
+            await self._flush(len(rows))
+            if any(r["memory_level"] == "permanent" for r in rows):
+                self.perm_cache.invalidate(user)
+            self.aggregates.on_write(user, rows)
+            self.anniversaries.on_write(user, rows)
+        if len(items) > 1:
+            logger.info(f"批量写入: {len(rows)}/{len(items)}条 | user={user}")
+        return results
+
+    async def _existing_ids(self, ids: list) -> set:
+        existing = set()
+        for i in range(0, len(ids), WRITE_CHUNK):
+            chunk = ids[i:i + WRITE_CHUNK]
+            existing.update(r["id"] for r in await self._query_ids(chunk, ["id"]))
+        return existing
+
+    async def import_rows(self, rows: list) -> tuple:
+        """导入整行（保留时间戳/召回数/层级/user），跳过库内及批内已有id，返回 (新增, 已存在)"""
+        existing = await self._existing_ids(list({r["id"] for r in rows}))
+        new, seen = [], set()
+        for r in rows:
+            if r["id"] in existing or r["id"] in seen:
+                continue
+            seen.add(r["id"])
+            new.append(r)
+        if new:
+            await self._insert_rows(new)
+            await self._flush(len(new))
+            for user in {r["user"] for r in new}:
+                self.perm_cache.invalidate(user)
+                self.aggregates.invalidate(user)
+                self.anniversaries.on_write(user, [r for r in new if r["user"] == user])
+        return len(new), len(rows) - len(new)
+
+    async def update(self, doc_id: str, content: str, embedding: list,
+                     category: str, tags: list) -> Optional[dict]:
+        r = await self.get_by_id(doc_id)
+        if not r:
+            return None
+        row = {
+            "id": doc_id, "embedding": embedding, "content": content,
+            "category": category,
+            "tags": ",".join(tags) if isinstance(tags, list) else tags,
+            "timestamp": r.get("timestamp", now_ms()),
+            "memory_level": r.get("memory_level", "flash"),
+            "recall_count": r.get("recall_count", 0),
+            "last_recall": r.get("last_recall", now_ms()),
+            "user": r.get("user", "default"),
+        }
+        await self._upsert_rows([row], partial=False)
+        await self._flush(1)
+        if r.get("memory_level") == "permanent":
+            self.perm_cache.invalidate(r.get("user", "default"))
+        self.aggregates.on_update(r, row)
+        self.anniversaries.on_update(r, row)
+        logger.info(f"更新: {doc_id}")
+        return {"message": "更新成功", "id": doc_id}
+
+    async def set_level(self, doc_id: str, level: str) -> Optional[dict]:
+        if not await self.set_level_many([doc_id], level):
+            return None
+        return {"message": f"已设为 {level}", "id": doc_id}
+
+    async def set_level_many(self, doc_ids: list, level: str) -> list:
+        if level not in LEVEL_ORDER or not doc_ids:
+            return []
+        current = await self._query_ids(doc_ids, ["id", "user", "memory_level"])
+        ts = now_ms()
+        await self._update_fields([
+            {"id": r["id"], "memory_level": level, "last_recall": ts} for r in current
+        ])
+        await self._flush(len(current))
+        for r in current:
+            if "permanent" in (level, r.get("memory_level")):
+                self.perm_cache.invalidate(r.get("user", "default"))
+            self.aggregates.on_level(r.get("user", "default"), r["id"],
+                                     r.get("memory_level", "flash"), level)
+            logger.info(f"层级变更: {r['id']} -> {level}")
+        return [r["id"] for r in current]
+
+    async def do_recall(self, doc_id: str, count: int = 1,
+                        last_recall: Optional[int] = None) -> None:
+        await self.apply_recalls({doc_id: (count, last_recall)})
+
+    async def apply_recalls(self, updates: dict) -> None:
+        """updates: doc_id -> (召回次数, 最近召回时间)，一次查询 + 一次upsert"""
+        if not updates:
+            return
+        current = await self._query_ids(
+            list(updates), ["id", "user", "memory_level", "recall_count"]
+        )
+        ts = now_ms()
+        new_counts = [r.get("recall_count", 0) + updates[r["id"]][0] for r in current]
+        new_levels = upgrade_levels([r.get("memory_level", "flash") for r in current], new_counts)
+        rows = []
+        for r, new_count, new_level in zip(current, new_counts, new_levels):
+            old_level = r.get("memory_level", "flash")
+            rows.append({
+                "id": r["id"], "memory_level": new_level,
+                "recall_count": new_count, "last_recall": updates[r["id"]][1] or ts,
+            })
+            if new_level != old_level:
+                logger.info(f"记忆升级: {r['id']} {old_level} -> {new_level} (recall={new_count})")
+        await self._update_fields(rows)
+        for r, row in zip(current, rows):
+            if row["memory_level"] != r.get("memory_level", "flash"):
+                if row["memory_level"] == "permanent":
+                    self.perm_cache.invalidate(r.get("user", "default"))
+                self.aggregates.on_level(r.get("user", "default"), r["id"],
+                                         r.get("memory_level", "flash"), row["memory_level"])
+            elif row["memory_level"] == "permanent":
+                self.perm_cache.patch(r["id"], row)
+
+    async def delete(self, doc_id: str) -> bool:
+        rows = await self._query_ids([doc_id], AGG_FIELDS + ["user"])
+        await self._delete_ids([doc_id])
+        self.perm_cache.invalidate_id(doc_id)
+        for r in rows:
+            if r.get("memory_level") == "permanent":
+                self.perm_cache.invalidate(r.get("user", "default"))
+        self.aggregates.on_delete(rows)
+        for r in rows:
+            self.anniversaries.on_delete(r.get("user", "default"), [r["id"]])
+        logger.warning(f"删除: {doc_id}")
+        return True
+
+    # ── 统计：从内存聚合读，缺失/过期/标脏时回后端重建 ──
+
+    async def _aggregate(self, user: str) -> UserAggregate:
+        agg = self.aggregates.get(user)
+        if agg is None:
+            agg = await self._build_aggregate(user)
+        return agg
+
+    async def _build_aggregate(self, user: str) -> UserAggregate:
+        self.aggregates.begin_build(user)
+        agg = UserAggregate()
+        async for page in self.scan(self._user_expr(user), AGG_FIELDS):
+            for r in page:
+                agg.add(r)
+        if agg.recent:
+            contents = {r["id"]: r.get("content", "") for r in await self._query_ids(
+                [x["id"] for x in agg.recent], ["id", "content"]
+            )}
+            for x in agg.recent:
+                x["content"] = (contents.get(x["id"]) or "")[:80]
+        self.aggregates.finish_build(user, agg)
+        return agg
+
+    async def stats(self, user: str = "default") -> dict:
+        agg = await self._aggregate(user)
+        return {"total": agg.total, "collection": COLLECTION_NAME, **agg.stats()}
+
+    async def dashboard(self, user: str = "default") -> dict:
+        return (await self._aggregate(user)).dashboard()
+
+    async def cleanup(self, threshold: float, user: str = "default",
+                      dry_run: bool = False) -> dict:
+        """只取算衰减需要的四列，按页整列算retention，再按 id in [...] 分块删除"""
+        now = now_ms()
+        doomed = []
+        levels = {lv: 0 for lv in LEVEL_ORDER if lv != "permanent"}
+        async for page in self.scan(self._user_expr(user, 'memory_level != "permanent"'),
+                                    CLEANUP_FIELDS):
+            page_levels = [r.get("memory_level", "flash") for r in page]
+            ret = retention_array(
+                page_levels,
+                [r.get("last_recall", 0) for r in page],
+                [r.get("recall_count", 0) for r in page],
+                now,
+            )
+            for i in np.flatnonzero(ret < threshold):
+                doomed.append(page[i]["id"])
+                levels[page_levels[i]] = levels.get(page_levels[i], 0) + 1
+
+        if not dry_run:
+            for i in range(0, len(doomed), DELETE_CHUNK):
+                await self._delete_ids(doomed[i:i + DELETE_CHUNK])
+            if doomed:
+                self.aggregates.invalidate(user)
+                self.anniversaries.on_delete(user, doomed)
+        logger.info(
+            f"清理{'(预演)' if dry_run else ''}: {'命中' if dry_run else '删除'}{len(doomed)}条 | "
+            f"{levels} | 阈值{threshold} | user={user}"
+        )
+        return {
+            "deleted": 0 if dry_run else len(doomed), "matched": len(doomed),
+            "levels": levels, "dry_run": dry_run,
+        }
+
+    async def export_all(self, user: str = "default") -> list:
+        items = []
+        async for page in self.scan(self._user_expr(user), ALL_FIELDS):
+            items.extend(format_items(page))
+        return items
+
+    async def export_iter(self, user: str = "default",
+                          include_embedding: bool = False) -> AsyncIterator[dict]:
+        """逐条产出导出记录：format_item + 原始时间戳（导入时可无损还原），可选带向量"""
+        fields = ALL_FIELDS + ["embedding"] if include_embedding else ALL_FIELDS
+        async for page in self.scan(self._user_expr(user), fields):
+            for r, item in zip(page, format_items(page)):
+                item["timestamp"] = r.get("timestamp", 0)
+                item["last_recall"] = r.get("last_recall", item["timestamp"])
+                if include_embedding:
+                    item["embedding"] = [float(x) for x in r["embedding"]]
+                yield item
+
+    async def _search_groups(self, query_vecs: list, top_k: int, user: str) -> tuple:
+        """一次ANN调用带上全部查询向量，permanent只取一次。返回 (每个查询的结果, permanent原始行)"""
+        perm_raw = self.perm_cache.get(user)
+        if perm_raw is not None:
+            groups = await self._ann(query_vecs, top_k + len(perm_raw), user, "ann")
+            perm_ids = {r["id"] for r in perm_raw}
+        else:
+            # permanent 查询与 ANN 并发；超取一段余量，被permanent挤掉太多时再按实际数量补拉
+            limit = top_k + self.perm_margin
+            perm_raw, groups = await asyncio.gather(
+                self._load_permanent(user), self._ann(query_vecs, limit, user, "ann")
+            )
+            perm_ids = {r["id"] for r in perm_raw}
+            short = [i for i, hits in enumerate(groups)
+                     if len(hits) >= limit and sum(h[0] not in perm_ids for h in hits) < top_k]
+            if short:
+                refetched = await self._ann(
+                    [query_vecs[i] for i in short], top_k + len(perm_raw), user, "ann_refetch"
+                )
+                for i, hits in zip(short, refetched):
+                    groups[i] = hits
+        with span("rerank", hits=sum(len(h) for h in groups)):
+            return [self._rerank(hits, perm_ids, top_k) for hits in groups], perm_raw
+
+    async def _ann(self, query_vecs: list, limit: int, user: str, phase: str) -> list:
+        with span(phase, queries=len(query_vecs), limit=limit):
+            return await self._ann_search_many(query_vecs, limit, user)
+
+    async def search(self, query_vec: list, top_k: int,
+                     user: str = "default", update_recall: bool = True) -> dict:
+        (output,), perm_raw = await self._search_groups([query_vec], top_k, user)
+        permanent = format_items(perm_raw)
+
+        if update_recall:
+            with span("recall"):
+                await self._record_recalls([it["id"] for it in output] + [r["id"] for r in perm_raw])
+
+        logger.info(
+            f"搜索: top_k={top_k} | 结果:{len(output)} | "
+            f"permanent:{len(permanent)} | user={user}"
+        )
+        return {"results": output, "permanent": permanent}
+
+    async def search_many(self, query_vecs: list, top_k: int,
+                          user: str = "default", update_recall: bool = True) -> dict:
+        """多个查询一次检索：results 与 query_vecs 一一对应，permanent 只返回一份，召回按id去重"""
+        if not query_vecs:
+            return {"results": [], "permanent": []}
+        groups, perm_raw = await self._search_groups(query_vecs, top_k, user)
+        permanent = format_items(perm_raw)
+
+        if update_recall:
+            ids = dict.fromkeys(it["id"] for output in groups for it in output)
+            ids.update(dict.fromkeys(r["id"] for r in perm_raw))
+            with span("recall", ids=len(ids)):
+                await self._record_recalls(list(ids))
+
+        logger.info(
+            f"批量搜索: {len(query_vecs)}个查询 | top_k={top_k} | "
+            f"结果:{sum(len(g) for g in groups)} | permanent:{len(permanent)} | user={user}"
+        )
+        return {"results": groups, "permanent": permanent}
+
+    def _rerank(self, hits: list, perm_ids: set, top_k: int) -> list:
+        """hits: [(id, entity, similarity)]。剔除permanent后整列算 retention / 最终得分，取前top_k"""
+        hits = [h for h in hits if h[0] not in perm_ids]
+        if not hits:
+            return []
+        ents = [h[1] for h in hits]
+        ret = retention_array(*row_columns(ents))
+        final = final_scores([h[2] for h in hits], ret)
+        output = []
+        for i in np.argsort(-final, kind="stable")[:top_k]:
+            doc_id, e, sim = hits[i]
+            output.append({
+                "id": doc_id, "content": e.get("content"),
+                "category": e.get("category"),
+                "tags": e.get("tags", "").split(","),
+                "similarity": round(sim * 100, 2),
+                "time": datetime.fromtimestamp(
+                    e.get("timestamp", 0) / 1000, tz=TZ_CN
+                ).strftime("%Y-%m-%d %H:%M"),
+                "memory_level": e.get("memory_level", "flash"),
+                "recall_count": e.get("recall_count", 0) + 1,
+                "retention": round(float(ret[i]) * 100, 2),
+            })
+        return output
+
+    async def _record_recalls(self, doc_ids: list) -> None:
+        RECALLS_QUEUED.inc(len(doc_ids))
+        if self.recall_queue is not None:
+            await self.recall_queue.put(doc_ids)
+            return
+        updates = {}
+        for doc_id in doc_ids:
+            updates[doc_id] = (updates.get(doc_id, (0, None))[0] + 1, None)
+        try:
+            await self.apply_recalls(updates)
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        if self.recall_queue is not None:
+            await self.recall_queue.stop()
 
-    def __init__(self, uri: str, token: str):
+
+class ZillizMemoryStore(MemoryStore):
+    """flush_policy:
+      immediate  — 每次写入后 collection.flush()（旧行为）
+      none       — 不显式flush，靠 consistency_level 保证读到自己的写入
+      background — 后台按 flush_interval 秒或累计 flush_rows 行合并flush
+    consistency_level 不传时：immediate 沿用collection默认，其余用 Session
+    """
+
+    def __init__(self, uri: str, token: str, partial_update: bool = True,
+                 flush_policy: str = "immediate", flush_interval: float = 10.0,
+                 flush_rows: int = 1000, consistency_level: Optional[str] = None):
+        super().__init__(partial_update)
         self.uri = uri
         self.token = token
         self.collection: Optional[Collection] = None
+        if flush_policy not in FLUSH_POLICIES:
+            raise ValueError(f"flush_policy 可选: {FLUSH_POLICIES}")
+        self.flush_policy = flush_policy
+        self.flush_interval = flush_interval
+        self.flush_rows = max(1, flush_rows)
+        if consistency_level is None and flush_policy != "immediate":
+            consistency_level = "Session"
+        self._read_kw = {"consistency_level": consistency_level} if consistency_level else {}
+        self._dirty_rows = 0
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
 
     async def connect(self) -> None:
         connections.connect(alias="default", uri=self.uri, token=self.token)
@@ -111,42 +559,39 @@ class ZillizMemoryStore(MemoryStore):
         self._create_collection()
 
     async def _migrate_add_user(self, old_col: Collection):
+        """流式把旧collection逐页拷进临时collection，拷完删旧表再改名，内存只占一页"""
         old_col.load()
-        all_data = old_col.query(
-            expr='id != ""',
-            output_fields=[
-                "id", "embedding", "content", "category", "tags",
-                "timestamp", "memory_level", "recall_count", "last_recall"
-            ],
-            limit=16384
-        )
-        count = len(all_data)
-        logger.info(f"导出 {count} 条记录用于迁移")
+        tmp_name = f"{COLLECTION_NAME}_migrating"
+        if utility.has_collection(tmp_name):
+            utility.drop_collection(tmp_name)
+        self._create_collection(tmp_name)
+
+        count = 0
+        async for batch in self._iter_pages(old_col, 'id != ""', [
+            "id", "embedding", "content", "category", "tags",
+            "timestamp", "memory_level", "recall_count", "last_recall"
+        ]):
+            await self._insert_rows([{
+                "id": r["id"], "embedding": r["embedding"],
+                "content": r["content"], "category": r["category"],
+                "tags": r.get("tags", ""),
+                "timestamp": r.get("timestamp", now_ms()),
+                "memory_level": r.get("memory_level", "flash"),
+                "recall_count": r.get("recall_count", 0),
+                "last_recall": r.get("last_recall", now_ms()),
+                "user": "default",
+            } for r in batch])
+            count += len(batch)
+        # 删旧表前必须落盘，不走flush策略
+        self.collection.flush()
 
         utility.drop_collection(COLLECTION_NAME)
-        self._create_collection()
-
-        if all_data:
-            batch_size = 100
-            for i in range(0, count, batch_size):
-                batch = all_data[i:i + batch_size]
-                data = [
-                    [r["id"] for r in batch],
-                    [r["embedding"] for r in batch],
-                    [r["content"] for r in batch],
-                    [r["category"] for r in batch],
-                    [r.get("tags", "") for r in batch],
-                    [r.get("timestamp", now_ms()) for r in batch],
-                    [r.get("memory_level", "flash") for r in batch],
-                    [r.get("recall_count", 0) for r in batch],
-                    [r.get("last_recall", now_ms()) for r in batch],
-                    ["default" for _ in batch],
-                ]
-                self.collection.insert(data)
-            self.collection.flush()
+        utility.rename_collection(tmp_name, COLLECTION_NAME)
+        self.collection = Collection(COLLECTION_NAME)
+        self.collection.load()
         logger.info(f"迁移完成: {count} 条 -> user=default")
 
-    def _create_collection(self):
+    def _create_collection(self, name: str = COLLECTION_NAME):
         fields = [
             FieldSchema(name="id", dtype=DataType.VARCHAR, is_primary=True, max_length=64),
             FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBEDDING_DIM),
@@ -160,7 +605,7 @@ class ZillizMemoryStore(MemoryStore):
             FieldSchema(name="user", dtype=DataType.VARCHAR, max_length=64),
         ]
         schema = CollectionSchema(fields=fields)
-        self.collection = Collection(name=COLLECTION_NAME, schema=schema)
+        self.collection = Collection(name=name, schema=schema)
         self.collection.create_index(
             field_name="embedding",
             index_params={"metric_type": "COSINE", "index_type": "AUTOINDEX", "params": {}}
@@ -168,290 +613,139 @@ class ZillizMemoryStore(MemoryStore):
         self.collection.load()
         logger.info("新collection已创建（含user字段）")
 
-    def _user_expr(self, user: str, extra: str = "") -> str:
-        base = f'user == "{user}"'
-        return f"{base} and {extra}" if extra else base
-
-    def _insert_one(self, rec: dict):
-        data = [
-            [rec["id"]], [rec["embedding"]], [rec["content"]],
-            [rec["category"]], [rec["tags"]], [rec["timestamp"]],
-            [rec["memory_level"]], [rec["recall_count"]],
-            [rec["last_recall"]], [rec["user"]],
-        ]
-        self.collection.insert(data)
-
-    def _get_with_embedding(self, doc_id: str) -> Optional[dict]:
-        results = self.collection.query(
-            expr=f'id == "{doc_id}"',
-            output_fields=ALL_FIELDS + ["embedding"],
-            limit=1
+    async def _query_ids(self, ids, fields):
+        return await asyncio.to_thread(
+            self.collection.query,
+            expr=ids_expr(ids), output_fields=fields, limit=len(ids), **self._read_kw
         )
-        return results[0] if results else None
 
-    async def write(self, content, embedding, category, tags, memory_level, user="default"):
-        doc_id = hashlib.md5(content.encode()).hexdigest()
-        if self.collection.query(expr=f'id == "{doc_id}"', output_fields=["id"], limit=1):
-            return {"status": "exists", "message": "知识已存在"}
+    async def _upsert_rows(self, rows, partial):
+        await asyncio.to_thread(self.collection.upsert, rows, partial_update=partial)
 
-        level = memory_level if memory_level in LEVEL_ORDER else "flash"
-        ts = now_ms()
-        self._insert_one({
-            "id": doc_id, "embedding": embedding, "content": content,
-            "category": category,
-            "tags": ",".join(tags) if isinstance(tags, list) else tags,
-            "timestamp": ts, "memory_level": level,
-            "recall_count": 0, "last_recall": ts, "user": user,
-        })
-        self.collection.flush()
-        logger.info(f"写入[{level}]: {content[:50]} | {category} | user={user}")
-        return {"status": "success", "message": "写入成功", "id": doc_id}
+    async def _delete_ids(self, ids):
+        await asyncio.to_thread(self.collection.delete, expr=ids_expr(ids))
 
-    async def search(self, query_vec, top_k, user="default", update_recall=True):
-        perm_expr = self._user_expr(user, 'memory_level == "permanent"')
-        perm_raw = self.collection.query(expr=perm_expr, output_fields=ALL_FIELDS, limit=100)
-        permanent = [format_item(r) for r in perm_raw]
-        perm_ids = {r["id"] for r in perm_raw}
+    async def _insert_rows(self, rows):
+        data = [
+            [r["id"] for r in rows], [r["embedding"] for r in rows],
+            [r["content"] for r in rows], [r["category"] for r in rows],
+            [r["tags"] for r in rows], [r["timestamp"] for r in rows],
+            [r["memory_level"] for r in rows], [r["recall_count"] for r in rows],
+            [r["last_recall"] for r in rows], [r["user"] for r in rows],
+        ]
+        await asyncio.to_thread(self.collection.insert, data)
+
+    async def _flush(self, rows=1):
+        if self.flush_policy == "immediate":
+            await asyncio.to_thread(self.collection.flush)
+        elif self.flush_policy == "background":
+            self._dirty_rows += rows
+            if self._flusher is None or self._flusher.done():
+                self._flush_wakeup = asyncio.Event()
+                self._flusher = asyncio.create_task(self._flush_loop())
+            if self._dirty_rows >= self.flush_rows:
+                self._flush_wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await asyncio.shield(self._flush_dirty())
+
+    async def _flush_dirty(self):
+        if not self._dirty_rows:
+            return
+        n, self._dirty_rows = self._dirty_rows, 0
+        try:
+            await asyncio.to_thread(self.collection.flush)
+        except Exception as e:
+            self._dirty_rows += n
+            logger.warning(f"后台flush失败: {e}")
+
+    async def close(self):
+        await super().close()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self._flush_dirty()
+
+    async def scan(self, expr, fields, page_size=None):
+        async for page in self._iter_pages(self.collection, expr, fields, page_size):
+            yield page
+
+    async def _iter_pages(self, col: Collection, expr, fields, page_size=None):
+        it = col.query_iterator(
+            batch_size=page_size or self.scan_page_size,
+            expr=expr, output_fields=fields, **self._read_kw
+        )
+        try:
+            while True:
+                page = await asyncio.to_thread(it.next)
+                if not page:
+                    break
+                yield page
+        finally:
+            it.close()
+
+    async def _query_permanent(self, user):
+        return await asyncio.to_thread(
+            self.collection.query,
+            expr=self._user_expr(user, 'memory_level == "permanent"'),
+            output_fields=ALL_FIELDS, limit=100,
+            **self._read_kw
+        )
 
-        hits_raw = self.collection.search(
-            data=[query_vec], anns_field="embedding",
+    async def _ann_search_many(self, query_vecs, limit, user):
+        hits_raw = await asyncio.to_thread(
+            self.collection.search,
+            data=list(query_vecs), anns_field="embedding",
             param={"metric_type": "COSINE"},
-            limit=top_k + len(perm_raw),
-            output_fields=[
-                "content", "category", "tags", "timestamp",
-                "memory_level", "recall_count", "last_recall", "user"
-            ],
+            limit=limit,
+            output_fields=SEARCH_FIELDS,
             expr=self._user_expr(user),
+            **self._read_kw,
         )
-
-        scored = []
-        for hits in hits_raw:
-            for hit in hits:
-                if hit.id in perm_ids:
-                    continue
-                level = hit.entity.get("memory_level", "flash")
-                lr = hit.entity.get("last_recall", hit.entity.get("timestamp", 0))
-                rc = hit.entity.get("recall_count", 0)
-                ret = calc_retention(level, lr, rc)
-                sim = hit.score
-                scored.append({
-                    "hit": hit,
-                    "final_score": sim * 0.7 + ret * 0.3,
-                    "retention": ret,
-                    "similarity": sim,
-                })
-
-        scored.sort(key=lambda x: x["final_score"], reverse=True)
-        scored = scored[:top_k]
-
-        if update_recall:
-            for it in scored:
-                try:
-                    await self.do_recall(it["hit"].id)
-                except Exception:
-                    pass
-            for r in perm_raw:
-                try:
-                    await self.do_recall(r["id"])
-                except Exception:
-                    pass
-
-        output = []
-        for it in scored:
-            h = it["hit"]
-            output.append({
-                "id": h.id,
-                "content": h.entity.get("content"),
-                "category": h.entity.get("category"),
-                "tags": h.entity.get("tags", "").split(","),
-                "similarity": round(it["similarity"] * 100, 2),
-                "time": datetime.fromtimestamp(
-                    h.entity.get("timestamp", 0) / 1000, tz=TZ_CN
-                ).strftime("%Y-%m-%d %H:%M"),
-                "memory_level": h.entity.get("memory_level", "flash"),
-                "recall_count": h.entity.get("recall_count", 0) + 1,
-                "retention": round(it["retention"] * 100, 2),
-            })
-
-        logger.info(
-            f"搜索: top_k={top_k} | 结果:{len(output)} | "
-            f"permanent:{len(permanent)} | user={user}"
-        )
-        return {"results": output, "permanent": permanent}
-
-    async def delete(self, doc_id):
-        self.collection.delete(expr=f'id == "{doc_id}"')
-        logger.warning(f"删除: {doc_id}")
-        return True
-
-    async def update(self, doc_id, content, embedding, category, tags):
-        r = await self.get_by_id(doc_id)
-        if not r:
-            return None
-        self.collection.delete(expr=f'id == "{doc_id}"')
-        self._insert_one({
-            "id": doc_id, "embedding": embedding, "content": content,
-            "category": category,
-            "tags": ",".join(tags) if isinstance(tags, list) else tags,
-            "timestamp": r.get("timestamp", now_ms()),
-            "memory_level": r.get("memory_level", "flash"),
-            "recall_count": r.get("recall_count", 0),
-            "last_recall": r.get("last_recall", now_ms()),
-            "user": r.get("user", "default"),
-        })
-        self.collection.flush()
-        logger.info(f"更新: {doc_id}")
-        return {"message": "更新成功", "id": doc_id}
+        return [[
+            (hit.id, {f: hit.entity.get(f) for f in SEARCH_FIELDS
+                      if hit.entity.get(f) is not None}, hit.score)
+            for hit in hits
+        ] for hits in hits_raw]
 
     async def get_by_id(self, doc_id):
-        results = self.collection.query(
-            expr=f'id == "{doc_id}"', output_fields=ALL_FIELDS, limit=1
+        results = await asyncio.to_thread(
+            self.collection.query,
+            expr=f'id == "{doc_id}"', output_fields=ALL_FIELDS, limit=1,
+            **self._read_kw
         )
         return results[0] if results else None
 
     async def list_all(self, limit, offset, user="default"):
-        results = self.collection.query(
+        results = await asyncio.to_thread(
+            self.collection.query,
             expr=self._user_expr(user),
-            output_fields=ALL_FIELDS, limit=limit, offset=offset
+            output_fields=ALL_FIELDS, limit=limit, offset=offset,
+            **self._read_kw
         )
         return {
-            "results": [format_item(r) for r in results],
-            "total": self.collection.num_entities
+            "results": format_items(results),
+            "total": await self.count()
         }
 
-    async def set_level(self, doc_id, level):
-        if level not in LEVEL_ORDER:
-            return None
-        r = self._get_with_embedding(doc_id)
-        if not r:
-            return None
-        self.collection.delete(expr=f'id == "{doc_id}"')
-        self._insert_one({
-            "id": r["id"], "embedding": r["embedding"],
-            "content": r["content"], "category": r["category"],
-            "tags": r["tags"], "timestamp": r["timestamp"],
-            "memory_level": level,
-            "recall_count": r.get("recall_count", 0),
-            "last_recall": now_ms(),
-            "user": r.get("user", "default"),
-        })
-        self.collection.flush()
-        logger.info(f"层级变更: {doc_id} -> {level}")
-        return {"message": f"已设为 {level}", "id": doc_id}
-
-    async def do_recall(self, doc_id):
-        r = self._get_with_embedding(doc_id)
-        if not r:
-            return
-        old_level = r.get("memory_level", "flash")
-        new_count = r.get("recall_count", 0) + 1
-        new_level = check_upgrade(old_level, new_count)
-
-        self.collection.delete(expr=f'id == "{doc_id}"')
-        self._insert_one({
-            "id": r["id"], "embedding": r["embedding"],
-            "content": r["content"], "category": r["category"],
-            "tags": r["tags"], "timestamp": r["timestamp"],
-            "memory_level": new_level, "recall_count": new_count,
-            "last_recall": now_ms(), "user": r.get("user", "default"),
-        })
-        if new_level != old_level:
-            logger.info(f"记忆升级: {doc_id} {old_level} -> {new_level} (recall={new_count})")
-
-    async def cleanup(self, threshold, user="default"):
-        expr = self._user_expr(user, 'memory_level != "permanent"')
-        all_data = self.collection.query(expr=expr, output_fields=ALL_FIELDS, limit=16384)
-        to_delete = [
-            r["id"] for r in all_data
-            if calc_retention(
-                r.get("memory_level", "flash"),
-                r.get("last_recall", r.get("timestamp", 0)),
-                r.get("recall_count", 0)
-            ) < threshold
-        ]
-        for doc_id in to_delete:
-            self.collection.delete(expr=f'id == "{doc_id}"')
-        logger.info(f"清理: 删除{len(to_delete)}条 | 阈值{threshold} | user={user}")
-        return len(to_delete)
-
-    async def stats(self, user="default"):
-        expr = self._user_expr(user)
-        all_data = self.collection.query(
-            expr=expr,
-            output_fields=["memory_level", "content", "category", "timestamp"],
-            limit=16384
-        )
-        levels = {"flash": 0, "short": 0, "long": 0, "permanent": 0}
-        now = datetime.now(TZ_CN)
-        trend = {(now - timedelta(days=i)).strftime("%m-%d"): 0 for i in range(6, -1, -1)}
-
-        for r in all_data:
-            lv = r.get("memory_level", "flash")
-            levels[lv] = levels.get(lv, 0) + 1
-            ts = r.get("timestamp", 0)
-            if ts:
-                key = datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%m-%d")
-                if key in trend:
-                    trend[key] += 1
-
-        sorted_data = sorted(all_data, key=lambda x: x.get("timestamp", 0), reverse=True)[:10]
-        recent = [{
-            "category": r.get("category", ""),
-            "content": r.get("content", "")[:80],
-            "time": datetime.fromtimestamp(
-                r.get("timestamp", 0) / 1000, tz=TZ_CN
-            ).strftime("%m-%d %H:%M") if r.get("timestamp") else ""
-        } for r in sorted_data]
-
-        return {
-            "total": len(all_data), "collection": COLLECTION_NAME,
-            "levels": levels, "trend": trend, "recent": recent,
-        }
-
-    async def dashboard(self, user="default"):
-        expr = self._user_expr(user)
-        all_data = self.collection.query(expr=expr, output_fields=ALL_FIELDS, limit=16384)
-
-        levels = {"flash": 0, "short": 0, "long": 0, "permanent": 0}
-        cat_count = {}
-        now = datetime.now(TZ_CN)
-        trend = {(now - timedelta(days=i)).strftime("%m-%d"): 0 for i in range(6, -1, -1)}
-
-        for item in all_data:
-            lv = item.get("memory_level", "flash")
-            levels[lv] = levels.get(lv, 0) + 1
-            cat = item.get("category", "未分类")
-            cat_count[cat] = cat_count.get(cat, 0) + 1
-            ts = item.get("timestamp", 0)
-            if ts:
-                key = datetime.fromtimestamp(ts / 1000, tz=TZ_CN).strftime("%m-%d")
-                if key in trend:
-                    trend[key] += 1
-
-        sorted_data = sorted(all_data, key=lambda x: x.get("timestamp", 0), reverse=True)
-        recent = [{
-            "id": r.get("id"),
-            "content": r.get("content", "")[:80],
-            "category": r.get("category"),
-            "memory_level": r.get("memory_level", "flash"),
-            "time": datetime.fromtimestamp(
-                r.get("timestamp", 0) / 1000, tz=TZ_CN
-            ).strftime("%m-%d %H:%M"),
-        } for r in sorted_data[:10]]
-
-        return {
-            "total": len(all_data), "levels": levels,
-            "categories": cat_count, "trend": trend, "recent": recent,
-        }
-
-    async def export_all(self, user="default"):
-        expr = self._user_expr(user)
-        all_data = self.collection.query(expr=expr, output_fields=ALL_FIELDS, limit=16384)
-        return [format_item(r) for r in all_data]
-
     async def count(self):
-        return self.collection.num_entities if self.collection else 0
+        if self.collection is None:
+            return 0
+        return await asyncio.to_thread(lambda: self.collection.num_entities)
 
     async def query_by_category(self, category, fields, limit, user="default"):
         expr = self._user_expr(user, f'category == "{category}"')
-        return self.collection.query(expr=expr, output_fields=fields, limit=limit)
+        return await asyncio.to_thread(
+            self.collection.query,
+            expr=expr, output_fields=fields, limit=limit, **self._read_kw
+        )
@@ -0,0 +1,118 @@
+"""HttpMemoryStore 对接参考桩：向量传输格式协商、全表翻页方式"""
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+
+import milvus_api_stub as stub
+from http_store import HttpMemoryStore, ScanWindowExceeded
+from store import COLLECTION_NAME
+
+pytest.importorskip("msgpack")
+
+
+def _vec(i):
+    v = np.zeros(384, dtype=np.float32)
+    v[i % 384] = 1.0
+    v[(i + 1) % 384] = 0.5
+    return v.tolist()
+
+
+@pytest.fixture(autouse=True)
+def _fresh_stub(monkeypatch):
+    stub.collections.clear()
+    monkeypatch.setattr(stub, "ORDERED_QUERY", True)
+    yield
+    stub.collections.clear()
+
+
+async def _store(**kw) -> HttpMemoryStore:
+    s = HttpMemoryStore("http://stub", "", http2=False, **kw)
+    await s.client.aclose()
+    s.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub.app))
+    await s.connect()
+    return s
+
+
+def _seed(n: int):
+    col = stub.collections[COLLECTION_NAME]
+    col.db.executemany(
+        'INSERT INTO rows (id, "user", memory_level, timestamp, last_recall, recall_count) '
+        "VALUES (?, 'default', 'flash', 0, 0, 0)",
+        [(f"{i:06d}",) for i in range(n)],
+    )
+
+
+@pytest.mark.parametrize("fmt", ["json", "base64", "msgpack"])
+def test_wire_format_roundtrip(fmt):
+    async def main():
+        s = await _store(wire_format=fmt)
+        assert s.wire == fmt
+        res = await s.write_many([
+            {"content": f"doc {i}", "embedding": _vec(i), "category": "t"} for i in range(5)
+        ])
+        assert [r["status"] for r in res] == ["success"] * 5
+        found = await s.search(_vec(2), top_k=1, update_recall=False)
+        assert found["results"][0]["content"] == "doc 2"
+        exported = [it async for it in s.export_iter(include_embedding=True)]
+        assert len(exported) == 5
+        by_content = {it["content"]: it["embedding"] for it in exported}
+        assert np.allclose(by_content["doc 3"], _vec(3))
+        await s.close()
+
+    asyncio.run(main())
+
+
+def test_wire_format_falls_back_without_capability(monkeypatch):
+    monkeypatch.setattr(stub, "WIRE_FORMATS", ("json",))
+
+    async def main():
+        s = await _store(wire_format="msgpack")
+        assert s.wire == "json"
+        await s.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("mode", ["cursor", "offset"])
+def test_scan_reads_every_row(mode):
+    async def main():
+        s = await _store(scan_mode=mode)
+        _seed(2500)
+        pages = [p async for p in s.scan('user == "default"', ["id"], page_size=1000)]
+        ids = [r["id"] for p in pages for r in p]
+        assert [len(p) for p in pages] == [1000, 1000, 500]
+        assert sorted(ids) == [f"{i:06d}" for i in range(2500)]
+        await s.close()
+
+    asyncio.run(main())
+
+
+def test_cursor_scan_passes_query_window():
+    async def main():
+        s = await _store(scan_mode="cursor")
+        assert s.scan_mode == "cursor"
+        _seed(17000)
+        total = 0
+        async for page in s.scan('user == "default"', ["id"], page_size=4000):
+            total += len(page)
+        assert total == 17000
+        await s.close()
+
+    asyncio.run(main())
+
+
+def test_cursor_falls_back_to_offset_and_fails_past_window(monkeypatch):
+    monkeypatch.setattr(stub, "ORDERED_QUERY", False)
+
+    async def main():
+        s = await _store(scan_mode="cursor")
+        assert s.scan_mode == "offset"
+        _seed(17000)
+        with pytest.raises(ScanWindowExceeded):
+            async for _ in s.scan('user == "default"', ["id"], page_size=4000):
+                pass
+        await s.close()
+
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""流式导入：断点续传的进度记账、截断末行、gzip/JSON数组识别"""
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from importer import ImportJob, iter_records
+
+ROWS = 50
+
+
+class _Store:
+
+    def __init__(self):
+        self.rows = {}
+
+    async def import_rows(self, rows):
+        new = [r for r in rows if r["id"] not in self.rows]
+        for r in new:
+            self.rows[r["id"]] = r
+        return len(new), len(rows) - len(new)
+
+
+async def _encode(texts):
+    return [[0.0] * 384 for _ in texts]
+
+
+async def _chunks(data: bytes, size: int = 37):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def _ndjson(n: int = ROWS) -> bytes:
+    return b"".join((json.dumps({"content": f"row {i}"}) + "\n").encode() for i in range(n))
+
+
+def _run(store, data, **kw):
+    return asyncio.run(ImportJob().run(store, _encode, _chunks(data), batch_size=8, **kw))
+
+
+def test_complete_file():
+    store = _Store()
+    res = _run(store, _ndjson())
+    assert res["status"] == "done"
+    assert (res["records"], res["bytes"], res["inserted"]) == (ROWS, len(_ndjson()), ROWS)
+
+
+def test_final_record_without_newline():
+    data = _ndjson().rstrip(b"\n")
+    res = _run(_Store(), data)
+    assert res["status"] == "done"
+    assert (res["records"], res["bytes"], res["invalid"]) == (ROWS, len(data), 0)
+
+
+def test_truncated_final_line_does_not_advance():
+    data = _ndjson()
+    cut = len(data) - 10
+    res = _run(_Store(), data[:cut])
+    assert res["status"] == "interrupted"
+    assert res["invalid"] == 0
+    assert res["records"] < ROWS
+    # 进度停在已提交批次的末尾：正好是某一行的换行之后
+    assert data[res["bytes"] - 1:res["bytes"]] == b"\n"
+    assert data[:res["bytes"]].count(b"\n") == res["records"]
+
+
+def test_resume_with_byte_offset():
+    data = _ndjson()
+    store = _Store()
+    first = _run(store, data[:len(data) - 10])
+    res = _run(store, data[first["bytes"]:], skip=first["records"], byte_offset=first["bytes"])
+    assert res["status"] == "done"
+    assert (res["records"], res["bytes"]) == (ROWS, len(data))
+    assert len(store.rows) == ROWS
+
+
+def test_resume_with_skip():
+    data = _ndjson()
+    store = _Store()
+    first = _run(store, data[:len(data) - 10])
+    res = _run(store, data, skip=first["records"])
+    assert res["status"] == "done"
+    assert res["records"] == ROWS
+    assert res["exists"] == 0                   # 跳过的记录不会再被提交
+    assert len(store.rows) == ROWS
+
+
+def test_gzip_input():
+    store = _Store()
+    res = _run(store, gzip.compress(_ndjson()))
+    assert res["status"] == "done"
+    assert (res["records"], res["inserted"]) == (ROWS, ROWS)
+
+
+@pytest.mark.parametrize("wrap", [
+    lambda items: {"exported_at": "x", "total": len(items), "data": items},
+    lambda items: items,
+])
+def test_json_array_input(wrap):
+    items = [{"content": f"row {i}", "memory_level": "long", "recall_count": i} for i in range(ROWS)]
+    data = json.dumps(wrap(items), ensure_ascii=False, indent=2).encode()
+    store = _Store()
+    res = _run(store, data)
+    assert res["status"] == "done"
+    assert res["inserted"] == ROWS
+    assert {r["memory_level"] for r in store.rows.values()} == {"long"}
+
+
+def test_iter_records_offsets():
+    data = _ndjson(3)
+
+    async def collect():
+        return [end async for _, end in iter_records(_chunks(data, 5))]
+
+    ends = asyncio.run(collect())
+    assert ends == [i + 1 for i, b in enumerate(data) if b == ord("\n")]
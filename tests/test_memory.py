@@ -0,0 +1,69 @@
+"""memory 整列版本与逐行版本的一致性"""
+import random
+
+import numpy as np
+import pytest
+
+from memory import (
+    LEVEL_ORDER, calc_retention, retention_array, check_upgrade, upgrade_levels,
+    final_score, final_scores,
+)
+
+NOW = 1_760_000_000_000
+LEVELS = LEVEL_ORDER + ["unknown", ""]
+
+
+def _rows(n, seed=0):
+    rng = random.Random(seed)
+    levels = [rng.choice(LEVELS) for _ in range(n)]
+    # 含未来时间（时钟漂移/导入数据）与远古时间
+    last = [NOW + rng.randint(-90 * 24 * 3600_000, 24 * 3600_000) for _ in range(n)]
+    counts = [rng.choice([0, 0, 1, 3, 4, 9, 10, 50, rng.randint(0, 200)]) for _ in range(n)]
+    return levels, last, counts
+
+
+def test_retention_array_matches_scalar():
+    levels, last, counts = _rows(5000)
+    got = retention_array(levels, last, counts, now=NOW)
+    want = [calc_retention(lv, lr, rc, now=NOW) for lv, lr, rc in zip(levels, last, counts)]
+    assert got.tolist() == want
+
+
+@pytest.mark.parametrize("level", LEVELS)
+@pytest.mark.parametrize("offset_h", [-5, 0, 1, 24, 1000])
+@pytest.mark.parametrize("count", [0, 1, 10])
+def test_retention_edge_cases(level, offset_h, count):
+    last = NOW - offset_h * 3600_000
+    got = retention_array([level], [last], [count], now=NOW)
+    assert got.tolist() == [calc_retention(level, last, count, now=NOW)]
+
+
+def test_retention_permanent_and_future():
+    got = retention_array(["permanent", "flash"], [0, NOW + 3600_000], [0, 0], now=NOW)
+    assert got.tolist() == [1.0, 1.0]
+
+
+def test_upgrade_levels_matches_scalar():
+    levels, _, counts = _rows(5000, seed=1)
+    got = upgrade_levels(levels, counts)
+    assert list(got) == [check_upgrade(lv, rc) for lv, rc in zip(levels, counts)]
+
+
+@pytest.mark.parametrize("level", LEVELS)
+@pytest.mark.parametrize("count", [0, 1, 3, 4, 9, 10, 11])
+def test_upgrade_edge_cases(level, count):
+    assert list(upgrade_levels([level], [count])) == [check_upgrade(level, count)]
+
+
+def test_final_scores_matches_scalar():
+    rng = random.Random(2)
+    sims = [rng.random() for _ in range(1000)]
+    rets = [rng.random() for _ in range(1000)]
+    got = final_scores(sims, rets)
+    assert got.tolist() == [final_score(s, r) for s, r in zip(sims, rets)]
+
+
+def test_empty_input():
+    assert retention_array([], [], [], now=NOW).shape == (0,)
+    assert len(upgrade_levels([], [])) == 0
+    assert final_scores([], np.zeros(0)).shape == (0,)
@@ -0,0 +1,62 @@
+"""permanent缓存：载入期间发生失效时不回填旧结果"""
+import asyncio
+
+from local_store import LocalMemoryStore
+
+
+def _vec(i):
+    v = [0.0] * 384
+    v[i] = 1.0
+    return v
+
+
+def test_write_during_load_is_not_masked():
+    async def main():
+        store = LocalMemoryStore(":memory:")
+        await store.connect()
+        await store.write("old", _vec(0), "通用", [], "permanent")
+
+        gate = asyncio.Event()
+        query = store._query_permanent
+
+        async def slow_query(user):
+            rows = await query(user)
+            await gate.wait()
+            return rows
+
+        store._query_permanent = slow_query
+        stale = asyncio.ensure_future(store._permanent("default"))
+        await asyncio.sleep(0.01)
+        await store.write("new", _vec(1), "通用", [], "permanent")
+        fresh = asyncio.ensure_future(store._permanent("default"))
+        await asyncio.sleep(0.01)
+        gate.set()
+
+        assert [r["content"] for r in await stale] == ["old"]
+        assert sorted(r["content"] for r in await fresh) == ["new", "old"]
+        cached = store.perm_cache.get("default")
+        assert sorted(r["content"] for r in cached) == ["new", "old"]
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_concurrent_misses_share_one_query():
+    async def main():
+        store = LocalMemoryStore(":memory:")
+        await store.connect()
+        calls = 0
+        query = store._query_permanent
+
+        async def counted(user):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return await query(user)
+
+        store._query_permanent = counted
+        await asyncio.gather(*[store._permanent("default") for _ in range(4)])
+        assert calls == 1
+        await store.close()
+
+    asyncio.run(main())
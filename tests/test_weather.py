@@ -0,0 +1,84 @@
+"""天气：format_weather 与旧 mcp_weather 输出一致；WeatherService 缓存/合并/失败回退"""
+import asyncio
+
+import httpx
+import pytest
+
+from weather import StubProvider, WeatherService, WttrProvider, format_weather
+
+WTTR = {
+    "current_condition": [{
+        "temp_C": "21", "FeelsLikeC": "20", "humidity": "63",
+        "lang_zh": [{"value": "多云"}], "weatherDesc": [{"value": "Partly cloudy"}],
+        "windspeedKmph": "11", "winddir16Point": "NE",
+    }],
+    "weather": [{"maxtempC": "25", "mintempC": "16"}],
+}
+
+
+def _legacy(city: str, data: dict) -> str:
+    """改造前 mcp_weather 的拼接逻辑"""
+    current = data.get("current_condition", [{}])[0]
+    forecast = data.get("weather", [])
+    desc = current.get("lang_zh", [{}])[0].get("value", "")
+    result = f"🌡️ {city}: {current.get('temp_C')}°C（体感{current.get('FeelsLikeC')}°C）| {desc} | 湿度{current.get('humidity')}%"
+    if forecast:
+        today = forecast[0]
+        result += f" | 今日{today.get('mintempC')}~{today.get('maxtempC')}°C"
+    return result
+
+
+@pytest.mark.parametrize("payload", [WTTR, {**WTTR, "weather": []}])
+def test_wttr_format_matches_legacy(payload):
+    async def main():
+        p = WttrProvider()
+        await p.client.aclose()
+        p.client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda req: httpx.Response(200, json=payload)))
+        w = await p.fetch("天津")
+        await p.close()
+        return w
+
+    assert format_weather(asyncio.run(main())) == _legacy("天津", payload)
+
+
+def test_stub_through_formatter():
+    async def main():
+        return await WeatherService(StubProvider()).get("北京")
+
+    w = asyncio.run(main())
+    text = format_weather(w)
+    assert text.startswith(f"🌡️ 北京: {w['temp_C']}°C（体感{w['feels_like']}°C）| {w['desc']} | 湿度{w['humidity']}%")
+    assert text.endswith(f" | 今日{w['min_temp']}~{w['max_temp']}°C")
+
+
+def test_concurrent_requests_share_one_fetch():
+    async def main():
+        provider = StubProvider(delay=0.02)
+        svc = WeatherService(provider)
+        results = await asyncio.gather(*[svc.get("上海") for _ in range(20)])
+        assert provider.calls == 1
+        assert all(r == results[0] for r in results)
+        await svc.get("上海")
+        assert provider.calls == 1
+
+    asyncio.run(main())
+
+
+def test_failure_serves_old_data_and_caches_error():
+    async def main():
+        provider = StubProvider()
+        svc = WeatherService(provider, ttl=0, stale_ttl=0, error_ttl=60)
+        old = await svc.get("广州")
+        provider.fail = True
+        assert await svc.get("广州") == old
+        calls = provider.calls
+        assert await svc.get("广州") == old
+        assert provider.calls == calls          # error_ttl 内不再打上游
+        with pytest.raises(RuntimeError):
+            await svc.get("深圳")
+        with pytest.raises(RuntimeError):
+            await svc.get("深圳")
+        assert provider.calls == calls + 1
+
+    asyncio.run(main())
@@ -0,0 +1,337 @@
+"""TieredMemoryStore - 本地热层：活跃user的向量与标量镜像到进程内NumPy索引，读走本地、写穿透后端"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from aggregates import UserAggregate
+from memory import cosine_topk, format_items
+from store import MemoryStore, EMBEDDING_DIM, ALL_FIELDS
+
+logger = logging.getLogger("recalldoggy")
+
+ROW_OVERHEAD = 512          # 估算每行标量字段的内存（字节），content另算
+SYNC_OVERLAP_MS = 5000      # 增量同步水位回退，容忍时钟误差与最终一致性
+
+
+class _Tenant:
+    """一个user的镜像：rows[i] 的向量在 vecs[i]，删除时与末行交换"""
+
+    def __init__(self, user: str):
+        self.user = user
+        self.rows = []
+        self.pos: Dict[str, int] = {}
+        self.vecs = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.watermark = 0                  # 见过的 max(timestamp, last_recall)
+        self.touched: Optional[set] = set()  # 载入期间被写穿透改过/删过的id，扫描结果不再覆盖
+        self.text_bytes = 0
+        self.loaded_at = time.monotonic()
+        self.synced_at = self.loaded_at
+        self.last_access = self.loaded_at
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vecs.nbytes + self.norms.nbytes + len(self.rows) * ROW_OVERHEAD + self.text_bytes
+
+    def _grow(self, need: int):
+        if need <= len(self.vecs):
+            return
+        cap = max(need, len(self.vecs) * 2, 64)
+        vecs = np.zeros((cap, EMBEDDING_DIM), dtype=np.float32)
+        norms = np.zeros(cap, dtype=np.float32)
+        n = len(self.rows)
+        vecs[:n], norms[:n] = self.vecs[:n], self.norms[:n]
+        self.vecs, self.norms = vecs, norms
+
+    def _mark(self, r: dict):
+        self.watermark = max(self.watermark, r.get("timestamp") or 0, r.get("last_recall") or 0)
+
+    def upsert(self, r: dict):
+        """r 可以是整行也可以只含部分字段；带 embedding 时同步更新向量"""
+        vec = r.get("embedding")
+        fields = {k: v for k, v in r.items() if k != "embedding"}
+        i = self.pos.get(r["id"])
+        if i is None:
+            if vec is None:
+                return
+            i = len(self.rows)
+            self._grow(i + 1)
+            self.rows.append({})
+            self.pos[r["id"]] = i
+        row = self.rows[i]
+        self.text_bytes -= len(row.get("content") or "")
+        row.update(fields)
+        self.text_bytes += len(row.get("content") or "")
+        if vec is not None:
+            v = np.asarray(vec, dtype=np.float32)
+            self.vecs[i] = v
+            self.norms[i] = np.linalg.norm(v)
+        self._mark(row)
+
+    def remove(self, doc_id: str) -> bool:
+        i = self.pos.pop(doc_id, None)
+        if i is None:
+            return False
+        last = len(self.rows) - 1
+        self.text_bytes -= len(self.rows[i].get("content") or "")
+        if i != last:
+            self.rows[i] = self.rows[last]
+            self.vecs[i], self.norms[i] = self.vecs[last], self.norms[last]
+            self.pos[self.rows[i]["id"]] = i
+        self.rows.pop()
+        self.norms[last] = 0
+        return True
+
+
+class TieredMemoryStore(MemoryStore):
+    """包住任意 MemoryStore：后端仍是唯一数据源，本层只做读缓存。
+
+    budget_mb:        热层内存上限，超出时按LRU整user淘汰（当前访问的user总会保留）
+    sync_interval:    访问时距上次同步超过该秒数，按 timestamp/last_recall 增量拉取变更
+    full_resync:      超过该秒数整组重载一次，兜住其他写入方的删除
+    """
+
+    def __init__(self, backend: MemoryStore, budget_mb: float = 256,
+                 sync_interval: float = 30.0, full_resync: float = 3600.0):
+        super().__init__(backend.partial_update)
+        self.backend = backend
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.sync_interval = sync_interval
+        self.full_resync = full_resync
+        self._tenants: "OrderedDict[str, _Tenant]" = OrderedDict()
+        self._owner: Dict[str, str] = {}           # doc_id -> user（仅驻留的）
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._building: Dict[str, _Tenant] = {}
+        self._count: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+        self.evictions = 0
+
+    # ── 驻留 / 同步 / 淘汰 ─────────────────────────
+
+    async def _tenant(self, user: str) -> _Tenant:
+        t = self._tenants.get(user)
+        now = time.monotonic()
+        if t is not None and now - t.loaded_at > self.full_resync:
+            self._drop(user)
+            t = None
+        if t is None:
+            task = self._loading.get(user)
+            if task is None:
+                self.misses += 1
+                task = self._loading[user] = asyncio.ensure_future(self._load(user))
+                task.add_done_callback(lambda _: self._loading.pop(user, None))
+            t = await asyncio.shield(task)
+        else:
+            self.hits += 1
+            if now - t.synced_at > self.sync_interval:
+                await self._sync(t)
+        t.last_access = time.monotonic()
+        self._tenants.move_to_end(user)
+        return t
+
+    async def _load(self, user: str) -> _Tenant:
+        t = self._building[user] = _Tenant(user)
+        try:
+            async for page in self.scan(self._user_expr(user), ALL_FIELDS + ["embedding"]):
+                for r in page:
+                    if r["id"] not in t.touched:
+                        t.upsert(r)
+        finally:
+            self._building.pop(user, None)
+        t.touched = None
+        self._tenants[user] = t
+        for doc_id in t.pos:
+            self._owner[doc_id] = user
+        if self._count is None:
+            self._count = await self.backend.count()
+        self._evict(keep=user)
+        logger.info(f"热层载入: user={user} | {len(t)}条 | {t.nbytes / 1048576:.1f}MB")
+        return t
+
+    async def _sync(self, t: _Tenant):
+        since = max(0, t.watermark - SYNC_OVERLAP_MS)
+        expr = self._user_expr(t.user, f"(timestamp > {since} or last_recall > {since})")
+        changed = 0
+        async for page in self.scan(expr, ALL_FIELDS + ["embedding"]):
+            for r in page:
+                t.upsert(r)
+                self._owner[r["id"]] = t.user
+            changed += len(page)
+        t.synced_at = time.monotonic()
+        self._count = await self.backend.count()
+        self.syncs += 1
+        if changed:
+            self._evict(keep=t.user)
+
+    def _drop(self, user: str):
+        t = self._tenants.pop(user, None)
+        if t is not None:
+            for doc_id in t.pos:
+                self._owner.pop(doc_id, None)
+
+    def _evict(self, keep: str):
+        used = sum(t.nbytes for t in self._tenants.values())
+        for user in list(self._tenants):
+            if used <= self.budget:
+                break
+            if user == keep:
+                continue
+            used -= self._tenants[user].nbytes
+            self._drop(user)
+            self.evictions += 1
+            logger.info(f"热层淘汰: user={user}")
+
+    def _live(self, user: Optional[str]) -> Optional[_Tenant]:
+        t = self._tenants.get(user)
+        return t if t is not None else self._building.get(user)
+
+    def _resident(self, doc_id: str) -> Optional[_Tenant]:
+        user = self._owner.get(doc_id)
+        return self._live(user) if user is not None else None
+
+    @staticmethod
+    def _touch(t: _Tenant, doc_id: str):
+        if t.touched is not None:
+            t.touched.add(doc_id)
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        total = self.hits + self.misses
+        return {
+            "tenants": len(self._tenants),
+            "mb": round(sum(t.nbytes for t in self._tenants.values()) / 1048576, 2),
+            "budget_mb": round(self.budget / 1048576, 2),
+            "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "syncs": self.syncs, "evictions": self.evictions,
+            "users": [{
+                "user": t.user, "rows": len(t), "mb": round(t.nbytes / 1048576, 2),
+                "staleness": round(now - t.synced_at, 1), "idle": round(now - t.last_access, 1),
+            } for t in reversed(self._tenants.values())],
+        }
+
+    # ── 后端原语：写穿透，再同步本地镜像 ────────────
+
+    async def connect(self) -> None:
+        await self.backend.connect()
+
+    async def _flush(self, rows=1):
+        await self.backend._flush(rows)
+
+    async def close(self) -> None:
+        await super().close()
+        await self.backend.close()
+
+    async def _insert_rows(self, rows):
+        await self.backend._insert_rows(rows)
+        if self._count is not None:
+            self._count += len(rows)
+        for r in rows:
+            t = self._live(r.get("user", "default"))
+            if t is not None:
+                self._touch(t, r["id"])
+                t.upsert(r)
+                self._owner[r["id"]] = t.user
+
+    async def _upsert_rows(self, rows, partial):
+        await self.backend._upsert_rows(rows, partial)
+        for r in rows:
+            t = self._resident(r["id"])
+            if t is not None and r.get("user", t.user) != t.user:
+                self._touch(t, r["id"])
+                t.remove(r["id"])
+                self._owner.pop(r["id"], None)
+                t = None
+            if t is None:
+                t = self._live(r.get("user"))
+                if t is None:
+                    continue
+                self._owner[r["id"]] = t.user
+            t.upsert(r)
+            if r["id"] in t.pos:
+                self._touch(t, r["id"])
+            else:
+                self._owner.pop(r["id"], None)
+
+    async def _delete_ids(self, ids):
+        await self.backend._delete_ids(ids)
+        for doc_id in ids:
+            t = self._resident(doc_id)
+            if t is not None:
+                self._touch(t, doc_id)
+            if t is not None and t.remove(doc_id):
+                self._owner.pop(doc_id, None)
+                if self._count is not None:
+                    self._count -= 1
+
+    async def _query_ids(self, ids, fields):
+        """全部命中驻留user时本地作答，否则整批回后端"""
+        found = []
+        for doc_id in ids:
+            t = self._resident(doc_id)
+            if t is None:
+                return await self.backend._query_ids(ids, fields)
+            i = t.pos[doc_id]
+            row = {f: t.rows[i].get(f) for f in fields if f != "embedding"}
+            if "embedding" in fields:
+                row["embedding"] = t.vecs[i].tolist()
+            found.append(row)
+        return found
+
+    def scan(self, expr, fields, page_size=None):
+        return self.backend.scan(expr, fields, page_size or self.scan_page_size)
+
+    async def _query_permanent(self, user):
+        t = await self._tenant(user)
+        return [dict(r) for r in t.rows if r.get("memory_level") == "permanent"][:100]
+
+    # ── 读：走本地镜像 ─────────────────────────────
+
+    async def _ann_search_many(self, query_vecs, limit, user):
+        t = await self._tenant(user)
+        n = len(t)
+        groups = []
+        for vec in query_vecs:
+            top, sims = cosine_topk(t.vecs[:n], t.norms[:n], vec, limit)
+            groups.append([(t.rows[i]["id"], t.rows[i], float(sim)) for i, sim in zip(top, sims)])
+        return groups
+
+    async def get_by_id(self, doc_id):
+        t = self._resident(doc_id)
+        if t is not None:
+            return {f: t.rows[t.pos[doc_id]].get(f) for f in ALL_FIELDS}
+        return await self.backend.get_by_id(doc_id)
+
+    async def list_all(self, limit, offset, user="default"):
+        t = await self._tenant(user)
+        rows = [{f: r.get(f) for f in ALL_FIELDS} for r in t.rows[offset:offset + limit]]
+        return {"results": format_items(rows), "total": await self.count()}
+
+    async def count(self):
+        if self._count is None:
+            self._count = await self.backend.count()
+        return self._count
+
+    async def query_by_category(self, category, fields, limit, user="default"):
+        t = await self._tenant(user)
+        return [
+            {f: r.get(f) for f in fields} for r in t.rows if r.get("category") == category
+        ][:limit]
+
+    async def _build_aggregate(self, user):
+        t = await self._tenant(user)
+        self.aggregates.begin_build(user)
+        agg = UserAggregate()
+        for r in t.rows:
+            agg.add(r)
+        self.aggregates.finish_build(user, agg)
+        return agg
@@ -0,0 +1,165 @@
+"""请求追踪 - contextvar 传递当前trace，按阶段记录起止时间与后端调用次数，采样后进内存环形缓冲
+
+    with trace("POST /api/search", force=...) as t:   # 根：HTTP请求 / MCP工具调用
+        with span("rerank", hits=n):                  # 阶段：没有活动trace时是空操作
+            ...
+
+asyncio.gather 出来的子任务复制父上下文，所以并发阶段的span会落在同一个trace里、同一深度。
+"""
+import random
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+
+MAX_SPANS = 500             # 单个trace最多记多少个span（全表清理之类的长请求），超出只计数
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("recalldoggy_trace", default=None)
+_depth: ContextVar[int] = ContextVar("recalldoggy_span_depth", default=0)
+
+sample_rate = 0.01
+_ring: deque = deque(maxlen=200)
+
+
+class Trace:
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.spans = []
+        self.calls = Counter()      # 后端原语调用次数
+        self.dropped = 0
+        self.attrs = {}
+
+    def add(self, rec: dict):
+        if rec.pop("backend", False):
+            self.calls[rec["name"]] += 1
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append(rec)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "name": self.name, "started_at": round(self.started_at, 3),
+            "duration_ms": self.duration_ms, **self.attrs,
+            "calls": dict(self.calls), "dropped": self.dropped,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "rec", "start", "token")
+
+    def __init__(self, t: Trace, name: str, attrs: dict):
+        self.trace = t
+        self.rec = {"name": name, "depth": _depth.get(), **attrs}
+
+    def set(self, **attrs):
+        self.rec.update(attrs)
+
+    def __enter__(self):
+        self.token = _depth.set(self.rec["depth"] + 1)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _depth.reset(self.token)
+        self.rec["start_ms"] = round((self.start - self.trace.t0) * 1000, 3)
+        self.rec["dur_ms"] = round((end - self.start) * 1000, 3)
+        if exc_type is not None:
+            self.rec["error"] = exc_type.__name__
+        self.trace.add(self.rec)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+def span(name: str, **attrs):
+    """当前没有采样中的trace时直接返回共享的空对象，热路径上只多一次 ContextVar.get"""
+    t = _trace.get()
+    return _NULL if t is None else _Span(t, name, attrs)
+
+
+def current() -> Optional[Trace]:
+    return _trace.get()
+
+
+class trace:
+    """根span。已经在trace里（如HTTP请求里调MCP工具）时退化为普通span；
+    否则按 sample_rate 采样，force=True 必采"""
+
+    def __init__(self, name: str, force: bool = False):
+        self.name = name
+        self.force = force
+        self.trace: Optional[Trace] = None
+        self._inner = None
+        self._token = None
+
+    def __enter__(self) -> Optional[Trace]:
+        parent = _trace.get()
+        if parent is not None:
+            self._inner = _Span(parent, self.name, {}).__enter__()
+            return parent
+        if not self.force and (sample_rate <= 0 or random.random() >= sample_rate):
+            return None
+        self.trace = Trace(self.name)
+        self._token = _trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._inner is not None:
+            return self._inner.__exit__(exc_type, exc, tb)
+        if self.trace is None:
+            return False
+        _trace.reset(self._token)
+        t = self.trace
+        t.duration_ms = round((time.perf_counter() - t.t0) * 1000, 3)
+        if exc_type is not None:
+            t.attrs["error"] = exc_type.__name__
+        _ring.append(t)
+        return False
+
+
+def configure(rate: float, buffer: int):
+    global sample_rate, _ring
+    sample_rate = max(0.0, min(1.0, rate))
+    if buffer != _ring.maxlen:
+        _ring = deque(_ring, maxlen=max(1, buffer))
+
+
+def recent(limit: int = 50, min_ms: float = 0.0, name: str = "") -> list:
+    out = []
+    for t in reversed(_ring):
+        if (t.duration_ms or 0) < min_ms or (name and name not in t.name):
+            continue
+        out.append(t.to_dict())
+        if len(out) >= limit:
+            break
+    return out
+
+
+def get(trace_id: str) -> Optional[dict]:
+    for t in reversed(_ring):
+        if t.id == trace_id:
+            return t.to_dict()
+    return None
@@ -0,0 +1,167 @@
+"""天气服务 - 异步拉取 + 按城市TTL缓存，过期后先返回旧值再后台刷新，同城并发请求合并成一次"""
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Tuple
+from urllib.parse import quote
+
+import httpx
+
+logger = logging.getLogger("recalldoggy")
+
+
+class WeatherProvider(ABC):
+
+    @abstractmethod
+    async def fetch(self, city: str) -> dict:
+        """返回统一格式：city/temp_C/feels_like/humidity/desc/wind_speed/wind_dir/max_temp/min_temp"""
+
+    async def close(self) -> None:
+        pass
+
+
+class WttrProvider(WeatherProvider):
+
+    def __init__(self, timeout: float = 5.0):
+        self.client = httpx.AsyncClient(timeout=timeout, headers={"User-Agent": "RecallDoggy/1.5"})
+
+    async def fetch(self, city: str) -> dict:
+        r = await self.client.get(f"https://wttr.in/{quote(city)}?format=j1&lang=zh&m")
+        r.raise_for_status()
+        data = r.json()
+        current = data.get("current_condition", [{}])[0]
+        forecast = data.get("weather", [])
+        result = {
+            "city": city,
+            "temp_C": current.get("temp_C"),
+            "feels_like": current.get("FeelsLikeC"),
+            "humidity": current.get("humidity"),
+            "desc": current.get("lang_zh", [{}])[0].get("value", current.get("weatherDesc", [{}])[0].get("value", "")),
+            "wind_speed": current.get("windspeedKmph"),
+            "wind_dir": current.get("winddir16Point"),
+        }
+        if forecast:
+            today = forecast[0]
+            result["max_temp"] = today.get("maxtempC")
+            result["min_temp"] = today.get("mintempC")
+        return result
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class StubProvider(WeatherProvider):
+    """离线桩：按城市名确定性地生成数据，可模拟延迟与失败，供本地联调/测试"""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def fetch(self, city: str) -> dict:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("stub weather provider failure")
+        h = hashlib.md5(city.encode()).digest()
+        temp = h[0] % 35 - 5
+        return {
+            "city": city, "temp_C": str(temp), "feels_like": str(temp - h[1] % 4),
+            "humidity": str(30 + h[2] % 60), "desc": ["晴", "多云", "阴", "小雨"][h[3] % 4],
+            "wind_speed": str(h[4] % 30), "wind_dir": ["N", "E", "S", "W"][h[5] % 4],
+            "max_temp": str(temp + 4), "min_temp": str(temp - 4),
+        }
+
+
+PROVIDERS = {"wttr": WttrProvider, "stub": StubProvider}
+
+
+class WeatherService:
+    """ttl:        新鲜期，期内直接返回缓存
+    stale_ttl:  超过ttl但未超过stale_ttl时立即返回旧值并后台刷新；再老就同步等新数据
+    error_ttl:  拉取失败后这段时间内不再打上游：有旧值返回旧值，没有就返回同一个错误
+    max_cities: 缓存的城市数上限（LRU）
+    """
+
+    def __init__(self, provider: WeatherProvider, ttl: float = 600.0, stale_ttl: float = 3600.0,
+                 error_ttl: float = 30.0, max_cities: int = 256):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = max(ttl, stale_ttl)
+        self.error_ttl = error_ttl
+        self.max_cities = max(1, max_cities)
+        self._cache: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._errors: Dict[str, Tuple[Exception, float]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, city: str) -> dict:
+        city = city.strip()
+        now = time.monotonic()
+        entry = self._cache.get(city)
+        if entry is not None:
+            data, fetched_at = entry
+            age = now - fetched_at
+            if age < self.ttl:
+                self._cache.move_to_end(city)
+                return data
+            if age < self.stale_ttl:
+                self._cache.move_to_end(city)
+                self._refresh(city)
+                return data
+        err = self._errors.get(city)
+        if err is not None and now - err[1] < self.error_ttl:
+            if entry is not None:
+                return entry[0]
+            raise err[0]
+        try:
+            return await asyncio.shield(self._refresh(city))
+        except Exception:
+            # 上游挂了时，过了 stale_ttl 的旧数据也比报错强
+            if entry is not None:
+                return entry[0]
+            raise
+
+    def _refresh(self, city: str) -> asyncio.Task:
+        task = self._inflight.get(city)
+        if task is None:
+            task = self._inflight[city] = asyncio.ensure_future(self._fetch(city))
+            task.add_done_callback(lambda t: self._done(city, t))
+        return task
+
+    def _done(self, city: str, task: asyncio.Task):
+        self._inflight.pop(city, None)
+        # 后台刷新没人 await，这里取走异常，避免 "Task exception was never retrieved"
+        if not task.cancelled() and task.exception() is not None and city in self._cache:
+            logger.warning(f"天气后台刷新失败，继续用旧数据: {city} | {task.exception()}")
+
+    async def _fetch(self, city: str) -> dict:
+        try:
+            data = await self.provider.fetch(city)
+        except Exception as e:
+            now = time.monotonic()
+            if len(self._errors) >= self.max_cities:
+                self._errors = {c: v for c, v in self._errors.items() if now - v[1] < self.error_ttl}
+            self._errors[city] = (e, now)
+            raise
+        self._errors.pop(city, None)
+        self._cache[city] = (data, time.monotonic())
+        self._cache.move_to_end(city)
+        while len(self._cache) > self.max_cities:
+            self._cache.popitem(last=False)
+        return data
+
+    async def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await self.provider.close()
+
+
+def format_weather(w: dict) -> str:
+    result = f"🌡️ {w['city']}: {w.get('temp_C')}°C（体感{w.get('feels_like')}°C）| {w.get('desc')} | 湿度{w.get('humidity')}%"
+    if w.get("min_temp") is not None:
+        result += f" | 今日{w.get('min_temp')}~{w.get('max_temp')}°C"
+    return result
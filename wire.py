@@ -0,0 +1,63 @@
+"""向量传输格式 - Milvus API 客户端与参考服务端共用的向量编解码（json / base64 / msgpack）"""
+import base64
+import json
+from typing import Optional, Tuple
+
+import numpy as np
+
+WIRE_FORMATS = ("json", "base64", "msgpack")
+MSGPACK_TYPE = "application/msgpack"
+
+_F32 = np.dtype("<f4")
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:
+        raise RuntimeError("wire_format=msgpack 需要安装 msgpack") from e
+    return msgpack
+
+
+def encode_vec(vec, fmt: str):
+    """json: 浮点列表；base64: 小端float32的base64字符串；msgpack: 小端float32原始字节"""
+    if fmt == "json":
+        return vec.tolist() if isinstance(vec, np.ndarray) else vec
+    raw = np.asarray(vec, dtype=_F32).tobytes()
+    return raw if fmt == "msgpack" else base64.b64encode(raw).decode("ascii")
+
+
+def decode_vec(value):
+    """按值的类型还原：字节/base64字符串 -> float32数组，列表原样返回"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=_F32)
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=_F32)
+    return value
+
+
+def pack_rows(rows: list, fmt: str, field: str = "embedding") -> list:
+    if fmt == "json":
+        return rows
+    return [{**r, field: encode_vec(r[field], fmt)} if r.get(field) is not None else r
+            for r in rows]
+
+
+def unpack_rows(rows: list, field: str = "embedding") -> list:
+    for r in rows:
+        if field in r and r[field] is not None:
+            r[field] = decode_vec(r[field])
+    return rows
+
+
+def dumps(body: dict, fmt: str) -> Tuple[bytes, str]:
+    """请求/响应体序列化，返回 (字节, Content-Type)"""
+    if fmt == "msgpack":
+        return _msgpack().packb(body, use_bin_type=True), MSGPACK_TYPE
+    return json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json"
+
+
+def loads(content: bytes, content_type: Optional[str]) -> dict:
+    if content_type and content_type.startswith(MSGPACK_TYPE):
+        return _msgpack().unpackb(content, raw=False)
+    return json.loads(content) if content else {}